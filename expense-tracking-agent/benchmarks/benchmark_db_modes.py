@@ -0,0 +1,104 @@
+"""Compare the sync (psycopg2 + threadpool) and async (asyncpg) API modes.
+
+Starts the API once per mode against the database configured in .env and
+drives a mix of filtered GET /expenses reads and POST /expenses writes at a
+fixed concurrency. Run it against a scratch database, the expenses written
+by the benchmark are deleted again at the end of each run.
+
+    python -m benchmarks.benchmark_db_modes --concurrency 200 --requests 5000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+import httpx
+
+from benchmarks.utils import latency_summary, print_results_table, run_api_server
+
+
+async def drive_load(base_url: str, concurrency: int, total_requests: int, write_ratio: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        category_ids = [item["category_id"] for item in (await client.get("/categories")).json()]
+        payment_method_ids = [item["payment_method_id"] for item in (await client.get("/payment_methods")).json()]
+        if not category_ids or not payment_method_ids:
+            raise RuntimeError("Load categories and payment methods before running the benchmark")
+
+        read_latencies, write_latencies, errors, created_ids = [], [], 0, []
+        queue = asyncio.Queue()
+        for _ in range(total_requests):
+            queue.put_nowait("write" if random.random() < write_ratio else "read")
+
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                kind = queue.get_nowait()
+                start = time.perf_counter()
+                if kind == "write":
+                    response = await client.post("/expenses", json={
+                        "date": str(date.today() - timedelta(days=random.randint(0, 365))),
+                        "category_id": random.choice(category_ids),
+                        "description": "benchmark expense",
+                        "amount": "12.50",
+                        "vat": "2.50",
+                        "payment_method_id": random.choice(payment_method_ids),
+                        "business_personal": "business",
+                    })
+                    write_latencies.append(time.perf_counter() - start)
+                    if response.status_code == 200:
+                        created_ids.append(response.json()["transaction_id"])
+                else:
+                    response = await client.get("/expenses", params={
+                        "category_id": random.choice(category_ids),
+                        "start_date": str(date.today() - timedelta(days=30)),
+                    })
+                    read_latencies.append(time.perf_counter() - start)
+                # A filter without matches answers 404, which is a valid response here
+                if response.status_code not in (200, 404):
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        for transaction_id in created_ids:
+            await client.request("DELETE", "/expenses", json={"transaction_id": transaction_id})
+
+    return {
+        "throughput_rps": total_requests / elapsed,
+        "errors": errors,
+        "read": latency_summary(read_latencies),
+        "write": latency_summary(write_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    results = []
+    for mode in ("sync", "async"):
+        with run_api_server(args.port, env={"API_DB_MODE": mode}) as base_url:
+            stats = asyncio.run(drive_load(base_url, args.concurrency, args.requests, args.write_ratio))
+        results.append({
+            "mode": mode,
+            "throughput_rps": stats["throughput_rps"],
+            "errors": stats["errors"],
+            "read_p50_ms": stats["read"].get("p50_ms", 0.0),
+            "read_p99_ms": stats["read"].get("p99_ms", 0.0),
+            "write_p50_ms": stats["write"].get("p50_ms", 0.0),
+            "write_p99_ms": stats["write"].get("p99_ms", 0.0),
+        })
+
+    print_results_table(results, ["mode", "throughput_rps", "errors", "read_p50_ms", "read_p99_ms", "write_p50_ms", "write_p99_ms"])
+
+
+if __name__ == "__main__":
+    main()
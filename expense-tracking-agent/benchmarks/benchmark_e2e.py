@@ -0,0 +1,434 @@
+"""End to end benchmark of the API and the receipt pipeline on local stand-ins.
+
+Starts postgres, either a throwaway cluster (--database ephemeral) or the
+scratch database of .env (--database env). It then applies the migrations,
+loads the categories and payment methods of config.yml, and starts the API and
+benchmarks/stub_llm_server.py. Every scenario runs at --concurrency:
+- single_insert: POST /expenses
+- bulk_insert: POST /expenses/bulk with --bulk-size expenses
+- filtered_list: GET /expenses for one category in a 90 day window, one page of 100
+- aggregation: GET /expenses/summary by category and month
+- receipt_pipeline: generated receipt images through the async image_preprocessor,
+  json_parser, normalizer and categorizer nodes against the stub LLM, saved through the expenses
+  backend chosen with --expenses-backend (POST /expenses, or the database directly)
+
+Each scenario reports p50/p95/p99 latency, throughput, and the peak resident
+memory of the API and of this process, which runs the graph. The results go
+to --output as JSON with the commit and settings, so runs of different
+commits can be compared, and --baseline prints the change against an earlier
+file. The response cache is off unless --response-cache is given, so reads
+measure the database path.
+
+    python -m benchmarks.benchmark_e2e --database ephemeral --concurrency 32 --output results.json
+    python -m benchmarks.benchmark_e2e --database ephemeral --output new.json --baseline results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import httpx
+import psutil
+import yaml
+from PIL import Image, ImageDraw
+
+from benchmarks.benchmark_summary import generate_expenses_query
+from benchmarks.utils import (API_APP, latency_summary, print_results_table, run_ephemeral_postgres, run_stub_llm_server,
+                              run_uvicorn_process)
+
+BENCHMARK_DESCRIPTION = "benchmark e2e expense"
+CONFIG_FILE_PATH = "config.yml"
+SCENARIOS = ("single_insert", "bulk_insert", "filtered_list", "aggregation", "receipt_pipeline")
+RESULT_COLUMNS = ["scenario", "requests", "errors", "per_s", "items_per_s", "p50_ms", "p95_ms", "p99_ms",
+                  "api_rss_mb", "client_rss_mb"]
+
+
+class MemorySampler:
+    """Peak resident memory of processes and their children, sampled from a thread while the block runs"""
+
+    def __init__(self, processes: dict, interval: float = 0.05):
+        self.processes = processes
+        self.interval = interval
+        self.peak_bytes = {name: 0 for name in processes}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        for name, process in self.processes.items():
+            try:
+                rss = process.memory_info().rss + sum(child.memory_info().rss for child in process.children(recursive=True))
+            except psutil.NoSuchProcess:
+                continue
+            self.peak_bytes[name] = max(self.peak_bytes[name], rss)
+
+    def peak_mb(self, name: str) -> float:
+        return self.peak_bytes[name] / 1024 / 1024
+
+
+class Context:
+    """What the scenarios share: the API client, the lookup ids and the command line"""
+
+    def __init__(self, client: httpx.AsyncClient, category_ids: list, payment_method_ids: list, receipt_paths: list, args):
+        self.client = client
+        self.category_ids = category_ids
+        self.payment_method_ids = payment_method_ids
+        self.receipt_paths = receipt_paths
+        self.args = args
+        self.rng = random.Random(0)
+        self.details = {}
+
+
+def expense_payload(context: Context) -> dict:
+    rng = context.rng
+    amount = Decimal(rng.randint(100, 50000)).scaleb(-2)
+    return {
+        "date": str(date.today() - timedelta(days=rng.randint(0, 1095))),
+        "category_id": rng.choice(context.category_ids),
+        "description": BENCHMARK_DESCRIPTION,
+        "amount": str(amount),
+        "vat": str((amount * Decimal("0.21")).quantize(Decimal("0.01"))),
+        "payment_method_id": rng.choice(context.payment_method_ids),
+        "business_personal": rng.choice(("business", "personal")),
+    }
+
+
+def random_window_start(context: Context) -> date:
+    return date.today() - timedelta(days=context.rng.randint(90, 1095))
+
+
+def single_insert(context: Context):
+    async def request(index: int) -> bool:
+        response = await context.client.post("/expenses", json=expense_payload(context))
+        return response.status_code in (200, 201)
+    return request
+
+
+def bulk_insert(context: Context):
+    async def request(index: int) -> bool:
+        rows = [expense_payload(context) for _ in range(context.args.bulk_size)]
+        response = await context.client.post("/expenses/bulk", json=rows)
+        return response.status_code in (200, 201) and not response.json()["errors"]
+    return request
+
+
+def filtered_list(context: Context):
+    async def request(index: int) -> bool:
+        start_date = random_window_start(context)
+        response = await context.client.get("/expenses", params={
+            "category_id": context.rng.choice(context.category_ids),
+            "start_date": str(start_date),
+            "end_date": str(start_date + timedelta(days=90)),
+            "limit": 100,
+        })
+        # A window without expenses of the category answers 404, which is a valid answer
+        return response.status_code in (200, 404)
+    return request
+
+
+def aggregation(context: Context):
+    async def request(index: int) -> bool:
+        response = await context.client.get("/expenses/summary", params={
+            "group_by": ["category", "month"],
+            "start_date": str(random_window_start(context)),
+        })
+        return response.status_code == 200
+    return request
+
+
+def receipt_pipeline(context: Context):
+    # Imported here because the graph reads its settings from the environment set up by main
+    from src.chain.batch_runner import StageLatencies, aprocess_receipt
+    from src.chain.helpers.expenses_backend import get_expenses_backend
+    from src.chain.nodes.save_expense_to_db import build_expense_data
+
+    stage_latencies = StageLatencies()
+    context.details["stages"] = stage_latencies
+
+    async def request(index: int) -> bool:
+        state = await aprocess_receipt(context.receipt_paths[index], stage_latencies)
+        transaction_id, error = await get_expenses_backend().asave_expense(build_expense_data(state))
+        return error is None
+    return request
+
+
+async def drive(request, total: int, concurrency: int) -> tuple:
+    """Call request(index) for every index below total with concurrency calls in flight"""
+    latencies, errors = [], 0
+    indexes = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for index in indexes:
+            start = time.perf_counter()
+            try:
+                ok = await request(index)
+            except Exception:
+                # A failed request or receipt counts as an error, the run goes on
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def arun_scenario(name: str, base_url: str, receipt_paths: list, args) -> tuple:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        category_ids = [item["category_id"] for item in (await client.get("/categories")).json()]
+        payment_method_ids = [item["payment_method_id"] for item in (await client.get("/payment_methods")).json()]
+        context = Context(client, category_ids, payment_method_ids, receipt_paths, args)
+        request = SCENARIO_FUNCTIONS[name](context)
+        total = {"bulk_insert": args.bulk_requests, "receipt_pipeline": len(receipt_paths)}.get(name, args.requests)
+        try:
+            latencies, errors, elapsed = await drive(request, total, args.concurrency)
+        finally:
+            if name == "receipt_pipeline":
+                from src.chain.helpers.http_client import aclose_async_http_client
+                from src.chain.helpers.llm import llm_registry
+                # The graph's async connections belong to this event loop
+                await aclose_async_http_client()
+                await llm_registry.aclose()
+    return latencies, errors, elapsed, context.details
+
+
+SCENARIO_FUNCTIONS = {
+    "single_insert": single_insert,
+    "bulk_insert": bulk_insert,
+    "filtered_list": filtered_list,
+    "aggregation": aggregation,
+    "receipt_pipeline": receipt_pipeline,
+}
+
+
+def run_scenario(name: str, base_url: str, api_process: subprocess.Popen, receipt_paths: list, args) -> dict:
+    processes = {"api": psutil.Process(api_process.pid), "client": psutil.Process()}
+    with MemorySampler(processes) as memory:
+        latencies, errors, elapsed, details = asyncio.run(arun_scenario(name, base_url, receipt_paths, args))
+
+    items_per_request = args.bulk_size if name == "bulk_insert" else 1
+    result = {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": elapsed,
+        "per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "items_per_s": len(latencies) * items_per_request / elapsed if elapsed else 0.0,
+        **latency_summary(latencies),
+        "api_rss_mb": memory.peak_mb("api"),
+        "client_rss_mb": memory.peak_mb("client"),
+    }
+    if "stages" in details:
+        result["stages"] = details["stages"].summary()
+    return result
+
+
+def load_config() -> dict:
+    with open(CONFIG_FILE_PATH, "r") as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def prepare_database(seed_rows: int):
+    """Apply the migrations and add seed_rows generated expenses for the read scenarios"""
+    from src.database.db_connection import close_connection_pool, get_connection
+    from src.database.migrate import run_migrations
+
+    run_migrations()
+    if seed_rows:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(generate_expenses_query, (BENCHMARK_DESCRIPTION, seed_rows))
+            conn.commit()
+    close_connection_pool()
+
+
+def seed_lookups(base_url: str, config: dict):
+    """Add the categories and payment methods of config.yml when the tables are empty"""
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        if not client.get("/categories").json():
+            for category in config.get("categories", []):
+                client.post("/categories", json={"category_name": category}).raise_for_status()
+        if not client.get("/payment_methods").json():
+            for payment_method in config.get("payment_methods", []):
+                client.post("/payment_methods", json={"payment_method_name": payment_method}).raise_for_status()
+
+
+def delete_benchmark_expenses():
+    from src.database.db_connection import close_connection_pool, get_connection
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM expenses WHERE description = %s", (BENCHMARK_DESCRIPTION,))
+        conn.commit()
+    close_connection_pool()
+
+
+def generate_receipts(directory: str, count: int) -> list:
+    """Distinct receipt images, so neither the extraction cache nor the image store can short cut them"""
+    paths = []
+    for index in range(count):
+        image = Image.new("RGB", (800, 1400), "white")
+        draw = ImageDraw.Draw(image)
+        lines = ["BENCHMARK STORE", f"Receipt {index:05d}", date.today().isoformat(), "",
+                 "Coffee            3.20", "Sandwich          7.80", "", "TOTAL            11.00", "VAT 21%           1.91"]
+        for line_number, line in enumerate(lines):
+            draw.text((80, 120 + line_number * 48), line, fill="black")
+        path = os.path.join(directory, f"receipt_{index:05d}.jpg")
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def git_revision() -> dict:
+    def git(*command):
+        completed = subprocess.run(["git", *command], capture_output=True, text=True)
+        return completed.stdout.strip() if completed.returncode == 0 else None
+
+    status = git("status", "--porcelain")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def print_baseline_comparison(results: list, baseline_path: str):
+    with open(baseline_path, "r") as file:
+        baseline = {result["scenario"]: result for result in json.load(file)["scenarios"]}
+
+    def change(new, old):
+        return (new - old) / old * 100 if old else None
+
+    rows = []
+    for result in results:
+        previous = baseline.get(result["scenario"])
+        if previous is None or not result.get("count") or not previous.get("count"):
+            continue
+        rows.append({
+            "scenario": result["scenario"],
+            "per_s_change_%": change(result["per_s"], previous["per_s"]),
+            "p50_change_%": change(result["p50_ms"], previous["p50_ms"]),
+            "p95_change_%": change(result["p95_ms"], previous["p95_ms"]),
+            "p99_change_%": change(result["p99_ms"], previous["p99_ms"]),
+        })
+    print(f"\nChange against {baseline_path}")
+    print_results_table(rows, ["scenario", "per_s_change_%", "p50_change_%", "p95_change_%", "p99_change_%"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", choices=("ephemeral", "env"), default="ephemeral",
+                        help="A throwaway postgres cluster, or the scratch database configured in .env")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests or receipts in flight")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests of single_insert, filtered_list and aggregation")
+    parser.add_argument("--bulk-requests", type=int, default=50)
+    parser.add_argument("--bulk-size", type=int, default=500, help="Expenses per bulk request")
+    parser.add_argument("--receipts", type=int, default=100, help="Receipts of receipt_pipeline")
+    parser.add_argument("--seed-rows", type=int, default=100000, help="Expenses generated before the scenarios run")
+    parser.add_argument("--llm-latency-ms", type=float, default=500, help="Latency of the stub LLM per call")
+    parser.add_argument("--api-mode", choices=("sync", "async"), default="sync", help="API_DB_MODE of the API")
+    parser.add_argument("--api-workers", type=int, default=1)
+    parser.add_argument("--response-cache", action="store_true", help="Keep the API response cache on")
+    parser.add_argument("--expenses-backend", choices=("http", "database"), default="http",
+                        help="EXPENSES_BACKEND of the graph in receipt_pipeline")
+    parser.add_argument("--api-port", type=int, default=8000)
+    parser.add_argument("--llm-port", type=int, default=8100)
+    parser.add_argument("--postgres-port", type=int, default=55432)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    config = load_config()
+    results = []
+    with ExitStack() as stack:
+        if args.database == "ephemeral":
+            os.environ.update(stack.enter_context(run_ephemeral_postgres(args.postgres_port)))
+        work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="expenses-e2e-"))
+
+        # The stub answers with names that exist, and with the benchmark description so the expenses can be deleted
+        stub_values = {
+            "payment_method": config["payment_methods"][0],
+            "category": config["categories"][0],
+            "business_personal": "business",
+            "description": BENCHMARK_DESCRIPTION,
+        }
+        llm_base_url = stack.enter_context(run_stub_llm_server(args.llm_port, args.llm_latency_ms,
+                                                               {"STUB_LLM_VALUES": json.dumps(stub_values)}))
+        os.environ.update({
+            "OPENAI_API_BASE": f"{llm_base_url}/v1",
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "stub"),
+            # Every receipt goes through the LLM calls
+            "EXTRACTION_CACHE_ENABLED": "false",
+            "CATEGORY_CLASSIFIER_ENABLED": "false",
+            # The stub has no rate limit, the scheduler only has to let every call through
+            "LLM_REQUESTS_PER_MINUTE": "1e9",
+            "LLM_TOKENS_PER_MINUTE": "1e12",
+            "LLM_INITIAL_CONCURRENCY": str(args.concurrency),
+            "IMAGE_STORE_DIR": os.path.join(work_dir, "image_store"),
+            "METRICS_ENABLED": "true",
+            "TRACE_ENABLED": "false",
+        })
+
+        prepare_database(args.seed_rows)
+        if args.database == "env":
+            stack.callback(delete_benchmark_expenses)
+
+        api_env = {"API_DB_MODE": args.api_mode, "RESPONSE_CACHE_ENABLED": "true" if args.response_cache else "false"}
+        base_url, api_process = stack.enter_context(run_uvicorn_process(API_APP, args.api_port, api_env, args.api_workers))
+        seed_lookups(base_url, config)
+        os.environ.update({"API_BASE_URL": base_url, "EXPENSES_BACKEND": args.expenses_backend})
+
+        receipt_paths = []
+        if "receipt_pipeline" in args.scenarios:
+            receipt_paths = generate_receipts(work_dir, args.receipts)
+
+        for name in args.scenarios:
+            print(f"Running {name}")
+            results.append(run_scenario(name, base_url, api_process, receipt_paths, args))
+
+    print_results_table(results, RESULT_COLUMNS)
+    for result in results:
+        for stage, latency in result.get("stages", {}).items():
+            print(f"  {result['scenario']} {stage:<20} p50={latency['p50_ms']:.0f}ms p95={latency['p95_ms']:.0f}ms")
+
+    if args.output:
+        report = {
+            **git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "settings": vars(args),
+            "scenarios": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        print_baseline_comparison(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
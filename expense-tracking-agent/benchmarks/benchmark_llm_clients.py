@@ -0,0 +1,111 @@
+"""Per receipt overhead of building a chat model per call versus the shared model registry.
+
+Starts benchmarks/stub_llm_server.py and runs the two structured calls of a
+receipt (extraction and categorization) against it:
+- per_call: a new ChatOpenAI(...).with_structured_output(...) for every call, as the nodes used to do
+- registry: models from src.chain.helpers.llm built once on shared keep-alive connections
+- registry_async: the same models through ainvoke, --concurrency receipts at a time
+
+With the stub answering immediately the latency is almost all client overhead.
+
+    python -m benchmarks.benchmark_llm_clients --receipts 200
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+
+from benchmarks.utils import latency_summary, print_results_table, run_stub_llm_server
+from src.chain.helpers.llm import ainvoke_structured_llm, get_structured_llm, llm_registry
+from src.chain.nodes.categorizer import Category
+from src.chain.nodes.json_parser import ReceiptSchema
+
+MODEL_NAME = "gpt-4-turbo"
+MESSAGES = [HumanMessage(content=[{"type": "text", "text": "Extract the receipt data"}])]
+RECEIPT_CALLS = (ReceiptSchema, Category)
+
+
+def run_per_call(receipts: int) -> list:
+    latencies = []
+    for _ in range(receipts):
+        start = time.perf_counter()
+        for schema in RECEIPT_CALLS:
+            ChatOpenAI(temperature=0, model=MODEL_NAME).with_structured_output(schema).invoke(MESSAGES)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_registry(receipts: int) -> list:
+    latencies = []
+    for _ in range(receipts):
+        start = time.perf_counter()
+        for schema in RECEIPT_CALLS:
+            get_structured_llm(MODEL_NAME, schema).invoke(MESSAGES)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run_registry_async(receipts: int, concurrency: int) -> list:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def receipt():
+        async with semaphore:
+            start = time.perf_counter()
+            for schema in RECEIPT_CALLS:
+                await ainvoke_structured_llm(MODEL_NAME, schema, MESSAGES)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(receipt() for _ in range(receipts)))
+    # The async connections belong to this event loop
+    await llm_registry.aclose()
+    return latencies
+
+
+def run_mode(mode: str, base_url: str, args) -> dict:
+    connections_before = httpx.get(f"{base_url}/stats").json()["connections"]
+
+    start = time.perf_counter()
+    if mode == "per_call":
+        latencies = run_per_call(args.receipts)
+    elif mode == "registry":
+        latencies = run_registry(args.receipts)
+        llm_registry.close()
+    else:
+        latencies = asyncio.run(run_registry_async(args.receipts, args.concurrency))
+    elapsed = time.perf_counter() - start
+
+    summary = latency_summary(latencies)
+    return {
+        "mode": mode,
+        "receipts_per_s": args.receipts / elapsed,
+        "mean_ms": summary["mean_ms"],
+        "p50_ms": summary["p50_ms"],
+        "p95_ms": summary["p95_ms"],
+        "connections": httpx.get(f"{base_url}/stats").json()["connections"] - connections_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8, help="Receipts in flight in registry_async mode")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency added by the stub server per call")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    with run_stub_llm_server(args.port, args.latency_ms) as base_url:
+        os.environ["OPENAI_API_BASE"] = f"{base_url}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "stub")
+        results = [run_mode(mode, base_url, args) for mode in ("per_call", "registry", "registry_async")]
+
+    print_results_table(results, ["mode", "receipts_per_s", "mean_ms", "p50_ms", "p95_ms", "connections"])
+
+
+if __name__ == "__main__":
+    main()
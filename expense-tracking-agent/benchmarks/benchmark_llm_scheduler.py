@@ -0,0 +1,135 @@
+"""LLM calls against a rate limited API with and without the scheduler of src/chain/helpers/llm_scheduler.py.
+
+Starts benchmarks/stub_llm_server.py with a requests per minute limit and a
+cap on concurrent requests, both answered with 429 and Retry-After like the
+real API, then sends --batch-calls extraction calls, --concurrency at a time,
+while --interactive-calls revision calls arrive one by one during the run:
+- unscheduled: the calls go straight to the API, the OpenAI client retries 429s twice
+- scheduled: the calls wait for the scheduler, which knows the limits, adapts
+  its concurrency to the 429s it still gets and starts the revisions first
+
+Reports the calls that failed, the 429s the stub sent, the throughput and the
+latency of each kind of call, waiting included.
+
+    python -m benchmarks.benchmark_llm_scheduler --batch-calls 300 --requests-per-minute 600 --max-concurrency 8
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import os
+import time
+
+import httpx
+from langchain_core.messages import HumanMessage
+from PIL import Image
+
+from benchmarks.utils import latency_summary, print_results_table, run_stub_llm_server
+from src.chain.helpers.llm import ainvoke_structured_llm, llm_registry
+from src.chain.helpers.llm_scheduler import LLM_PRIORITY_BATCH, LLM_PRIORITY_INTERACTIVE, llm_scheduler
+from src.chain.nodes.json_parser import ReceiptSchema
+
+MODEL_NAME = "gpt-4-turbo"
+
+
+def receipt_messages() -> list:
+    """A prompt with a receipt sized image, so the scheduler estimates vision tokens"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (1000, 2000), "white").save(buffer, format="PNG")
+    image_url = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+    return [HumanMessage(content=[
+        {"type": "text", "text": "Extract the receipt data"},
+        {"type": "image_url", "image_url": {"url": image_url}},
+    ])]
+
+
+async def run_calls(args, messages: list) -> dict:
+    latencies = {"batch": [], "interactive": []}
+    failures = {"batch": 0, "interactive": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def call(kind: str, priority: int):
+        start = time.perf_counter()
+        try:
+            await ainvoke_structured_llm(MODEL_NAME, ReceiptSchema, messages, priority=priority)
+            latencies[kind].append(time.perf_counter() - start)
+        except Exception:
+            failures[kind] += 1
+
+    async def batch_call():
+        async with semaphore:
+            await call("batch", LLM_PRIORITY_BATCH)
+
+    async def interactive_calls():
+        # A reviewer asks for a revision every interval while the batch runs
+        tasks = []
+        for _ in range(args.interactive_calls):
+            await asyncio.sleep(args.interactive_interval)
+            tasks.append(asyncio.create_task(call("interactive", LLM_PRIORITY_INTERACTIVE)))
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(interactive_calls(), *(batch_call() for _ in range(args.batch_calls)))
+    # The async connections belong to this event loop
+    await llm_registry.aclose()
+    return {"latencies": latencies, "failures": failures}
+
+
+def run_mode(mode: str, base_url: str, args, messages: list) -> dict:
+    llm_scheduler.enabled = mode == "scheduled"
+    llm_scheduler.set_default_limits(args.requests_per_minute, args.tokens_per_minute)
+    stats_before = httpx.get(f"{base_url}/stats").json()
+
+    start = time.perf_counter()
+    result = asyncio.run(run_calls(args, messages))
+    elapsed = time.perf_counter() - start
+
+    stats = httpx.get(f"{base_url}/stats").json()
+    batch = latency_summary(result["latencies"]["batch"])
+    interactive = latency_summary(result["latencies"]["interactive"])
+    succeeded = len(result["latencies"]["batch"]) + len(result["latencies"]["interactive"])
+    return {
+        "mode": mode,
+        "succeeded": succeeded,
+        "failed": result["failures"]["batch"] + result["failures"]["interactive"],
+        "http_429": stats["rate_limited"] - stats_before["rate_limited"],
+        "calls_per_s": succeeded / elapsed,
+        "batch_p50_ms": batch.get("p50_ms", 0.0),
+        "batch_p95_ms": batch.get("p95_ms", 0.0),
+        "interactive_p50_ms": interactive.get("p50_ms", 0.0),
+        "interactive_p95_ms": interactive.get("p95_ms", 0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=32, help="Batch calls in flight from the caller's side")
+    parser.add_argument("--interactive-calls", type=int, default=10)
+    parser.add_argument("--interactive-interval", type=float, default=1.0, help="Seconds between two interactive calls")
+    parser.add_argument("--requests-per-minute", type=float, default=600, help="Request limit of the stub, given to the scheduler as well")
+    parser.add_argument("--tokens-per-minute", type=float, default=2_000_000, help="Token limit of the stub, given to the scheduler as well")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Requests the stub serves at once, unknown to the scheduler")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Latency added by the stub server per call")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    messages = receipt_messages()
+    # A fresh stub per mode, so each starts with full rate limit budgets
+    results = []
+    for mode in ("unscheduled", "scheduled"):
+        with run_stub_llm_server(args.port, args.latency_ms, {
+            "STUB_LLM_REQUESTS_PER_MINUTE": str(args.requests_per_minute),
+            "STUB_LLM_TOKENS_PER_MINUTE": str(args.tokens_per_minute),
+            "STUB_LLM_MAX_CONCURRENCY": str(args.max_concurrency),
+        }) as base_url:
+            os.environ["OPENAI_API_BASE"] = f"{base_url}/v1"
+            os.environ.setdefault("OPENAI_API_KEY", "stub")
+            results.append(run_mode(mode, base_url, args, messages))
+
+    print_results_table(results, ["mode", "succeeded", "failed", "http_429", "calls_per_s", "batch_p50_ms", "batch_p95_ms",
+                                  "interactive_p50_ms", "interactive_p95_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Compare the serialization of expense lists through pydantic models with orjson on cursor rows.
+
+Both paths start from the rows a cursor returns and end with the response
+body, without a database or a server, so only serialization is timed:
+- models: an Expense per row validated again as list[Expense] and dumped with
+  json.dumps, which is what FastAPI did for the response_model of GET /expenses
+- orjson: rows with amounts read as text serialized by expense_rows_response
+
+    python -m benchmarks.benchmark_serialization --rows 100000
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import orjson
+from pydantic import TypeAdapter
+
+from benchmarks.utils import print_results_table
+from src.api.expenses_routes import expense_row_to_dict, expense_rows_response
+from src.database.expenses import Expense
+
+
+def generate_rows(count: int, amounts_as_text: bool) -> list:
+    rng = random.Random(0)
+    start = date(2020, 1, 1)
+    rows = []
+    for transaction_id in range(1, count + 1):
+        # numeric(10, 2) values as psycopg2 returns them and as amount::text renders them
+        amount = Decimal(rng.randint(1, 50000)).scaleb(-2)
+        vat = (amount * Decimal("0.21")).quantize(Decimal("0.01"))
+        if amounts_as_text:
+            amount, vat = str(amount), str(vat)
+        rows.append((transaction_id, start + timedelta(days=rng.randint(0, 1095)), rng.randint(1, 12),
+                     f"expense {transaction_id}", amount, vat, rng.randint(1, 5),
+                     rng.choice(("business", "personal"))))
+    return rows
+
+
+def models_list(rows: list, adapter: TypeAdapter) -> bytes:
+    expenses = [Expense(transaction_id=row[0], date=row[1], category_id=row[2], description=row[3],
+                        amount=row[4], vat=row[5], payment_method_id=row[6], business_personal=row[7]) for row in rows]
+    return json.dumps(adapter.dump_python(adapter.validate_python(expenses), mode="json")).encode()
+
+
+def models_stream(rows: list) -> bytes:
+    return b"".join(
+        (Expense(transaction_id=row[0], date=row[1], category_id=row[2], description=row[3],
+                 amount=row[4], vat=row[5], payment_method_id=row[6], business_personal=row[7]
+                 ).model_dump_json() + "\n").encode()
+        for row in rows
+    )
+
+
+def orjson_list(rows: list) -> bytes:
+    return expense_rows_response(rows).body
+
+
+def orjson_stream(rows: list) -> bytes:
+    return b"".join(orjson.dumps(expense_row_to_dict(row)) + b"\n" for row in rows)
+
+
+def best_seconds(serialize, rows: list, repeat: int) -> tuple:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = serialize(rows)
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per path, the fastest one is reported")
+    args = parser.parse_args()
+
+    decimal_rows = generate_rows(args.rows, amounts_as_text=False)
+    text_rows = generate_rows(args.rows, amounts_as_text=True)
+    adapter = TypeAdapter(list[Expense])
+
+    paths = {
+        "models_list": (lambda rows: models_list(rows, adapter), decimal_rows),
+        "orjson_list": (orjson_list, text_rows),
+        "models_stream": (models_stream, decimal_rows),
+        "orjson_stream": (orjson_stream, text_rows),
+    }
+    results = []
+    bodies = {}
+    for name, (serialize, rows) in paths.items():
+        seconds, bodies[name] = best_seconds(serialize, rows, args.repeat)
+        results.append({"path": name, "seconds": seconds, "rows_per_s": args.rows / seconds, "bytes": len(bodies[name])})
+
+    # Both paths must produce the same documents
+    assert json.loads(bodies["models_list"]) == json.loads(bodies["orjson_list"])
+    assert bodies["models_stream"] == bodies["orjson_stream"]
+
+    print_results_table(results, ["path", "seconds", "rows_per_s", "bytes"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Compare the two-call path (json_parser + categorizer) with single pass extraction.
+
+The chat model is replaced by a stub that counts prompt and completion tokens
+with tiktoken and sleeps for a latency derived from them, so the comparison
+runs offline and shows the per receipt latency and cost of each path.
+
+    python -m benchmarks.benchmark_single_pass --receipts 20
+"""
+
+import argparse
+import json
+import threading
+import time
+import typing
+
+import tiktoken
+import yaml
+
+import src.chain.nodes.categorizer as categorizer_module
+import src.chain.nodes.json_parser as json_parser_module
+from benchmarks.utils import print_results_table
+
+CONFIG_FILE_PATH = "config.yml"
+
+
+class ModelUsage:
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+
+def stub_value(field):
+    """A plausible value for a pydantic v1 field, the first option of a Literal"""
+    if typing.get_origin(field.outer_type_) is typing.Literal:
+        return typing.get_args(field.outer_type_)[0]
+    if field.outer_type_ is float:
+        return 12.5
+    if field.name == "date":
+        return "04-18-2024"
+    return "stub"
+
+
+class StubStructuredLLM:
+    """Stands in for ChatOpenAI(...).with_structured_output(schema)"""
+
+    def __init__(self, schema, usage: ModelUsage, args):
+        self.schema = schema
+        self.usage = usage
+        self.args = args
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def invoke(self, messages):
+        # The function definition is sent with every call and counts as prompt tokens
+        prompt_tokens = len(self.encoding.encode(json.dumps(self.schema.schema())))
+        for message in messages:
+            for part in message.content:
+                if part["type"] == "text":
+                    prompt_tokens += len(self.encoding.encode(part["text"]))
+                else:
+                    prompt_tokens += self.args.image_tokens
+
+        response = self.schema(**{name: stub_value(field) for name, field in self.schema.__fields__.items()})
+        completion_tokens = len(self.encoding.encode(response.json()))
+
+        time.sleep((self.args.call_latency_ms + prompt_tokens * self.args.prompt_token_ms
+                    + completion_tokens * self.args.completion_token_ms) / 1000)
+        self.usage.record(prompt_tokens, completion_tokens)
+        return response
+
+
+class StubImageStore:
+    def get_base64(self, handle: str) -> str:
+        return handle
+
+
+def install_stubs(usage: ModelUsage, args, categories: dict, payment_methods: dict):
+    stub_factory = lambda model_name, schema, temperature=0: StubStructuredLLM(schema, usage, args)
+    ids_by_category = {name: category_id for category_id, name in categories.items()}
+    ids_by_payment_method = {name: payment_method_id for payment_method_id, name in payment_methods.items()}
+
+    json_parser_module.get_structured_llm = stub_factory
+    json_parser_module.image_store = StubImageStore()
+    json_parser_module.get_payment_methods = lambda: payment_methods
+    json_parser_module.get_category_id = ids_by_category.get
+    json_parser_module.get_payment_method_id = ids_by_payment_method.get
+    categorizer_module.get_structured_llm = stub_factory
+    categorizer_module.get_categories = lambda: categories
+    categorizer_module.get_category_id = ids_by_category.get
+    categorizer_module.get_payment_method_id = ids_by_payment_method.get
+
+
+def run_path(single_pass: bool, receipts: int, args, categories: dict, payment_methods: dict) -> dict:
+    usage = ModelUsage()
+    install_stubs(usage, args, categories, payment_methods)
+
+    start = time.perf_counter()
+    for _ in range(receipts):
+        state = {
+            "image_pages": ["stub"],
+            "categories": categories,
+            "payment_methods": payment_methods,
+            "vision_model_name": "gpt-4-vision-preview",
+            "categorizer_model_name": "gpt-4-turbo",
+            "single_pass": single_pass,
+        }
+        state = json_parser_module.json_parser(state)
+        if not single_pass:
+            state = categorizer_module.categorizer(state)
+    elapsed = time.perf_counter() - start
+
+    cost = (usage.prompt_tokens * args.prompt_price + usage.completion_tokens * args.completion_price) / 1000
+    return {
+        "path": "single_pass" if single_pass else "two_calls",
+        "calls": usage.calls / receipts,
+        "prompt_tokens": usage.prompt_tokens / receipts,
+        "completion_tokens": usage.completion_tokens / receipts,
+        "latency_ms": elapsed / receipts * 1000,
+        "usd_per_1k": cost / receipts * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=10)
+    parser.add_argument("--image-tokens", type=int, default=765, help="Prompt tokens charged per image (1024x1024, high detail)")
+    parser.add_argument("--call-latency-ms", type=float, default=400, help="Fixed latency per model call")
+    parser.add_argument("--prompt-token-ms", type=float, default=0.05)
+    parser.add_argument("--completion-token-ms", type=float, default=25)
+    parser.add_argument("--prompt-price", type=float, default=0.01, help="USD per 1K prompt tokens")
+    parser.add_argument("--completion-price", type=float, default=0.03, help="USD per 1K completion tokens")
+    args = parser.parse_args()
+
+    with open(CONFIG_FILE_PATH, "r") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)
+    categories = dict(enumerate(config["categories"], start=1))
+    payment_methods = dict(enumerate(config["payment_methods"], start=1))
+
+    results = [run_path(single_pass, args.receipts, args, categories, payment_methods) for single_pass in (False, True)]
+    print_results_table(results, ["path", "calls", "prompt_tokens", "completion_tokens", "latency_ms", "usd_per_1k"])
+
+
+if __name__ == "__main__":
+    main()
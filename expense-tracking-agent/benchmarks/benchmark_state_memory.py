@@ -0,0 +1,90 @@
+"""Memory held per in-flight receipt with the image inline in the state versus an image store handle.
+
+Every receipt is walked through the same hops as the graph: each node copies
+the state and some print it. The "inline" layout carries the base64 encoded
+image in the state like image_encoder used to, the "handle" layout stores the
+bytes in an ImageStore and only keeps the handle. tracemalloc reports the
+memory still held by the in-flight states and the peak while walking them.
+
+    python -m benchmarks.benchmark_state_memory --receipts 20 --image-kb 3000
+"""
+
+import argparse
+import base64
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks.utils import print_results_table
+from src.chain.helpers.image_store import ImageStore
+
+# image_preprocessor, json_parser, categorizer, human_checker, save_expense_to_db
+NODE_HOPS = 5
+# categorizer and modifier printed the whole state
+PRINTING_HOPS = 2
+
+
+def base_state(categories: dict) -> dict:
+    return {
+        "categories": categories,
+        "payment_methods": categories,
+        "vision_model_name": "gpt-4-vision-preview",
+        "categorizer_model_name": "gpt-4-turbo",
+        "description": "stub",
+        "amount": "12.50",
+        "vat": "2.10",
+    }
+
+
+def walk_state(state: dict, devnull) -> dict:
+    for hop in range(NODE_HOPS):
+        state = state.copy()
+        state[f"hop_{hop}"] = True
+        if hop < PRINTING_HOPS:
+            print(state, file=devnull)
+    return state
+
+
+def run_layout(layout: str, receipts: int, image_kb: int, store: ImageStore, categories: dict) -> dict:
+    with open(os.devnull, "w") as devnull:
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+
+        in_flight = []
+        for _ in range(receipts):
+            # Stands in for reading the receipt file, random bytes are not compressible
+            image_bytes = os.urandom(image_kb * 1024)
+            state = base_state(categories)
+            if layout == "inline":
+                state["image_base64"] = base64.b64encode(image_bytes).decode("utf-8")
+            else:
+                state["image_pages"] = [store.put(image_bytes)]
+            del image_bytes
+            in_flight.append(walk_state(state, devnull))
+
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "layout": layout,
+        "receipts": receipts,
+        "held_kb_per_receipt": (current - baseline) / receipts / 1024,
+        "peak_mb": (peak - baseline) / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=20, help="Receipts in flight at the same time")
+    parser.add_argument("--image-kb", type=int, default=3000, help="Size of each receipt file")
+    args = parser.parse_args()
+
+    categories = {category_id: f"category {category_id}" for category_id in range(1, 21)}
+    with tempfile.TemporaryDirectory() as directory:
+        store = ImageStore(directory)
+        results = [run_layout(layout, args.receipts, args.image_kb, store, categories) for layout in ("inline", "handle")]
+    print_results_table(results, ["layout", "receipts", "held_kb_per_receipt", "peak_mb"])
+
+
+if __name__ == "__main__":
+    main()
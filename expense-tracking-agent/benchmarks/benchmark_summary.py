@@ -0,0 +1,101 @@
+"""Compare GET /expenses/summary with summing streamed expenses in the client.
+
+Loads --rows generated expenses into the scratch database configured in .env
+with one INSERT ... SELECT, which also exercises the summary triggers on a
+large statement, then times monthly totals per category both ways. The
+generated expenses are deleted again at the end.
+
+    python -m benchmarks.benchmark_summary --rows 1000000
+"""
+
+import argparse
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+import httpx
+import orjson
+
+from benchmarks.utils import latency_summary, print_results_table, run_api_server
+from src.database.db_connection import close_connection_pool, get_connection
+
+BENCHMARK_DESCRIPTION = "benchmark summary expense"
+
+generate_expenses_query = """
+INSERT INTO expenses (date, category_id, description, amount, vat, payment_method_id, business_personal)
+SELECT current_date - (random() * 1095)::int,
+       (SELECT array_agg(category_id) FROM categories)[1 + (random() * (SELECT count(*) - 1 FROM categories))::int],
+       %s,
+       round((random() * 500)::numeric, 2),
+       round((random() * 50)::numeric, 2),
+       (SELECT array_agg(payment_method_id) FROM payment_methods)[1 + (random() * (SELECT count(*) - 1 FROM payment_methods))::int],
+       CASE WHEN random() < 0.5 THEN 'business' ELSE 'personal' END
+FROM generate_series(1, %s)
+"""
+
+
+def run_sql(query: str, params: tuple) -> float:
+    start = time.perf_counter()
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+        conn.commit()
+    return time.perf_counter() - start
+
+
+def summary_from_stream(client: httpx.Client) -> dict:
+    """Monthly totals per category computed in the client from every expense"""
+    totals = defaultdict(Decimal)
+    with client.stream("GET", "/expenses", params={"stream": "true"}) as response:
+        for line in response.iter_lines():
+            if line:
+                expense = orjson.loads(line)
+                totals[(expense["category_id"], expense["date"][:7])] += Decimal(expense["amount"])
+    return totals
+
+
+def time_requests(request, repeat: int) -> list:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        request()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=20, help="Requests per summary endpoint query")
+    parser.add_argument("--stream-repeat", type=int, default=1, help="Full client side aggregations")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    insert_seconds = run_sql(generate_expenses_query, (BENCHMARK_DESCRIPTION, args.rows))
+    print(f"Inserted {args.rows} expenses in {insert_seconds:.1f}s including the summary trigger")
+
+    try:
+        with run_api_server(args.port) as base_url, httpx.Client(base_url=base_url, timeout=600) as client:
+            queries = {
+                "total": {},
+                "category_month": {"group_by": ["category", "month"]},
+                "payment_method_week": {"group_by": ["payment_method", "week"], "start_date": "2024-01-01"},
+                "business_personal_day": {"group_by": ["business_personal", "day"]},
+            }
+            results = []
+            for name, params in queries.items():
+                latencies = time_requests(lambda: client.get("/expenses/summary", params=params).raise_for_status(), args.repeat)
+                results.append({"query": name, **latency_summary(latencies)})
+
+            latencies = time_requests(lambda: summary_from_stream(client), args.stream_repeat)
+            results.append({"query": "client_side_stream", **latency_summary(latencies)})
+
+        print_results_table(results, ["query", "count", "mean_ms", "p50_ms", "p95_ms", "max_ms"])
+    finally:
+        delete_seconds = run_sql("DELETE FROM expenses WHERE description = %s", (BENCHMARK_DESCRIPTION,))
+        print(f"Deleted the generated expenses in {delete_seconds:.1f}s")
+        close_connection_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Answers POST /v1/chat/completions after STUB_LLM_LATENCY_MS milliseconds. When
+the request carries tools, as with_structured_output does, the answer is a
+call of the first tool with a value for every parameter of its JSON schema,
+otherwise a short text message. STUB_LLM_VALUES, a JSON object of
+parameter name -> value, overrides the answer for those parameters, e.g. to
+return a payment method that exists. Point the OpenAI client at it with
+OPENAI_API_BASE=http://127.0.0.1:<port>/v1 and any OPENAI_API_KEY.
+
+Like the real API it answers 429 with a Retry-After header beyond
+STUB_LLM_REQUESTS_PER_MINUTE or STUB_LLM_TOKENS_PER_MINUTE, with more than
+STUB_LLM_MAX_CONCURRENCY requests in flight, and at random for a
+STUB_LLM_RATE_LIMIT_PROBABILITY share of requests. All are off by default.
+
+    uvicorn benchmarks.stub_llm_server:app --port 8100
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "0"))
+STUB_LLM_VALUES = json.loads(os.getenv("STUB_LLM_VALUES", "{}"))
+STUB_LLM_REQUESTS_PER_MINUTE = float(os.getenv("STUB_LLM_REQUESTS_PER_MINUTE", "0"))
+STUB_LLM_TOKENS_PER_MINUTE = float(os.getenv("STUB_LLM_TOKENS_PER_MINUTE", "0"))
+STUB_LLM_MAX_CONCURRENCY = int(os.getenv("STUB_LLM_MAX_CONCURRENCY", "0"))
+STUB_LLM_RATE_LIMIT_PROBABILITY = float(os.getenv("STUB_LLM_RATE_LIMIT_PROBABILITY", "0"))
+
+app = FastAPI()
+
+stats = {"requests": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0, "connections": set()}
+
+
+class Budget:
+    """Allowance of per_minute units refilled continuously, like the API's rate limits"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated_at = time.monotonic()
+
+    def take(self, amount: float) -> float:
+        """Take amount and return 0, or return the seconds until it is available"""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.level >= amount:
+            self.level -= amount
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+request_budget = Budget(STUB_LLM_REQUESTS_PER_MINUTE) if STUB_LLM_REQUESTS_PER_MINUTE else None
+token_budget = Budget(STUB_LLM_TOKENS_PER_MINUTE) if STUB_LLM_TOKENS_PER_MINUTE else None
+
+
+def prompt_tokens(body: dict) -> int:
+    """Rough prompt size: a token per 4 characters of text and 765 per image"""
+    tokens = len(json.dumps(body.get("tools") or [])) // 4
+    for message in body.get("messages", []):
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += len(content) // 4 + 4
+            continue
+        for part in content:
+            tokens += 765 if part.get("type") == "image_url" else len(part.get("text", "")) // 4
+        tokens += 4
+    return tokens
+
+
+def rate_limit_wait(tokens: int):
+    """Seconds the client should wait when the request is over a limit, None to serve it"""
+    if STUB_LLM_MAX_CONCURRENCY and stats["in_flight"] > STUB_LLM_MAX_CONCURRENCY:
+        return 1.0
+    if STUB_LLM_RATE_LIMIT_PROBABILITY and random.random() < STUB_LLM_RATE_LIMIT_PROBABILITY:
+        return 1.0
+    if request_budget is not None and (wait := request_budget.take(1)):
+        return wait
+    if token_budget is not None and (wait := token_budget.take(min(tokens, token_budget.capacity))):
+        return wait
+    return None
+
+
+def rate_limited_response(wait: float) -> JSONResponse:
+    stats["rate_limited"] += 1
+    return JSONResponse(
+        status_code=429,
+        headers={"retry-after": str(math.ceil(wait * 10) / 10)},
+        content={"error": {"message": "Rate limit reached", "type": "requests", "param": None, "code": "rate_limit_exceeded"}},
+    )
+
+
+def stub_value(name: str, schema: dict):
+    """A value matching a JSON schema property, the first option of an enum"""
+    if name in STUB_LLM_VALUES:
+        return STUB_LLM_VALUES[name]
+    if "enum" in schema:
+        return schema["enum"][0]
+    if schema.get("type") in ("number", "integer"):
+        return 12.5 if schema["type"] == "number" else 1
+    if name == "date":
+        return "04-18-2024"
+    return "stub"
+
+
+def stub_message(body: dict) -> dict:
+    tools = body.get("tools") or []
+    if not tools:
+        return {"role": "assistant", "content": "stub"}
+
+    function = tools[0]["function"]
+    properties = function.get("parameters", {}).get("properties", {})
+    arguments = {name: stub_value(name, schema) for name, schema in properties.items()}
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+        }],
+    }
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+async def get_stats():
+    """Requests received, 429s sent, peak concurrency and distinct client connections seen, to check connection reuse"""
+    return {**{name: value for name, value in stats.items() if name != "connections"}, "connections": len(stats["connections"])}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    stats["connections"].add(request.client)
+    tokens = prompt_tokens(body)
+
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    try:
+        wait = rate_limit_wait(tokens)
+        if wait is not None:
+            return rate_limited_response(wait)
+        if STUB_LLM_LATENCY_MS:
+            await asyncio.sleep(STUB_LLM_LATENCY_MS / 1000)
+    finally:
+        stats["in_flight"] -= 1
+
+    message = stub_message(body)
+    completion_tokens = len(json.dumps(message)) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if "tool_calls" in message else "stop",
+        }],
+        "usage": {"prompt_tokens": tokens, "completion_tokens": completion_tokens, "total_tokens": tokens + completion_tokens},
+    }
@@ -0,0 +1,129 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks are run from the expense-tracking-agent folder, e.g.
+    python -m benchmarks.benchmark_db_modes
+"""
+
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import httpx
+
+
+def latency_summary(latencies: list) -> dict:
+    """Summarize a list of latencies in seconds as milliseconds percentiles"""
+    if not latencies:
+        return {"count": 0}
+
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def wait_until_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} did not come up within {timeout} seconds")
+
+
+API_APP = "src.api.run_api:app"
+
+
+@contextmanager
+def run_uvicorn_process(app: str, port: int, env: dict = None, workers: int = 1, ready_path: str = "/docs"):
+    """Start an ASGI app with uvicorn in a subprocess for the duration of the block, yields (base_url, process)"""
+    server_env = {**os.environ, **(env or {})}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app,
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=server_env,
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}{ready_path}")
+        yield f"http://127.0.0.1:{port}", process
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@contextmanager
+def run_uvicorn(app: str, port: int, env: dict = None, workers: int = 1, ready_path: str = "/docs"):
+    """Start an ASGI app with uvicorn in a subprocess for the duration of the block"""
+    with run_uvicorn_process(app, port, env, workers, ready_path) as (base_url, _):
+        yield base_url
+
+
+def run_api_server(port: int, env: dict = None, workers: int = 1):
+    """Start the FastAPI app for the duration of the block"""
+    return run_uvicorn(API_APP, port, env, workers)
+
+
+def run_stub_llm_server(port: int, latency_ms: float = 0, env: dict = None):
+    """Start benchmarks/stub_llm_server.py for the duration of the block"""
+    return run_uvicorn("benchmarks.stub_llm_server:app", port, {"STUB_LLM_LATENCY_MS": str(latency_ms), **(env or {})},
+                       ready_path="/health")
+
+
+def postgres_binary(name: str) -> str:
+    """Path of a postgres server binary, from PG_BIN_DIR, pg_config --bindir or PATH"""
+    bin_dir = os.getenv("PG_BIN_DIR")
+    if not bin_dir and shutil.which("pg_config"):
+        bin_dir = subprocess.run(["pg_config", "--bindir"], capture_output=True, text=True, check=True).stdout.strip()
+    path = os.path.join(bin_dir, name) if bin_dir else shutil.which(name)
+    if not path or not os.path.exists(path):
+        raise RuntimeError(f"{name} not found, install the postgres server or set PG_BIN_DIR")
+    return path
+
+
+@contextmanager
+def run_ephemeral_postgres(port: int, database: str = "expenses"):
+    """Create a throwaway postgres cluster in a temporary directory and start it for the duration of the block.
+
+    Yields the DB_* settings of its database, the cluster is deleted afterwards.
+    initdb refuses to run as root, run the benchmark as a regular user.
+    """
+    with tempfile.TemporaryDirectory(prefix="expenses-pg-") as data_dir:
+        subprocess.run([postgres_binary("initdb"), "-D", data_dir, "-U", "postgres", "--auth=trust", "-E", "UTF8", "--no-sync"],
+                       check=True, stdout=subprocess.DEVNULL)
+        # The socket goes in the data directory so clusters of parallel runs do not clash
+        options = f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1"
+        subprocess.run([postgres_binary("pg_ctl"), "-D", data_dir, "-o", options, "-l", os.path.join(data_dir, "server.log"),
+                        "-w", "start"], check=True, stdout=subprocess.DEVNULL)
+        try:
+            subprocess.run([postgres_binary("createdb"), "-h", "127.0.0.1", "-p", str(port), "-U", "postgres", database], check=True)
+            yield {"DB_HOST": "127.0.0.1", "DB_PORT": str(port), "DB_NAME": database, "DB_USER": "postgres", "DB_PASSWORD": ""}
+        finally:
+            subprocess.run([postgres_binary("pg_ctl"), "-D", data_dir, "-m", "fast", "-w", "stop"], stdout=subprocess.DEVNULL)
+
+
+def print_results_table(results: list, columns: list):
+    header = " | ".join(f"{column:>14}" for column in columns)
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        print(" | ".join(
+            f"{row.get(column, ''):>14.2f}" if isinstance(row.get(column), float) else f"{str(row.get(column, '')):>14}"
+            for column in columns
+        ))
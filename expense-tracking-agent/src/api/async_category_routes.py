@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, HTTPException
+import asyncpg
+from src.api.category_routes import CategoryCreate, CategoryDelete, Category
+from src.database.async_db_connection import get_async_db_connection
+from src.database.repositories import SELECT_CATEGORIES_SQL
+
+# Initialize APIRouter
+router = APIRouter()
+
+# GET all categories
+@router.get("/categories", response_model=list[Category])
+async def get_categories(conn=Depends(get_async_db_connection)):
+    try:
+        categories = await conn.fetch(SELECT_CATEGORIES_SQL)
+        return [{"category_id": category[0], "category_name": category[1]} for category in categories]
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# POST a category
+@router.post("/categories", response_model=Category)
+async def create_category(category_data: CategoryCreate, conn=Depends(get_async_db_connection)):
+    try:
+        category = await conn.fetchrow("INSERT INTO categories (category_name) VALUES ($1) RETURNING category_id, category_name", category_data.category_name)
+        return {"category_id": category[0], "category_name": category[1]}
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# DELETE a category
+@router.delete("/categories")
+async def delete_category(category_data: CategoryDelete, conn=Depends(get_async_db_connection)):
+    try:
+        deleted_category = await conn.fetchrow("DELETE FROM categories WHERE category_name = $1 RETURNING category_name", category_data.category_name)
+        if not deleted_category:
+            raise HTTPException(status_code=404, detail="Category not found")
+        return {"message": "Category deleted successfully"}
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
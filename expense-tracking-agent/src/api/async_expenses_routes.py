@@ -0,0 +1,131 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from src.api.expenses_routes import (ExpenseDelete, ExpenseSummary, SummaryGroup, read_bulk_expense_rows, expense_row_to_dict,
+                                     parse_expenses_cursor, parse_summary_group_by, expense_rows_response,
+                                     EXPENSES_PAGE_MAX_LIMIT, EXPENSES_STREAM_BATCH_SIZE)
+from src.database.async_db_connection import acquire_async_connection, get_async_db_connection
+from src.database.expenses import BulkExpenseResult, Expense, ExpenseCreate, reject_unknown_references, validate_bulk_expenses
+from src.database.expense_queries import build_expense_summary_query, build_expenses_query, encode_expenses_cursor, to_asyncpg_placeholders
+from src.database.repositories import INSERT_EXPENSE_SQL, expense_values
+from datetime import date
+import asyncpg
+import orjson
+
+INSERT_EXPENSE_ASYNCPG_SQL = to_asyncpg_placeholders(INSERT_EXPENSE_SQL)
+
+# Initialize APIRouter
+router = APIRouter()
+
+# GET all expenses with optional filters
+@router.get("/expenses", response_model=list[Expense])
+async def get_expenses(
+    category_id: int = None,
+    payment_method_id: int = None,
+    start_date: date = None,
+    end_date: date = None,
+    limit: int = Query(None, ge=1, le=EXPENSES_PAGE_MAX_LIMIT),
+    after: str = None,
+    stream: bool = False):
+    filters = dict(category_id=category_id, payment_method_id=payment_method_id, start_date=start_date,
+                   end_date=end_date, after=parse_expenses_cursor(after))
+    query, params = build_expenses_query(limit=limit, **filters)
+    query = to_asyncpg_placeholders(query)
+
+    # The stream acquires its own connection, a pooled one would sit unused until the response is sent
+    if stream:
+        return StreamingResponse(stream_expenses(query, params), media_type="application/x-ndjson")
+
+    try:
+        async with acquire_async_connection() as conn:
+            expenses = await conn.fetch(query, *params)
+
+        if not expenses and after is None:
+            raise HTTPException(status_code=404, detail="No expenses found for the given filters")
+
+        # A full page means there may be more rows after the last one
+        headers = {}
+        if limit is not None and len(expenses) == limit:
+            headers["X-Next-Cursor"] = encode_expenses_cursor(expenses[-1][1], expenses[-1][0])
+
+        # asyncpg records unpack like the psycopg2 tuples
+        return expense_rows_response(expenses, headers)
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+async def stream_expenses(query: str, params: list):
+    """Yield expenses as NDJSON lines from a server side cursor, prefetching EXPENSES_STREAM_BATCH_SIZE rows at a time"""
+    async with acquire_async_connection() as conn:
+        async with conn.transaction(readonly=True):
+            async for expense in conn.cursor(query, *params, prefetch=EXPENSES_STREAM_BATCH_SIZE):
+                yield orjson.dumps(expense_row_to_dict(expense)) + b"\n"
+
+# GET totals and VAT of expenses grouped by category, payment method, business/personal and period
+@router.get("/expenses/summary", response_model=list[ExpenseSummary], response_model_exclude_unset=True)
+async def get_expenses_summary(
+    group_by: list[SummaryGroup] = Query([]),
+    category_id: int = None,
+    payment_method_id: int = None,
+    start_date: date = None,
+    end_date: date = None,
+    conn=Depends(get_async_db_connection)):
+    query, params = build_expense_summary_query(
+        parse_summary_group_by(group_by), category_id=category_id, payment_method_id=payment_method_id,
+        start_date=start_date, end_date=end_date)
+    try:
+        rows = await conn.fetch(to_asyncpg_placeholders(query), *params)
+        return [ExpenseSummary(**dict(row)) for row in rows]
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# POST an expense
+@router.post("/expenses", response_model=Expense)
+async def create_expense(expense_data: ExpenseCreate, conn=Depends(get_async_db_connection)):
+    try:
+        new_expense = await conn.fetchrow(INSERT_EXPENSE_ASYNCPG_SQL, *expense_values(expense_data))
+        return Expense(transaction_id=new_expense[0], date=new_expense[1], category_id=new_expense[2], description=new_expense[3],
+                       amount=new_expense[4], vat=new_expense[5], payment_method_id=new_expense[6], business_personal=new_expense[7])
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# POST many expenses in one transaction
+@router.post("/expenses/bulk", response_model=BulkExpenseResult)
+async def create_expenses_bulk(rows: list = Depends(read_bulk_expense_rows), conn=Depends(get_async_db_connection)):
+    valid_rows, errors = validate_bulk_expenses(rows)
+    try:
+        async with conn.transaction():
+            if valid_rows:
+                # Check foreign keys once for the whole batch
+                category_ids = {row[0] for row in await conn.fetch(
+                    "SELECT category_id FROM categories WHERE category_id = ANY($1::int[])",
+                    list({expense.category_id for _, expense in valid_rows}))}
+                payment_method_ids = {row[0] for row in await conn.fetch(
+                    "SELECT payment_method_id FROM payment_methods WHERE payment_method_id = ANY($1::int[])",
+                    list({expense.payment_method_id for _, expense in valid_rows}))}
+                valid_rows = reject_unknown_references(valid_rows, errors, category_ids, payment_method_ids)
+
+            transaction_ids = []
+            if valid_rows:
+                # One statement for the whole batch, columns are sent as arrays and unnested server side
+                columns = list(zip(*[expense_values(expense) for _, expense in valid_rows]))
+                inserted = await conn.fetch(
+                    "INSERT INTO expenses (date, category_id, description, amount, vat, payment_method_id, business_personal) "
+                    "SELECT * FROM unnest($1::date[], $2::int[], $3::text[], $4::numeric[], $5::numeric[], $6::int[], $7::text[]) "
+                    "RETURNING transaction_id",
+                    *[list(column) for column in columns]
+                )
+                transaction_ids = [row[0] for row in inserted]
+
+        return BulkExpenseResult(transaction_ids=transaction_ids, inserted_indexes=[index for index, _ in valid_rows], errors=errors)
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# DELETE an expense
+@router.delete("/expenses")
+async def delete_expense(expense_data: ExpenseDelete, conn=Depends(get_async_db_connection)):
+    try:
+        deleted_expense = await conn.fetchrow("DELETE FROM expenses WHERE transaction_id = $1 RETURNING transaction_id", expense_data.transaction_id)
+        if not deleted_expense:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        return {"message": "Expense deleted successfully"}
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
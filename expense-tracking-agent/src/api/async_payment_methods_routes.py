@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, HTTPException
+import asyncpg
+from src.api.payment_methods_routes import PaymentMethodCreate, PaymentMethodDelete, PaymentMethod
+from src.database.async_db_connection import get_async_db_connection
+from src.database.repositories import SELECT_PAYMENT_METHODS_SQL
+
+# Initialize APIRouter
+router = APIRouter()
+
+# GET all payment methods
+@router.get("/payment_methods", response_model=list[PaymentMethod])
+async def get_payment_methods(conn=Depends(get_async_db_connection)):
+    try:
+        payment_methods = await conn.fetch(SELECT_PAYMENT_METHODS_SQL)
+        return [{"payment_method_id": method[0], "payment_method_name": method[1]} for method in payment_methods]
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# POST a payment method
+@router.post("/payment_methods", response_model=PaymentMethod)
+async def create_payment_method(payment_method_data: PaymentMethodCreate, conn=Depends(get_async_db_connection)):
+    try:
+        method = await conn.fetchrow("INSERT INTO payment_methods (payment_method_name) VALUES ($1) RETURNING payment_method_id, payment_method_name", payment_method_data.payment_method_name)
+        return {"payment_method_id": method[0], "payment_method_name": method[1]}
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# DELETE a payment method
+@router.delete("/payment_methods")
+async def delete_payment_method(payment_method_data: PaymentMethodDelete, conn=Depends(get_async_db_connection)):
+    try:
+        deleted_method = await conn.fetchrow("DELETE FROM payment_methods WHERE payment_method_id = $1 RETURNING payment_method_id", payment_method_data.payment_method_id)
+        if not deleted_method:
+            raise HTTPException(status_code=404, detail="Payment method not found")
+        return {"message": "Payment method deleted successfully"}
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from src.api.response_cache import response_cache
+
+# Initialize APIRouter
+router = APIRouter()
+
+# GET response cache counters
+@router.get("/cache/stats")
+def get_cache_stats():
+    return response_cache.stats()
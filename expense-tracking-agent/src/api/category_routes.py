@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 import psycopg2
-from src.database.db_connection import conn, cursor
+from src.database.db_connection import get_db_cursor
+from src.database.repositories import fetch_categories
 
 # Define Pydantic models for request and response
 class CategoryCreate(BaseModel):
@@ -14,44 +15,37 @@ class Category(BaseModel):
     category_id: int
     category_name: str
 
-# Helper function to close database connection
-def close_db_connection(conn, cursor):
-    cursor.close()
-    conn.close()
-
 # Initialize APIRouter
 router = APIRouter()
 
 # GET all categories
 @router.get("/categories", response_model=list[Category])
-def get_categories():
+def get_categories(cursor=Depends(get_db_cursor)):
     try:
-        cursor.execute("SELECT category_id, category_name FROM categories")
-        categories = cursor.fetchall()
-        return [{"category_id": category[0], "category_name": category[1]} for category in categories]
+        return fetch_categories(cursor)
     except psycopg2.Error as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 # POST a category
 @router.post("/categories", response_model=Category)
-def create_category(category_data: CategoryCreate):
+def create_category(category_data: CategoryCreate, cursor=Depends(get_db_cursor)):
     try:
         cursor.execute("INSERT INTO categories (category_name) VALUES (%s) RETURNING category_id, category_name", (category_data.category_name,))
         category = cursor.fetchone()
-        conn.commit()
+        cursor.connection.commit()
         return {"category_id": category[0], "category_name": category[1]}
     except psycopg2.Error as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 # DELETE a category
 @router.delete("/categories")
-def delete_category(category_data: CategoryDelete):
+def delete_category(category_data: CategoryDelete, cursor=Depends(get_db_cursor)):
     try:
         cursor.execute("DELETE FROM categories WHERE category_name = %s RETURNING category_name", (category_data.category_name,))
         deleted_category = cursor.fetchone()
         if not deleted_category:
             raise HTTPException(status_code=404, detail="Category not found")
-        conn.commit()
+        cursor.connection.commit()
         return {"message": "Category deleted successfully"}
     except psycopg2.Error as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
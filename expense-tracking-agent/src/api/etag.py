@@ -0,0 +1,24 @@
+"""Helpers for conditional GET with ETag / If-None-Match"""
+
+import hashlib
+
+from fastapi import Response
+
+
+def content_etag(body: bytes) -> str:
+    """Strong ETag derived from the response body, so equal bodies always share an ETag"""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header matches etag, using weak comparison as RFC 9110 asks for GET"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return etag.removeprefix("W/") in (candidate.removeprefix("W/") for candidate in candidates)
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
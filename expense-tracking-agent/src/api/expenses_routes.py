@@ -1,41 +1,114 @@
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel, validator
-from src.database.db_connection import conn, cursor
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from src.database.db_connection import get_connection, get_db_cursor
+from src.database.expense_queries import (EXPENSE_COLUMNS, SUMMARY_PERIODS, build_expense_summary_query, build_expenses_query,
+                                         decode_expenses_cursor, encode_expenses_cursor)
+from src.database.expenses import BulkExpenseResult, Expense, ExpenseCreate, save_expense, save_expenses
 from dotenv import load_dotenv
 from datetime import date
 from decimal import Decimal
+from typing import Literal, Optional
+import orjson
 import psycopg2
+import os
 
 load_dotenv()
 
-class ExpenseCreate(BaseModel):
-    date: date
-    category_id: int
-    description: str
-    amount: Decimal 
-    vat: Decimal 
-    payment_method_id: int 
-    business_personal: str
-
-    @validator("date")
-    def validate_date(cls, value):
-        if value > date.today():
-            raise ValueError("Date cannot be in the future")
-        return value
+# Upper bound on rows accepted by POST /expenses/bulk in one request
+BULK_INSERT_MAX_ROWS = int(os.getenv("BULK_INSERT_MAX_ROWS", "50000"))
+# Largest page GET /expenses?limit= may ask for
+EXPENSES_PAGE_MAX_LIMIT = int(os.getenv("EXPENSES_PAGE_MAX_LIMIT", "1000"))
+# Rows fetched per round trip when streaming GET /expenses?stream=true
+EXPENSES_STREAM_BATCH_SIZE = int(os.getenv("EXPENSES_STREAM_BATCH_SIZE", "2000"))
 
 class ExpenseDelete(BaseModel):
     transaction_id: int
 
-class Expense(BaseModel):
-    transaction_id: int
-    date: date
-    category_id: int
-    description: str
+SummaryGroup = Literal["category", "payment_method", "business_personal", "day", "week", "month"]
+
+class ExpenseSummary(BaseModel):
+    # Only the grouped columns are set, unset ones are left out of the response
+    category_id: Optional[int] = None
+    payment_method_id: Optional[int] = None
+    business_personal: Optional[str] = None
+    period: Optional[date] = None
+    expense_count: int
     amount: Decimal
     vat: Decimal
-    payment_method_id: int
-    business_personal: str
 
+def parse_summary_group_by(group_by: list) -> list:
+    group_by = list(dict.fromkeys(group_by))
+    if sum(group in SUMMARY_PERIODS for group in group_by) > 1:
+        raise HTTPException(status_code=400, detail="Group by at most one of day, week and month")
+    return group_by
+
+def parse_expenses_cursor(after: str):
+    if after is None:
+        return None
+    try:
+        return decode_expenses_cursor(after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor, pass the X-Next-Cursor value of the previous page")
+
+def expense_row_to_dict(row) -> dict:
+    return dict(zip(EXPENSE_COLUMNS, row))
+
+def expense_rows_response(rows: list, headers: dict = None) -> Response:
+    """Serialize expense rows straight to JSON with orjson.
+
+    Rows come from build_expenses_query with amounts as text, so the output matches
+    list[Expense] without building and validating a model per row.
+    """
+    return Response(content=orjson.dumps([expense_row_to_dict(row) for row in rows]), media_type="application/json", headers=headers)
+
+def stream_expenses(query: str, params: list):
+    """Yield expenses as NDJSON lines from a server side cursor, fetching EXPENSES_STREAM_BATCH_SIZE rows at a time.
+
+    The connection is checked out here rather than through get_db_cursor because the
+    response body is produced after the request dependencies have been closed.
+    """
+    with get_connection() as conn:
+        with conn.cursor(name="stream_expenses") as cursor:
+            cursor.itersize = EXPENSES_STREAM_BATCH_SIZE
+            cursor.execute(query, tuple(params))
+            for expense in cursor:
+                yield orjson.dumps(expense_row_to_dict(expense)) + b"\n"
+        conn.rollback()
+
+
+async def read_bulk_expense_rows(request: Request) -> list:
+    """Read the bulk request body as a JSON array or, for application/x-ndjson, one JSON object per line"""
+    content_type = request.headers.get("content-type", "")
+
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        rows, buffer = [], b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            rows.extend(line for line in lines if line.strip())
+            if len(rows) > BULK_INSERT_MAX_ROWS:
+                raise HTTPException(status_code=413, detail=f"At most {BULK_INSERT_MAX_ROWS} expenses can be sent at once")
+        if buffer.strip():
+            rows.append(buffer)
+        # Lines are decoded individually so one malformed line only fails that row
+        return [_decode_ndjson_line(line) for line in rows]
+
+    try:
+        rows = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array of expenses")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array of expenses")
+    if len(rows) > BULK_INSERT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_INSERT_MAX_ROWS} expenses can be sent at once")
+    return rows
+
+def _decode_ndjson_line(line: bytes):
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError as e:
+        return e
 
 # Initialize APIRouter
 router = APIRouter()
@@ -46,64 +119,80 @@ def get_expenses(
     category_id: int = None,
     payment_method_id: int = None,
     start_date: date = None, 
-    end_date: date = None):
-    try:
-        # Construct SQL query
-        query = "SELECT * FROM expenses WHERE 1=1"
-        params = []
+    end_date: date = None,
+    limit: int = Query(None, ge=1, le=EXPENSES_PAGE_MAX_LIMIT),
+    after: str = None,
+    stream: bool = False):
+    filters = dict(category_id=category_id, payment_method_id=payment_method_id, start_date=start_date,
+                   end_date=end_date, after=parse_expenses_cursor(after))
+    query, params = build_expenses_query(limit=limit, **filters)
+
+    # The stream checks out its own connection, a pooled cursor would sit unused until the response is sent
+    if stream:
+        return StreamingResponse(stream_expenses(query, params), media_type="application/x-ndjson")
 
-        if category_id is not None:
-            query += " AND category_id = %s"
-            params.append(category_id)
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, tuple(params))
+                expenses = cursor.fetchall()
 
-        if payment_method_id is not None:
-            query += " AND payment_method_id = %s"
-            params.append(payment_method_id)
+        if not expenses and after is None:
+            raise HTTPException(status_code=404, detail="No expenses found for the given filters")
 
-        if start_date is not None:
-            query += " AND date >= %s"
-            params.append(start_date)
+        # A full page means there may be more rows after the last one
+        headers = {}
+        if limit is not None and len(expenses) == limit:
+            headers["X-Next-Cursor"] = encode_expenses_cursor(expenses[-1][1], expenses[-1][0])
 
-        if end_date is not None:
-            query += " AND date <= %s"
-            params.append(end_date)
+        return expense_rows_response(expenses, headers)
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
+# GET totals and VAT of expenses grouped by category, payment method, business/personal and period
+@router.get("/expenses/summary", response_model=list[ExpenseSummary], response_model_exclude_unset=True)
+def get_expenses_summary(
+    group_by: list[SummaryGroup] = Query([]),
+    category_id: int = None,
+    payment_method_id: int = None,
+    start_date: date = None,
+    end_date: date = None,
+    cursor=Depends(get_db_cursor)):
+    query, params = build_expense_summary_query(
+        parse_summary_group_by(group_by), category_id=category_id, payment_method_id=payment_method_id,
+        start_date=start_date, end_date=end_date)
+    try:
         cursor.execute(query, tuple(params))
-        expenses = cursor.fetchall()
-
-        if not expenses:
-            raise HTTPException(status_code=404, detail="No expenses found for the given filters")
-
-        return [Expense(transaction_id=expense[0], date=expense[1], category_id=expense[2], description=expense[3],
-                        amount=expense[4], vat=expense[5], payment_method_id=expense[6], business_personal=expense[7]) for expense in expenses]
+        columns = [column.name for column in cursor.description]
+        return [ExpenseSummary(**dict(zip(columns, row))) for row in cursor.fetchall()]
     except psycopg2.Error as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 # POST an expense
 @router.post("/expenses", response_model=Expense)
-def create_expense(expense_data: ExpenseCreate):
+def create_expense(expense_data: ExpenseCreate, cursor=Depends(get_db_cursor)):
+    try:
+        return save_expense(cursor, expense_data)
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# POST many expenses in one transaction
+@router.post("/expenses/bulk", response_model=BulkExpenseResult)
+def create_expenses_bulk(rows: list = Depends(read_bulk_expense_rows), cursor=Depends(get_db_cursor)):
     try:
-        cursor.execute(
-            "INSERT INTO expenses (date, category_id, description, amount, vat, payment_method_id, business_personal) "
-            "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING transaction_id, date, category_id, description, amount, vat, payment_method_id, business_personal",
-            (expense_data.date, expense_data.category_id, expense_data.description, expense_data.amount, expense_data.vat, expense_data.payment_method_id, expense_data.business_personal)
-        )
-        new_expense = cursor.fetchone()
-        conn.commit()
-        return Expense(transaction_id=new_expense[0], date=new_expense[1], category_id=new_expense[2], description=new_expense[3],
-                       amount=new_expense[4], vat=new_expense[5], payment_method_id=new_expense[6], business_personal=new_expense[7])
+        return save_expenses(cursor, rows)
     except psycopg2.Error as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 # DELETE an expense
 @router.delete("/expenses")
-def delete_expense(expense_data: ExpenseDelete):
+def delete_expense(expense_data: ExpenseDelete, cursor=Depends(get_db_cursor)):
     try:
         cursor.execute("DELETE FROM expenses WHERE transaction_id = %s RETURNING transaction_id", (expense_data.transaction_id,))
         deleted_expense = cursor.fetchone()
         if not deleted_expense:
             raise HTTPException(status_code=404, detail="Expense not found")
-        conn.commit()
+        cursor.connection.commit()
         return {"message": "Expense deleted successfully"}
     except psycopg2.Error as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Response
+from src.api.response_cache import response_cache
+from src.observability.metrics import CONTENT_TYPE, metrics_registry
+
+# Initialize APIRouter
+router = APIRouter()
+
+def collect_response_cache() -> list:
+    stats = response_cache.stats()
+    requests = [({"result": result}, stats[result]) for result in ("hits", "misses", "not_modified", "bypassed")]
+    return [
+        ("expense_tracker_response_cache_requests_total", "counter", "Cacheable GET requests by how the cache answered", requests),
+        ("expense_tracker_response_cache_entries", "gauge", "Responses in the cache", [({}, stats["entries"])]),
+        ("expense_tracker_response_cache_bytes", "gauge", "Bytes of cached response bodies", [({}, stats["bytes"])]),
+        ("expense_tracker_response_cache_invalidations_total", "counter", "Table invalidations", [({}, stats["invalidations"])]),
+        ("expense_tracker_response_cache_evictions_total", "counter", "Responses evicted to stay within the limits", [({}, stats["evictions"])]),
+    ]
+
+metrics_registry.register_collector(collect_response_cache)
+
+# GET metrics of this process in the Prometheus text format
+@router.get("/metrics")
+def get_metrics():
+    return Response(content=metrics_registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,106 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Literal, Optional
+import psycopg2
+import os
+import re
+from src.database.db_connection import get_db_cursor
+from src.database.receipt_jobs import enqueue_receipt_job, get_receipt_job, list_receipt_jobs
+
+# Largest receipt image POST /receipts accepts
+RECEIPT_UPLOAD_MAX_BYTES = int(os.getenv("RECEIPT_UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# File extension of each accepted content type, the graph reads the image type from the extension
+RECEIPT_CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "application/pdf": ".pdf",
+}
+RECEIPT_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".pdf")
+UNSAFE_FILENAME_CHARACTERS = re.compile(r"[^\w.-]")
+
+ReceiptJobStatus = Literal["queued", "running", "review", "saved", "failed"]
+
+class ReceiptJob(BaseModel):
+    job_id: int
+    status: ReceiptJobStatus
+    image_name: str
+    single_pass: bool
+    auto_accept: bool
+    attempts: int
+    worker: Optional[str] = None
+    # GET /reviews/{review_thread_id} once the receipt waits for a review
+    review_thread_id: Optional[str] = None
+    transaction_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+def receipt_image_name(filename: Optional[str], content_type: str) -> str:
+    """A file name safe to write to disk, with the extension of the image type"""
+    content_type = content_type.split(";")[0].strip().lower()
+    name = UNSAFE_FILENAME_CHARACTERS.sub("_", os.path.basename(filename or ""))[:200] or "receipt"
+    if name.lower().endswith(RECEIPT_EXTENSIONS):
+        return name
+    if content_type not in RECEIPT_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail=f"Send a receipt image as one of {', '.join(RECEIPT_CONTENT_TYPES)}")
+    return name + RECEIPT_CONTENT_TYPES[content_type]
+
+async def read_receipt_image(request: Request) -> bytes:
+    """Read the image sent as the raw request body, refusing it as soon as it exceeds RECEIPT_UPLOAD_MAX_BYTES"""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > RECEIPT_UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Receipt images can be at most {RECEIPT_UPLOAD_MAX_BYTES} bytes")
+        chunks.append(chunk)
+    if not size:
+        raise HTTPException(status_code=400, detail="Send the receipt image as the request body")
+    return b"".join(chunks)
+
+# Initialize APIRouter
+router = APIRouter()
+
+# POST a receipt image, it is processed by src/chain/receipt_worker.py
+@router.post("/receipts", response_model=ReceiptJob, status_code=202)
+def create_receipt_job(
+    request: Request,
+    filename: str = None,
+    single_pass: bool = False,
+    auto_accept: bool = False,
+    image: bytes = Depends(read_receipt_image),
+    cursor=Depends(get_db_cursor)):
+    image_name = receipt_image_name(filename, request.headers.get("content-type", ""))
+    try:
+        job = enqueue_receipt_job(cursor, image_name, image, single_pass, auto_accept)
+        cursor.connection.commit()
+        return job
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# GET receipt jobs in upload order, optionally with one status
+@router.get("/receipts", response_model=list[ReceiptJob])
+def get_receipt_jobs(
+    status: ReceiptJobStatus = None,
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = None,
+    cursor=Depends(get_db_cursor)):
+    try:
+        return list_receipt_jobs(cursor, status, limit, after)
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# GET the status of a receipt job
+@router.get("/receipts/{job_id}", response_model=ReceiptJob)
+def get_receipt_job_status(job_id: int, cursor=Depends(get_db_cursor)):
+    try:
+        job = get_receipt_job(cursor, job_id)
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Receipt job not found")
+    return job
@@ -0,0 +1,44 @@
+"""ASGI middleware timing every API request in API_REQUEST_SECONDS"""
+
+import re
+import time
+
+from src.observability.metrics import API_REQUEST_SECONDS, ERRORS
+
+# Numeric path segments are ids, folded so the route label stays low cardinality
+ID_SEGMENT_PATTERN = re.compile(r"/\d+(?=/|$)")
+
+
+def route_label(scope, status: int) -> str:
+    # Requests no route matched would otherwise add a label per scanned path
+    if scope.get("endpoint") is None and status == 404:
+        return "unmatched"
+    return ID_SEGMENT_PATTERN.sub("/{id}", scope["path"])
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            ERRORS.labels("api", type(e).__name__).inc()
+            raise
+        finally:
+            # Streamed responses are timed until their last chunk is sent
+            API_REQUEST_SECONDS.labels(scope["method"], route_label(scope, status), status).observe(time.perf_counter() - start)
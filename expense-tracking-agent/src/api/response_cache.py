@@ -0,0 +1,221 @@
+"""In-process cache of GET responses of the read endpoints.
+
+ResponseCacheMiddleware keys GET /categories, /payment_methods, /expenses and
+/expenses/summary by path and query parameters and stores the serialized body
+with a strong ETag computed from it. A cached request is answered, or gets a
+304 when If-None-Match matches, before routing, so it never checks out a
+database connection. Streamed responses are not cached.
+
+Every table has a generation counter and entries remember the generation they
+were built at, so invalidating a table is a counter increment. Tables are
+invalidated by writes through this process and by the table_changed
+notifications of other processes, see src/database/change_listener.py. While
+the listener is not connected, or RESPONSE_CACHE_ENABLED is false, nothing is
+served from the cache since changes could be missed, but responses still get
+their ETag and conditional requests still get a 304.
+"""
+
+import os
+import threading
+from collections import Counter, OrderedDict
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+from src.api.etag import content_etag, etag_matches, not_modified_response
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Larger responses are served but not stored
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+
+# Path prefix -> table whose writes change the response
+CACHED_TABLES = {
+    "/categories": "categories",
+    "/payment_methods": "payment_methods",
+    "/expenses": "expenses",
+}
+
+# Headers recomputed for every response instead of being stored
+UNCACHED_HEADERS = ("content-length", "etag")
+
+
+def table_for_path(path: str):
+    for prefix, table in CACHED_TABLES.items():
+        if path == prefix or path.startswith(prefix + "/"):
+            return table
+    return None
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, etag: str, headers: dict, table: str, generation: tuple):
+        self.body = body
+        self.etag = etag
+        self.headers = headers
+        self.table = table
+        self.generation = generation
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, max_bytes: int, max_entry_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generations = Counter()
+        # Bumped on every listener connect and disconnect, which invalidates all tables at once
+        self._epoch = 0
+        self._listening = False
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def generation(self, table: str) -> tuple:
+        return self._epoch, self._generations[table]
+
+    def get(self, key):
+        with self._lock:
+            if not self._listening:
+                self._counters["bypassed"] += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != (self._epoch, self._generations[entry.table]):
+                if entry is not None:
+                    self._remove(key)
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry
+
+    def put(self, key, entry: CachedResponse):
+        with self._lock:
+            # The table changed while the response was built, it may already be stale
+            if (not self._listening or entry.generation != (self._epoch, self._generations[entry.table])
+                    or len(entry.body) > self.max_entry_bytes):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(entry.body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def _remove(self, key):
+        self._bytes -= len(self._entries.pop(key).body)
+
+    def invalidate(self, table: str):
+        with self._lock:
+            self._generations[table] += 1
+            self._counters["invalidations"] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self._counters["not_modified"] += 1
+
+    def set_listening(self, listening: bool):
+        """Called by the change listener, entries cached before a disconnect cannot be trusted"""
+        with self._lock:
+            self._listening = listening
+            self._epoch += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "enabled": RESPONSE_CACHE_ENABLED,
+                "listening": self._listening,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._counters["hits"],
+                "misses": self._counters["misses"],
+                "hit_rate": self._counters["hits"] / lookups if lookups else None,
+                "not_modified": self._counters["not_modified"],
+                "bypassed": self._counters["bypassed"],
+                "invalidations": self._counters["invalidations"],
+                "evictions": self._counters["evictions"],
+            }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_ENTRY_BYTES)
+
+
+def is_stream_request(query: list) -> bool:
+    return any(name == "stream" and value.lower() in ("1", "true", "yes", "on") for name, value in query)
+
+
+class ResponseCacheMiddleware:
+    """ASGI middleware serving the read endpoints from response_cache"""
+
+    def __init__(self, app, cache: ResponseCache = response_cache):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        table = table_for_path(scope["path"]) if scope["type"] == "http" else None
+        if table is None:
+            await self.app(scope, receive, send)
+        elif scope["method"] == "GET":
+            await self._cached_get(scope, receive, send, table)
+        elif scope["method"] in ("POST", "PUT", "PATCH", "DELETE"):
+            await self._write(scope, receive, send, table)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _write(self, scope, receive, send, table: str):
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # The notification does the same once the write commits, this makes our own writes
+            # visible immediately. Invalidating after a failed write only costs a cache miss
+            self.cache.invalidate(table)
+
+    async def _cached_get(self, scope, receive, send, table: str):
+        query = parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+        if is_stream_request(query):
+            await self.app(scope, receive, send)
+            return
+
+        key = (scope["path"], tuple(sorted(query)))
+        if_none_match = Headers(scope=scope).get("if-none-match")
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            await self._respond(entry, if_none_match, scope, receive, send)
+            return
+
+        generation = self.cache.generation(table)
+        messages = []
+
+        async def buffer(message):
+            messages.append(message)
+
+        await self.app(scope, receive, buffer)
+
+        start = messages[0] if messages else None
+        if start is None or start["status"] != 200:
+            for message in messages:
+                await send(message)
+            return
+
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+        headers = {
+            name.decode("latin-1"): value.decode("latin-1") for name, value in start["headers"]
+            if name.decode("latin-1").lower() not in UNCACHED_HEADERS
+        }
+        entry = CachedResponse(body, content_etag(body), headers, table, generation)
+        self.cache.put(key, entry)
+        await self._respond(entry, if_none_match, scope, receive, send)
+
+    async def _respond(self, entry: CachedResponse, if_none_match: str, scope, receive, send):
+        if etag_matches(if_none_match, entry.etag):
+            self.cache.count_not_modified()
+            response = not_modified_response(entry.etag)
+        else:
+            response = Response(entry.body, headers={**entry.headers, "ETag": entry.etag})
+        await response(scope, receive, send)
@@ -0,0 +1,95 @@
+from fastapi import APIRouter, HTTPException, Query, Response
+from pydantic import BaseModel
+from typing import Optional
+from src.chain.review_queue import (ReviewInProgressError, ReviewNotFoundError, ReviewStateError, decode_reviews_cursor,
+                                    encode_reviews_cursor, get_review_queue)
+
+# Define Pydantic models for request and response
+class ReviewRevise(BaseModel):
+    instructions: str
+
+class ReviewChangeModel(BaseModel):
+    vision_model_name: str
+
+class Review(BaseModel):
+    thread_id: str
+    image_location: Optional[str] = None
+    single_pass: bool
+    receipt: dict
+    vision_model_name: Optional[str] = None
+    duplicate_receipt: bool
+    # PDF pages beyond PDF_MAX_PAGES the extraction did not read
+    pages_truncated: int = 0
+    # pending, in_progress or failed while listed, saved or not_saved after a decision
+    status: str
+    error: Optional[str] = None
+    transaction_id: Optional[int] = None
+    created_at: Optional[float] = None
+    updated_at: Optional[float] = None
+
+def resume_review(thread_id: str, user_decision: str, **values) -> dict:
+    try:
+        return get_review_queue().resume(thread_id, user_decision, **values)
+    except ReviewNotFoundError:
+        raise HTTPException(status_code=404, detail="Review not found")
+    except ReviewInProgressError:
+        raise HTTPException(status_code=409, detail="A decision on this review is already being processed")
+    except ReviewStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        # The run keeps its checkpoint and is listed as failed, POST /reviews/{thread_id}/retry continues it
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# Initialize APIRouter
+router = APIRouter()
+
+# GET receipts waiting for a review, oldest first
+@router.get("/reviews", response_model=list[Review])
+def get_reviews(response: Response, limit: int = Query(100, ge=1, le=1000), after: str = None):
+    try:
+        position = decode_reviews_cursor(after) if after is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor, pass the X-Next-Cursor value of the previous page")
+
+    reviews = get_review_queue().pending(limit, position)
+    # A full page means there may be more runs after the last one
+    if len(reviews) == limit:
+        response.headers["X-Next-Cursor"] = encode_reviews_cursor(reviews[-1]["created_at"], reviews[-1]["thread_id"])
+    return reviews
+
+# GET one receipt waiting for a review
+@router.get("/reviews/{thread_id}", response_model=Review)
+def get_review(thread_id: str):
+    try:
+        return get_review_queue().get(thread_id)
+    except ReviewNotFoundError:
+        raise HTTPException(status_code=404, detail="Review not found")
+
+# POST accept the receipt and save the expense
+@router.post("/reviews/{thread_id}/accept", response_model=Review)
+def accept_review(thread_id: str):
+    return resume_review(thread_id, "accept")
+
+# POST revise the receipt with the LLM following the instructions, it then waits for a review again
+@router.post("/reviews/{thread_id}/revise", response_model=Review)
+def revise_review(thread_id: str, revise_data: ReviewRevise):
+    return resume_review(thread_id, "revise", review_instructions=revise_data.instructions)
+
+# POST extract the receipt again with another vision model, it then waits for a review again
+@router.post("/reviews/{thread_id}/change_model", response_model=Review)
+def change_review_model(thread_id: str, model_data: ReviewChangeModel):
+    return resume_review(thread_id, "change_model", vision_model_name=model_data.vision_model_name)
+
+# POST continue a failed run from its last checkpoint
+@router.post("/reviews/{thread_id}/retry", response_model=Review)
+def retry_review(thread_id: str):
+    try:
+        return get_review_queue().retry(thread_id)
+    except ReviewNotFoundError:
+        raise HTTPException(status_code=404, detail="Review not found")
+    except ReviewInProgressError:
+        raise HTTPException(status_code=409, detail="This run is already being retried")
+    except ReviewStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -1,17 +1,76 @@
 from fastapi import FastAPI
-from src.api.category_routes import router as category_router
-from src.api.payment_methods_routes import router as payment_methods_router
-from src.api.expenses_routes import router as expenses_router
 from dotenv import load_dotenv
 import os
+from src.api.cache_routes import router as cache_router
+from src.api.metrics_routes import router as metrics_router
+from src.api.request_metrics import RequestMetricsMiddleware
+from src.api.response_cache import RESPONSE_CACHE_ENABLED, ResponseCacheMiddleware, response_cache
+from src.api.receipt_routes import router as receipt_router
+from src.api.review_routes import router as review_router
+from src.database.change_listener import ChangeListener
 
 load_dotenv()
 
+# "sync" serves blocking psycopg2 handlers on the threadpool,
+# "async" serves async handlers on an asyncpg pool
+API_DB_MODE = os.getenv("API_DB_MODE", "sync").lower()
+
 app = FastAPI(
     title="Expense Tracker API",
     version="1.0.0"
 )
 
+app.add_middleware(ResponseCacheMiddleware)
+# Added last so it is outermost and also times requests answered from the cache
+app.add_middleware(RequestMetricsMiddleware)
+
+# Invalidates the response cache when another process writes to a table
+change_listener = ChangeListener(
+    on_change=response_cache.invalidate,
+    on_connected=lambda: response_cache.set_listening(True),
+    on_disconnected=lambda: response_cache.set_listening(False),
+)
+
+@app.on_event("startup")
+def start_change_listener():
+    if RESPONSE_CACHE_ENABLED:
+        change_listener.start()
+
+@app.on_event("shutdown")
+def stop_change_listener():
+    change_listener.stop()
+
+if API_DB_MODE == "async":
+    from src.api.async_category_routes import router as category_router
+    from src.api.async_payment_methods_routes import router as payment_methods_router
+    from src.api.async_expenses_routes import router as expenses_router
+    from src.database.async_db_connection import open_async_connection_pool, close_async_connection_pool
+
+    @app.on_event("startup")
+    async def startup_connection_pool():
+        await open_async_connection_pool()
+
+    @app.on_event("shutdown")
+    async def shutdown_connection_pool():
+        await close_async_connection_pool()
+
+elif API_DB_MODE == "sync":
+    from src.api.category_routes import router as category_router
+    from src.api.payment_methods_routes import router as payment_methods_router
+    from src.api.expenses_routes import router as expenses_router
+    from src.database.db_connection import close_connection_pool
+
+    @app.on_event("shutdown")
+    def shutdown_connection_pool():
+        close_connection_pool()
+
+else:
+    raise ValueError(f"Unknown API_DB_MODE '{API_DB_MODE}', expected 'sync' or 'async'")
+
 app.include_router(category_router)
 app.include_router(payment_methods_router)
-app.include_router(expenses_router)
\ No newline at end of file
+app.include_router(expenses_router)
+app.include_router(cache_router)
+app.include_router(metrics_router)
+app.include_router(review_router)
+app.include_router(receipt_router)
@@ -0,0 +1,47 @@
+from typing import TypedDict, Dict, List, Optional
+
+class AgentState(TypedDict):
+    user_decision: Optional[list]
+    image_location: Optional[str]
+    # Image store handles of the preprocessed JPEG pages, the bytes are only loaded to build the LLM request
+    image_pages: Optional[List[str]]
+    # Size of the original file minus the size of the preprocessed pages
+    image_bytes_saved: Optional[int]
+    # PDF pages beyond PDF_MAX_PAGES that were left out of the extraction
+    pages_truncated: Optional[int]
+    # SHA-256 of the receipt image, keys the extraction cache
+    image_hash: Optional[str]
+    # An expense was already saved from the same image
+    duplicate_receipt: Optional[bool]
+    # ISO date once the normalizer node has read it
+    date: Optional[str]
+    category_id: Optional[int]
+    description: Optional[str]
+    # Decimal strings with two places once normalized, JSON safe for checkpoints and the API
+    amount: Optional[str]
+    vat: Optional[str]
+    payment_method_id: Optional[int]
+    business_personal: Optional[str]
+    category: Optional[str]
+    payment_method: Optional[str]
+    payment_methods: Optional[Dict[int, str]]
+    categories: Optional[Dict[int, str]]
+    vision_model_name: Optional[str]
+    categorizer_model_name: Optional[str]
+    # Extract the category in the json_parser call and skip the categorizer node
+    single_pass: Optional[bool]
+    # What to change, given through the review API instead of typed into modifier
+    review_instructions: Optional[str]
+    # Set by save_expense_to_db once the expense is stored
+    transaction_id: Optional[int]
+
+
+RECEIPT_FIELDS = ("date", "description", "amount", "vat", "business_personal", "payment_method", "payment_method_id", "category", "category_id")
+
+def display_value(value) -> str:
+    """A receipt field as text, amounts may still be floats before the normalizer node"""
+    return "" if value is None else str(value).strip()
+
+def receipt_fields(state: AgentState) -> dict:
+    """The extracted receipt fields of the state, for logging without the lookup tables"""
+    return {field: state.get(field) for field in RECEIPT_FIELDS}
@@ -0,0 +1,287 @@
+"""Process many receipts without a human in the loop.
+
+Runs image_preprocessor -> json_parser -> normalizer -> categorizer for every receipt in a
+directory or manifest on a bounded worker pool, or as coroutines on one
+event loop with --async, with the LLM calls at batch priority in the
+scheduler of llm_scheduler.py, so interactive revisions overtake them. Receipts whose extraction looks complete are saved with one bulk
+request, the rest are appended to a review queue file for a human.
+
+    python -m src.chain.batch_runner receipts/ --workers 8 --llm-requests-per-minute 120
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.chain.agent_state import AgentState
+from src.chain.graph_state import ASYNC_NODES, SYNC_NODES, acreate_graph_state, create_graph_state
+from src.chain.helpers.category_classifier import classifier_metrics
+from src.chain.helpers.http_client import aclose_async_http_client
+from src.chain.helpers.llm import llm_registry
+from src.chain.helpers.llm_scheduler import LLM_PRIORITY_BATCH, llm_priority, llm_scheduler
+from src.chain.nodes.image_preprocessor import PDF_MAX_PAGES
+from src.chain.nodes.normalizer import normalize_fields
+from src.chain.nodes.save_expense_to_db import save_expenses_to_db
+from src.observability.metrics import start_metrics_server
+from src.observability.tracing import configure_logging, span
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".pdf")
+
+# (stage name, node), the nodes are the traced ones of the graph
+PIPELINE = [
+    ("image_preprocessor", SYNC_NODES["image_preprocessor"]),
+    ("json_parser", SYNC_NODES["json_parser"]),
+    ("normalizer", SYNC_NODES["normalizer"]),
+    ("categorizer", SYNC_NODES["categorizer"]),
+]
+
+ASYNC_PIPELINE = [
+    ("image_preprocessor", ASYNC_NODES["image_preprocessor"]),
+    ("json_parser", ASYNC_NODES["json_parser"]),
+    ("normalizer", ASYNC_NODES["normalizer"]),
+    ("categorizer", ASYNC_NODES["categorizer"]),
+]
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ("date", "description", "amount", "vat", "business_personal", "category_id", "payment_method_id")
+
+
+class StageLatencies:
+    def __init__(self):
+        self._latencies = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._latencies[stage].append(seconds)
+
+    def summary(self) -> dict:
+        summary = {}
+        for stage, latencies in self._latencies.items():
+            ordered = sorted(latencies)
+            summary[stage] = {
+                "count": len(ordered),
+                "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p50_ms": ordered[len(ordered) // 2] * 1000,
+                "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            }
+        return summary
+
+
+def load_receipt_paths(source: str) -> list:
+    """Image paths from a directory, or from a manifest file listing one path per line"""
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, file_name) for file_name in os.listdir(source)
+            if file_name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    # Relative paths in a manifest are relative to the manifest itself
+    manifest_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, "r") as file:
+        return [
+            os.path.join(manifest_dir, line.strip()) for line in file
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def review_reasons(state: AgentState) -> list:
+    """Why a receipt cannot be saved without a human looking at it, empty when it can"""
+    # The checks of the normalizer node, on fields it could not repair
+    values, problems, needs_image = normalize_fields(state)
+    reasons = list(dict.fromkeys(problems.values()))
+    reasons += [f"missing {field}" for field in REQUIRED_FIELDS if field not in problems and state.get(field) in (None, "")]
+
+    if state.get("duplicate_receipt"):
+        reasons.append("an expense was already saved from this image")
+    if state.get("pages_truncated"):
+        reasons.append(f"{state['pages_truncated']} PDF pages beyond the first {PDF_MAX_PAGES} were not read")
+
+    return reasons
+
+
+def process_receipt(image_location: str, stage_latencies: StageLatencies, single_pass: bool = False) -> AgentState:
+    # The node spans of one receipt share the trace of this span. The priority is set here, worker threads do not inherit it
+    with span("receipt", image_location=image_location), llm_priority(LLM_PRIORITY_BATCH):
+        state = create_graph_state(single_pass=single_pass)
+        state["image_location"] = image_location
+
+        for stage, node in PIPELINE:
+            # json_parser already picked the category
+            if single_pass and stage == "categorizer":
+                continue
+            start = time.perf_counter()
+            state = node(state)
+            stage_latencies.record(stage, time.perf_counter() - start)
+
+        return state
+
+
+async def aprocess_receipt(image_location: str, stage_latencies: StageLatencies, single_pass: bool = False) -> AgentState:
+    with span("receipt", image_location=image_location), llm_priority(LLM_PRIORITY_BATCH):
+        state = await acreate_graph_state(single_pass=single_pass)
+        state["image_location"] = image_location
+
+        for stage, node in ASYNC_PIPELINE:
+            if single_pass and stage == "categorizer":
+                continue
+            start = time.perf_counter()
+            state = await node(state)
+            stage_latencies.record(stage, time.perf_counter() - start)
+
+        return state
+
+
+def extract_receipts(image_locations: list, workers: int, stage_latencies: StageLatencies,
+                     single_pass: bool) -> list:
+    """(image_location, state, error) for every receipt, processed on a pool of worker threads"""
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process_receipt, image_location, stage_latencies, single_pass): image_location
+            for image_location in image_locations
+        }
+        for future in as_completed(futures):
+            try:
+                results.append((futures[future], future.result(), None))
+            except Exception as e:
+                results.append((futures[future], None, e))
+    return results
+
+
+async def aextract_receipts(image_locations: list, concurrency: int, stage_latencies: StageLatencies,
+                            single_pass: bool) -> list:
+    """Like extract_receipts, with up to concurrency receipts in flight on the running event loop"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def extract(image_location: str) -> tuple:
+        async with semaphore:
+            try:
+                return image_location, await aprocess_receipt(image_location, stage_latencies, single_pass), None
+            except Exception as e:
+                return image_location, None, e
+
+    try:
+        return await asyncio.gather(*(extract(image_location) for image_location in image_locations))
+    finally:
+        # The async connections belong to this event loop
+        await aclose_async_http_client()
+        await llm_registry.aclose()
+
+
+def review_entry(image_location: str, state: AgentState, reasons: list) -> dict:
+    entry = {"image_location": image_location, "reasons": reasons}
+    if state is not None:
+        for field in ("date", "description", "amount", "vat", "business_personal", "category", "payment_method"):
+            entry[field] = state.get(field)
+    return entry
+
+
+def append_review_entries(review_queue_path: str, entries: list):
+    if not entries:
+        return
+    with open(review_queue_path, "a") as file:
+        for entry in entries:
+            file.write(json.dumps(entry, default=str) + "\n")
+
+
+def run_batch(source: str, workers: int, review_queue_path: str, save_batch_size: int,
+              single_pass: bool = False, use_async: bool = False) -> dict:
+    image_locations = load_receipt_paths(source)
+    stage_latencies = StageLatencies()
+    accepted, flagged = [], []
+
+    start = time.perf_counter()
+    if use_async:
+        results = asyncio.run(aextract_receipts(image_locations, workers, stage_latencies, single_pass))
+    else:
+        results = extract_receipts(image_locations, workers, stage_latencies, single_pass)
+
+    for image_location, state, error in results:
+        if error is not None:
+            flagged.append(review_entry(image_location, None, [f"processing failed: {error}"]))
+            continue
+
+        reasons = review_reasons(state)
+        if reasons:
+            flagged.append(review_entry(image_location, state, reasons))
+        else:
+            accepted.append(state)
+
+    # Flagged receipts are on disk before the save starts, so a failing save cannot lose them
+    append_review_entries(review_queue_path, flagged)
+
+    saved = 0
+    for batch_start in range(0, len(accepted), save_batch_size):
+        batch = accepted[batch_start:batch_start + save_batch_size]
+        save_start = time.perf_counter()
+        try:
+            with span("save_expenses_to_db", receipts=len(batch)):
+                result = save_expenses_to_db(batch)
+        except Exception as e:
+            # The whole batch goes to review, the following batches are still saved
+            logger.warning("Failed to save %d receipts: %s", len(batch), e)
+            rejected = [review_entry(state["image_location"], state, [f"save failed: {e}"]) for state in batch]
+        else:
+            stage_latencies.record("save_expenses_to_db", time.perf_counter() - save_start)
+            saved += len(result["transaction_ids"])
+            rejected = [review_entry(batch[error["index"]]["image_location"], batch[error["index"]],
+                                     [f"rejected by API: {error['detail']}"]) for error in result["errors"]]
+        append_review_entries(review_queue_path, rejected)
+        flagged.extend(rejected)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "receipts": len(image_locations),
+        "saved": saved,
+        "flagged_for_review": len(flagged),
+        "elapsed_seconds": elapsed,
+        "receipts_per_minute": len(image_locations) / elapsed * 60 if elapsed else 0.0,
+        "stage_latencies": stage_latencies.summary(),
+        "category_classifier": classifier_metrics.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a directory or manifest of receipt images in batch")
+    parser.add_argument("source", help="Directory of receipt images, or a manifest file with one image path per line")
+    parser.add_argument("--workers", type=int, default=4, help="Receipts processed concurrently")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Process the receipts as coroutines on one event loop instead of worker threads")
+    parser.add_argument("--llm-requests-per-minute", type=float, help="Requests per minute allowed to each model, LLM_REQUESTS_PER_MINUTE by default")
+    parser.add_argument("--llm-tokens-per-minute", type=float, help="Tokens per minute allowed to each model, LLM_TOKENS_PER_MINUTE by default")
+    parser.add_argument("--review-queue", default="review_queue.jsonl", help="File flagged receipts are appended to")
+    parser.add_argument("--save-batch-size", type=int, default=500, help="Receipts saved per bulk request")
+    parser.add_argument("--single-pass", action="store_true", help="Extract the category in the same LLM call as the receipt data")
+    parser.add_argument("--metrics-port", type=int, help="Serve GET /metrics on this port while the batch runs")
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    llm_scheduler.set_default_limits(args.llm_requests_per_minute, args.llm_tokens_per_minute)
+
+    report = run_batch(args.source, args.workers, args.review_queue, args.save_batch_size,
+                       args.single_pass, args.use_async)
+
+    print(f"Processed {report['receipts']} receipts in {report['elapsed_seconds']:.1f}s "
+          f"({report['receipts_per_minute']:.1f} receipts/min)")
+    print(f"Saved {report['saved']}, flagged {report['flagged_for_review']} for review in {args.review_queue}")
+    for stage, latency in report["stage_latencies"].items():
+        print(f"  {stage:<20} n={latency['count']:<5} mean={latency['mean_ms']:.0f}ms "
+              f"p50={latency['p50_ms']:.0f}ms p95={latency['p95_ms']:.0f}ms")
+    classifier = report["category_classifier"]
+    if classifier["predictions"]:
+        print(f"Category classifier answered {classifier['fast_path_hits']} of {classifier['predictions']} receipts "
+              f"({classifier['hit_rate']:.0%}), mean {classifier['mean_latency_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,64 @@
-from datetime import date
-from decimal import Decimal
-from typing import TypedDict, Dict, Optional, Union
-from api.payment_methods_routes import get_payment_methods
-from chain.helpers.get_categories import get_categories
+import asyncio
+from typing import Union
+from src.chain.helpers.get_payment_methods import aget_payment_methods, get_payment_methods
+from src.chain.helpers.get_categories import aget_categories, get_categories
 from langgraph.graph import StateGraph
 
-from src.chain.nodes.image_encoder import image_encoder
-from src.chain.nodes.json_parser import json_parser
-from src.chain.nodes.categorizer import categorizer
-from src.chain.nodes.human_checker import human_checker
-from src.chain.nodes.modifier import modifier
-from src.chain.nodes.save_expense_to_db import save_expense_to_db
-
-class AgentState(TypedDict):
-    user_decision: Optional[list]
-    image_base64: Optional[str]
-    image_location: Optional[str]
-    date: Optional[date]
-    category_id: Optional[int]
-    description: Optional[str]
-    amount: Optional[Decimal]
-    vat: Optional[Decimal]
-    payment_method_id: Optional[int]
-    business_personal: Optional[str]
-    category: Optional[str]
-    payment_method: Optional[str]
-    payment_methods: Optional[Dict[int, str]]
-    categories: Optional[Dict[int, str]]
-    vision_model_name: Optional[str]
-    categorizer_model_name: Optional[str]
-
-def create_graph_state() -> AgentState:
+from src.chain.agent_state import AgentState
+
+from src.chain.nodes.image_preprocessor import aimage_preprocessor, image_preprocessor
+from src.chain.nodes.json_parser import ajson_parser, json_parser
+from src.chain.nodes.normalizer import anormalizer, normalizer
+from src.chain.nodes.categorizer import acategorizer, categorizer
+from src.chain.nodes.human_checker import ahuman_checker, human_checker
+from src.chain.nodes.modifier import amodifier, modifier
+from src.chain.nodes.save_expense_to_db import asave_expense_to_db, save_expense_to_db
+from src.observability.tracing import traced_node
+
+# Every node runs in a node.<name> span and is timed in GRAPH_NODE_SECONDS
+SYNC_NODES = {
+    "image_preprocessor": image_preprocessor,
+    "json_parser": json_parser,
+    "normalizer": normalizer,
+    "categorizer": categorizer,
+    "human_checker": human_checker,
+    "modifier": modifier,
+    "save_expense_to_db": save_expense_to_db,
+}
+SYNC_NODES = {name: traced_node(name, node) for name, node in SYNC_NODES.items()}
+
+ASYNC_NODES = {
+    "image_preprocessor": aimage_preprocessor,
+    "json_parser": ajson_parser,
+    "normalizer": anormalizer,
+    "categorizer": acategorizer,
+    "human_checker": ahuman_checker,
+    "modifier": amodifier,
+    "save_expense_to_db": asave_expense_to_db,
+}
+ASYNC_NODES = {name: traced_node(name, node) for name, node in ASYNC_NODES.items()}
+
+def create_graph_state(single_pass: bool = False) -> AgentState:
 
     categories = get_categories()
     payment_methods = get_payment_methods()
 
+    return initial_graph_state(categories, payment_methods, single_pass)
+
+async def acreate_graph_state(single_pass: bool = False) -> AgentState:
+    categories, payment_methods = await asyncio.gather(aget_categories(), aget_payment_methods())
+
+    return initial_graph_state(categories, payment_methods, single_pass)
+
+def initial_graph_state(categories: dict, payment_methods: dict, single_pass: bool) -> AgentState:
     return {
         "user_decision": None,
-        "image_base64": None,
         "image_location": None,
+        "image_pages": None,
+        "image_bytes_saved": None,
+        "pages_truncated": None,
+        "image_hash": None,
+        "duplicate_receipt": None,
         "date": None,
         "category_id": None,
         "description": None,
@@ -51,23 +71,38 @@ def create_graph_state() -> AgentState:
         "payment_methods": payment_methods,
         "categories": categories,
         "vision_model_name": "gpt-4-vision-preview",
-        "categorizer_model_name": "gpt-4-turbo"
+        "categorizer_model_name": "gpt-4-turbo",
+        "single_pass": single_pass,
+        "review_instructions": None,
+        "transaction_id": None
     }
 
-def setup_agent_graph():
-    agentState = create_graph_state()
-    graph = StateGraph(agentState)
-
-    graph.add_node("image_encoder", image_encoder)
-    graph.add_node("json_parser", json_parser)
-    graph.add_node("categorizer", categorizer)
-    graph.add_node("human_checker", human_checker)
-    graph.add_node("modifier", modifier)
-    graph.add_node("save_expense_to_db", save_expense_to_db)
-
-    graph.add_edge("image_encoder", "json_parser")
-    graph.add_edge("json_parser", "categorizer")
-    graph.add_edge("categorizer", "human_checker")
+def setup_agent_graph(single_pass: bool = False, use_async: bool = False):
+    """Build the receipt graph. With single_pass=True json_parser also picks the category
+    and the categorizer node is left out, the initial state must then be created with
+    create_graph_state(single_pass=True).
+
+    With use_async=True the nodes are coroutines and the compiled graph has to be run
+    with ainvoke or astream, so one event loop can work on many receipts at once."""
+    nodes = ASYNC_NODES if use_async else SYNC_NODES
+    graph = StateGraph(AgentState)
+
+    graph.add_node("image_preprocessor", nodes["image_preprocessor"])
+    graph.add_node("json_parser", nodes["json_parser"])
+    graph.add_node("normalizer", nodes["normalizer"])
+    graph.add_node("human_checker", nodes["human_checker"])
+    graph.add_node("modifier", nodes["modifier"])
+    graph.add_node("save_expense_to_db", nodes["save_expense_to_db"])
+
+    graph.add_edge("image_preprocessor", "json_parser")
+    # Dates, amounts and business_personal are checked and repaired before anything relies on them
+    graph.add_edge("json_parser", "normalizer")
+    if single_pass:
+        graph.add_edge("normalizer", "human_checker")
+    else:
+        graph.add_node("categorizer", nodes["categorizer"])
+        graph.add_edge("normalizer", "categorizer")
+        graph.add_edge("categorizer", "human_checker")
 
     def decide_after_human_checker(state: AgentState) -> Union[str, None]:
 
@@ -93,7 +128,7 @@ def setup_agent_graph():
 
     graph.add_edge("modifier", "human_checker")
 
-    graph.set_entry_point("image_encoder")
+    graph.set_entry_point("image_preprocessor")
     graph.set_finish_point("save_expense_to_db")
 
     return graph
@@ -0,0 +1,204 @@
+"""Local classifier picking the category from the receipt description.
+
+A multinomial naive Bayes model over hashed word unigrams and bigrams, trained
+from the description -> category_id history of the expenses table by
+src.chain.train_category_classifier. Training only adds counts, so new
+expenses are folded in without retraining from scratch. The categorizer node
+asks it first and only calls the LLM when the model is missing, has seen fewer
+than CATEGORY_CLASSIFIER_MIN_EXAMPLES expenses or is less confident than
+CATEGORY_CLASSIFIER_THRESHOLD.
+"""
+
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+
+from src.observability.metrics import metrics_registry
+
+CATEGORY_CLASSIFIER_ENABLED = os.getenv("CATEGORY_CLASSIFIER_ENABLED", "true").lower() in ("1", "true", "yes")
+CATEGORY_CLASSIFIER_PATH = os.getenv("CATEGORY_CLASSIFIER_PATH", os.path.join(".cache", "category_classifier.pkl"))
+CATEGORY_CLASSIFIER_THRESHOLD = float(os.getenv("CATEGORY_CLASSIFIER_THRESHOLD", "0.9"))
+CATEGORY_CLASSIFIER_MIN_EXAMPLES = int(os.getenv("CATEGORY_CLASSIFIER_MIN_EXAMPLES", "200"))
+CATEGORY_CLASSIFIER_HASH_FEATURES = int(os.getenv("CATEGORY_CLASSIFIER_HASH_FEATURES", str(2 ** 20)))
+
+TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d+")
+
+
+class CategoryClassifier:
+    def __init__(self, hash_features: int = CATEGORY_CLASSIFIER_HASH_FEATURES, alpha: float = 1.0):
+        self.hash_features = hash_features
+        # Laplace smoothing
+        self.alpha = alpha
+        self.class_counts = Counter()
+        self.feature_counts = defaultdict(Counter)
+        self.feature_totals = Counter()
+        self.vocabulary = set()
+        self.examples = 0
+        # Highest expenses.transaction_id trained on, incremental training continues after it
+        self.trained_through_transaction_id = 0
+        # Every expense is predicted before it is trained on, which estimates accuracy on unseen receipts
+        self.evaluation = Counter()
+
+    def features(self, description: str) -> Counter:
+        tokens = TOKEN_PATTERN.findall(description.casefold())
+        grams = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+        return Counter(zlib.crc32(gram.encode("utf-8")) % self.hash_features for gram in grams)
+
+    def predict_proba(self, description: str) -> dict:
+        """{category_id: probability}, empty when no word of the description was seen in training"""
+        features = {feature: count for feature, count in self.features(description).items() if feature in self.vocabulary}
+        if not features or not self.examples:
+            return {}
+
+        vocabulary_size = len(self.vocabulary)
+        scores = {}
+        for category_id, class_count in self.class_counts.items():
+            counts = self.feature_counts[category_id]
+            denominator = self.feature_totals[category_id] + self.alpha * vocabulary_size
+            score = math.log(class_count / self.examples)
+            for feature, count in features.items():
+                score += count * math.log((counts.get(feature, 0) + self.alpha) / denominator)
+            scores[category_id] = score
+
+        # Softmax of the log scores
+        highest = max(scores.values())
+        exponentials = {category_id: math.exp(score - highest) for category_id, score in scores.items()}
+        total = sum(exponentials.values())
+        return {category_id: value / total for category_id, value in exponentials.items()}
+
+    def predict(self, description: str) -> tuple:
+        """(category_id, confidence), (None, 0.0) when the model knows nothing about the description"""
+        probabilities = self.predict_proba(description)
+        if not probabilities:
+            return None, 0.0
+        category_id = max(probabilities, key=probabilities.get)
+        return category_id, probabilities[category_id]
+
+    def partial_fit(self, rows):
+        """Add (transaction_id, description, category_id) rows to the model"""
+        for transaction_id, description, category_id in rows:
+            if self.examples >= CATEGORY_CLASSIFIER_MIN_EXAMPLES:
+                predicted_category_id, confidence = self.predict(description)
+                self.evaluation["evaluated"] += 1
+                self.evaluation["correct"] += predicted_category_id == category_id
+                if confidence >= CATEGORY_CLASSIFIER_THRESHOLD:
+                    self.evaluation["confident"] += 1
+                    self.evaluation["confident_correct"] += predicted_category_id == category_id
+
+            features = self.features(description)
+            self.class_counts[category_id] += 1
+            self.feature_counts[category_id].update(features)
+            self.feature_totals[category_id] += sum(features.values())
+            self.vocabulary.update(features)
+            self.examples += 1
+            self.trained_through_transaction_id = max(self.trained_through_transaction_id, transaction_id)
+
+    def evaluation_summary(self) -> dict:
+        evaluated = self.evaluation["evaluated"]
+        confident = self.evaluation["confident"]
+        return {
+            "examples": self.examples,
+            "evaluated": evaluated,
+            "accuracy": self.evaluation["correct"] / evaluated if evaluated else None,
+            # Share of receipts that would skip the LLM, and how often the model is right on those
+            "fast_path_rate": confident / evaluated if evaluated else None,
+            "fast_path_accuracy": self.evaluation["confident_correct"] / confident if confident else None,
+        }
+
+    def save(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Replace the file atomically, running processes may be reloading it
+        fd, temp_path = tempfile.mkstemp(dir=directory or ".")
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path: str) -> "CategoryClassifier":
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+
+class ClassifierMetrics:
+    """How often the fast path answered and how long predictions took, in this process"""
+
+    def __init__(self):
+        self.predictions = 0
+        self.fast_path_hits = 0
+        self.latency_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool, seconds: float):
+        with self._lock:
+            self.predictions += 1
+            self.fast_path_hits += hit
+            self.latency_seconds += seconds
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "predictions": self.predictions,
+                "fast_path_hits": self.fast_path_hits,
+                "llm_fallbacks": self.predictions - self.fast_path_hits,
+                "hit_rate": self.fast_path_hits / self.predictions if self.predictions else None,
+                "mean_latency_ms": self.latency_seconds / self.predictions * 1000 if self.predictions else None,
+            }
+
+
+    def collect(self) -> list:
+        """Samples for metrics_registry"""
+        with self._lock:
+            predictions, hits, seconds = self.predictions, self.fast_path_hits, self.latency_seconds
+        return [
+            ("expense_tracker_category_classifier_predictions_total", "counter",
+             "Receipts the local classifier was asked about, by whether it answered or left them to the LLM",
+             [({"result": "answered"}, hits), ({"result": "llm_fallback"}, predictions - hits)]),
+            ("expense_tracker_category_classifier_seconds_total", "counter", "Time spent in local predictions",
+             [({}, seconds)]),
+        ]
+
+
+classifier_metrics = ClassifierMetrics()
+metrics_registry.register_collector(classifier_metrics.collect)
+
+_loaded = {"model": None, "mtime": None}
+_load_lock = threading.Lock()
+
+
+def get_category_classifier():
+    """The trained model, reloaded when the training job replaces the file, None without one"""
+    if not CATEGORY_CLASSIFIER_ENABLED:
+        return None
+    try:
+        mtime = os.stat(CATEGORY_CLASSIFIER_PATH).st_mtime
+    except FileNotFoundError:
+        return None
+
+    if _loaded["mtime"] != mtime:
+        with _load_lock:
+            if _loaded["mtime"] != mtime:
+                _loaded["model"] = CategoryClassifier.load(CATEGORY_CLASSIFIER_PATH)
+                _loaded["mtime"] = mtime
+    return _loaded["model"]
+
+
+def classify_category(description, categories: dict):
+    """The category_id when the local model is confident enough, None to fall back to the LLM.
+    Predictions of categories missing from categories count as misses"""
+    classifier = get_category_classifier()
+    if classifier is None or not description or classifier.examples < CATEGORY_CLASSIFIER_MIN_EXAMPLES:
+        return None
+
+    start = time.perf_counter()
+    category_id, confidence = classifier.predict(str(description))
+    hit = category_id in categories and confidence >= CATEGORY_CLASSIFIER_THRESHOLD
+    classifier_metrics.record(hit, time.perf_counter() - start)
+    return category_id if hit else None
@@ -0,0 +1,137 @@
+"""Where the graph reads categories and payment methods and saves expenses.
+
+EXPENSES_BACKEND selects the backend:
+- http: calls the expenses API at API_BASE_URL, for a graph running apart from the API
+- database: runs the validation and save functions of src/database/expenses.py on the pooled
+  psycopg2 connection of src/database/db_connection.py, skipping the HTTP round
+  trip when the graph runs next to the database. The API does not need to be up.
+
+Both backends return the same shapes, so nodes and LookupCache do not know
+which one they use. The async methods of the database backend run the sync
+ones in a worker thread, the pool blocks when all connections are in use.
+"""
+
+import asyncio
+import os
+
+import psycopg2
+from dotenv import load_dotenv
+from pydantic import ValidationError
+
+from src.chain.helpers.http_client import arequest_api, request_api
+from src.database.db_connection import get_connection
+from src.database.expenses import ExpenseCreate, save_expense, save_expenses
+from src.database.repositories import fetch_categories, fetch_payment_methods
+
+load_dotenv()
+
+# "http" or "database"
+EXPENSES_BACKEND = os.getenv("EXPENSES_BACKEND", "http").lower()
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000").rstrip("/")
+
+
+class HttpExpensesBackend:
+    """Expenses API client, lookups are revalidated with If-None-Match"""
+
+    def __init__(self, base_url: str = API_BASE_URL):
+        self.base_url = base_url.rstrip("/")
+
+    def fetch_lookup(self, table: str, etag: str = None) -> tuple:
+        """Return (rows, etag) of GET /<table>, rows is None when the table is unchanged since etag"""
+        response = request_api("GET", f"{self.base_url}/{table}", headers=self._lookup_headers(etag))
+        return self._lookup_result(table, response)
+
+    async def afetch_lookup(self, table: str, etag: str = None) -> tuple:
+        response = await arequest_api("GET", f"{self.base_url}/{table}", headers=self._lookup_headers(etag))
+        return self._lookup_result(table, response)
+
+    def save_expense(self, expense_data: dict) -> tuple:
+        """Return (transaction_id, None) once saved or (None, error) when the expense was rejected"""
+        response = request_api("POST", f"{self.base_url}/expenses", json=expense_data)
+        return self._saved_expense(response)
+
+    async def asave_expense(self, expense_data: dict) -> tuple:
+        response = await arequest_api("POST", f"{self.base_url}/expenses", json=expense_data)
+        return self._saved_expense(response)
+
+    def save_expenses(self, expenses_data: list) -> dict:
+        """Save many expenses at once, returning transaction_ids, inserted_indexes and per-row errors"""
+        response = request_api("POST", f"{self.base_url}/expenses/bulk", json=expenses_data)
+        if response.status_code in (200, 201):
+            return response.json()
+        raise Exception("Failed to save expenses in bulk. Status code: {}".format(response.status_code))
+
+    def _lookup_headers(self, etag: str) -> dict:
+        headers = {"accept": "application/json"}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        return headers
+
+    def _lookup_result(self, table: str, response) -> tuple:
+        if response.status_code == 304:
+            return None, response.headers.get("ETag")
+        if response.status_code == 200:
+            return response.json(), response.headers.get("ETag")
+        raise Exception("Failed to fetch {}. Status code: {}".format(table, response.status_code))
+
+    def _saved_expense(self, response) -> tuple:
+        if response.status_code in (200, 201):
+            return response.json()["transaction_id"], None
+        return None, f"status code {response.status_code}"
+
+
+class DatabaseExpensesBackend:
+    """Runs the service and repository functions of the API directly on the pooled database connection"""
+
+    LOOKUP_FETCHERS = {"categories": fetch_categories, "payment_methods": fetch_payment_methods}
+
+    def fetch_lookup(self, table: str, etag: str = None) -> tuple:
+        """Return (rows, None), the tables are small so they are read again instead of revalidated"""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                rows = self.LOOKUP_FETCHERS[table](cursor)
+            conn.rollback()
+        return rows, None
+
+    async def afetch_lookup(self, table: str, etag: str = None) -> tuple:
+        return await asyncio.to_thread(self.fetch_lookup, table, etag)
+
+    def save_expense(self, expense_data: dict) -> tuple:
+        try:
+            expense = ExpenseCreate.model_validate(expense_data)
+        except ValidationError as e:
+            return None, f"invalid expense with {e.error_count()} errors"
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    return save_expense(cursor, expense).transaction_id, None
+        except psycopg2.Error as e:
+            return None, type(e).__name__
+
+    async def asave_expense(self, expense_data: dict) -> tuple:
+        return await asyncio.to_thread(self.save_expense, expense_data)
+
+    def save_expenses(self, expenses_data: list) -> dict:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                return save_expenses(cursor, expenses_data).model_dump()
+
+
+EXPENSES_BACKENDS = {"http": HttpExpensesBackend, "database": DatabaseExpensesBackend}
+
+_backend = None
+
+
+def get_expenses_backend():
+    global _backend
+    if _backend is None:
+        if EXPENSES_BACKEND not in EXPENSES_BACKENDS:
+            raise ValueError(f"EXPENSES_BACKEND must be one of {', '.join(EXPENSES_BACKENDS)}, got {EXPENSES_BACKEND!r}")
+        _backend = EXPENSES_BACKENDS[EXPENSES_BACKEND]()
+    return _backend
+
+
+def set_expenses_backend(backend):
+    """Use backend for the rest of the process, e.g. a DatabaseExpensesBackend in a script that owns the database"""
+    global _backend
+    _backend = backend
@@ -0,0 +1,148 @@
+"""Persistent cache of LLM extraction results keyed by image content.
+
+Entries are keyed by the SHA-256 of the receipt image, the model name and a
+fingerprint of the prompt and output schema, so re-running a receipt with the
+same model and prompt returns the stored result without calling the model.
+The cache is a SQLite file and evicts least recently used entries once it
+holds more than EXTRACTION_CACHE_MAX_ENTRIES entries or EXTRACTION_CACHE_MAX_BYTES
+bytes of results.
+
+The same file records the images whose expense was saved, with the
+transaction_id, so a receipt counts as a duplicate only once it was saved,
+not when it was merely extracted before. These rows are small and never
+evicted.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join(".cache", "extraction_cache.sqlite3"))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "100000"))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+create_table_extraction_cache = """
+CREATE TABLE IF NOT EXISTS extraction_cache (
+    cache_key TEXT PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    result TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS extraction_cache_image_hash_idx ON extraction_cache (image_hash);
+CREATE INDEX IF NOT EXISTS extraction_cache_last_accessed_at_idx ON extraction_cache (last_accessed_at);
+CREATE TABLE IF NOT EXISTS saved_receipts (
+    image_hash TEXT PRIMARY KEY,
+    transaction_id INTEGER NOT NULL,
+    saved_at REAL NOT NULL
+);
+"""
+
+
+def hash_image(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def prompt_version(prompt: str, schema, *extra: str) -> str:
+    """Fingerprint of everything besides the image and model that shapes the answer,
+    extra takes further settings such as the image preprocessing"""
+    fingerprint = hashlib.sha256()
+    fingerprint.update(prompt.encode("utf-8"))
+    fingerprint.update(json.dumps(schema.schema(), sort_keys=True).encode("utf-8"))
+    for value in extra:
+        fingerprint.update(value.encode("utf-8"))
+    return fingerprint.hexdigest()[:16]
+
+
+class ExtractionCache:
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # sqlite3 connections cannot be shared between threads, so each thread opens its own
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._initialized:
+                conn.executescript(create_table_extraction_cache)
+                self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(image_hash: str, model_name: str, prompt_version: str) -> str:
+        return f"{image_hash}:{model_name}:{prompt_version}"
+
+    def get(self, cache_key: str):
+        """Return the cached result dict, or None on a miss"""
+        conn = self._connection()
+        row = conn.execute("SELECT result FROM extraction_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE extraction_cache SET last_accessed_at = ? WHERE cache_key = ?", (time.time(), cache_key))
+        return json.loads(row[0])
+
+    def put(self, cache_key: str, image_hash: str, model_name: str, prompt_version: str, result: dict):
+        conn = self._connection()
+        serialized = json.dumps(result, default=str)
+        now = time.time()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache "
+                "(cache_key, image_hash, model_name, prompt_version, result, size_bytes, created_at, last_accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (cache_key, image_hash, model_name, prompt_version, serialized, len(serialized), now, now)
+            )
+            self._evict(conn)
+
+    def saved_transaction_id(self, image_hash: str):
+        """transaction_id of the expense saved from this exact image, None when it was never saved"""
+        conn = self._connection()
+        row = conn.execute("SELECT transaction_id FROM saved_receipts WHERE image_hash = ?", (image_hash,)).fetchone()
+        return row[0] if row is not None else None
+
+    def record_saved(self, saved: list):
+        """Record (image_hash, transaction_id) pairs of saved expenses"""
+        if not saved:
+            return
+        conn = self._connection()
+        now = time.time()
+        with self._write_lock, conn:
+            conn.executemany("INSERT OR REPLACE INTO saved_receipts (image_hash, transaction_id, saved_at) VALUES (?, ?, ?)",
+                             [(image_hash, transaction_id, now) for image_hash, transaction_id in saved])
+
+    def _evict(self, conn: sqlite3.Connection):
+        entries, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM extraction_cache").fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        # Walk entries from least to most recently used until both limits hold
+        to_delete = []
+        for cache_key, size_bytes in conn.execute("SELECT cache_key, size_bytes FROM extraction_cache ORDER BY last_accessed_at"):
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            to_delete.append((cache_key,))
+            entries -= 1
+            total_bytes -= size_bytes
+        conn.executemany("DELETE FROM extraction_cache WHERE cache_key = ?", to_delete)
+
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_MAX_ENTRIES, EXTRACTION_CACHE_MAX_BYTES) if EXTRACTION_CACHE_ENABLED else None
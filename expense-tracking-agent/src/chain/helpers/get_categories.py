@@ -1,16 +1,24 @@
-import requests
+from src.chain.helpers.lookup_cache import LookupCache
 
-CATEGORIES_ENDPOINT_URL = 'http://localhost:8000/categories'
+categories_cache = LookupCache("categories", "category_id", "category_name")
 
 def get_categories() -> dict:
-    response = requests.get(CATEGORIES_ENDPOINT_URL, headers={"accept": "application/json"})
-
-    if response.status_code == 200:
-        categories = response.json()
-        categories_dict = {
-            item["category_id"]: item["category_name"]
-            for item in categories
-        }
-        return categories_dict
-    else:
-        raise Exception("Failed to fetch categories. Status code: {}".format(response.status_code))
\ No newline at end of file
+    return categories_cache.get_all()
+
+def get_category_id(category_name: str):
+    return categories_cache.get_id(category_name)
+
+def get_category_name(category_id: int):
+    return categories_cache.get_name(category_id)
+
+async def aget_categories() -> dict:
+    return await categories_cache.aget_all()
+
+async def aget_category_id(category_name: str):
+    return await categories_cache.aget_id(category_name)
+
+async def aget_category_name(category_id: int):
+    return await categories_cache.aget_name(category_id)
+
+def invalidate_categories():
+    categories_cache.invalidate()
@@ -1,17 +1,24 @@
-import requests
+from src.chain.helpers.lookup_cache import LookupCache
 
-PAYMENT_METHODS_ENDPOINT_URL = "http://localhost:8000/payment_methods"
+payment_methods_cache = LookupCache("payment_methods", "payment_method_id", "payment_method_name")
 
 def get_payment_methods() -> dict:
-    
-    response = requests.get(PAYMENT_METHODS_ENDPOINT_URL, headers={"accept": "application/json"})
-
-    if response.status_code == 200:
-        payment_methods = response.json()
-        payment_methods_dict = {
-            item["payment_method_id"]: item["payment_method_name"]
-            for item in payment_methods
-        }
-        return payment_methods_dict
-    else:
-        raise Exception("Failed to fetch payment methods. Status code: {}".format(response.status_code))
+    return payment_methods_cache.get_all()
+
+def get_payment_method_id(payment_method_name: str):
+    return payment_methods_cache.get_id(payment_method_name)
+
+def get_payment_method_name(payment_method_id: int):
+    return payment_methods_cache.get_name(payment_method_id)
+
+async def aget_payment_methods() -> dict:
+    return await payment_methods_cache.aget_all()
+
+async def aget_payment_method_id(payment_method_name: str):
+    return await payment_methods_cache.aget_id(payment_method_name)
+
+async def aget_payment_method_name(payment_method_id: int):
+    return await payment_methods_cache.aget_name(payment_method_id)
+
+def invalidate_payment_methods():
+    payment_methods_cache.invalidate()
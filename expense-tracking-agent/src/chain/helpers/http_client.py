@@ -0,0 +1,80 @@
+"""Shared httpx.AsyncClient for the async nodes and helpers calling the expenses API.
+
+An AsyncClient's pooled connections belong to the event loop that opened them,
+so there is one client per running loop. Close it with aclose_async_http_client
+before the loop ends.
+
+request_api and arequest_api wrap every call to the API in an http.request
+span and record it in HTTP_CLIENT_SECONDS.
+"""
+
+import asyncio
+import os
+import re
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+from src.observability.metrics import HTTP_CLIENT_SECONDS
+from src.observability.tracing import span
+
+API_HTTP_MAX_CONNECTIONS = int(os.getenv("API_HTTP_MAX_CONNECTIONS", "50"))
+API_HTTP_TIMEOUT = float(os.getenv("API_HTTP_TIMEOUT", "30"))
+
+_clients = weakref.WeakKeyDictionary()
+
+# Numeric path segments are ids, they are folded so the endpoint label stays low cardinality
+ID_SEGMENT_PATTERN = re.compile(r"/\d+(?=/|$)")
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(max_connections=API_HTTP_MAX_CONNECTIONS, max_keepalive_connections=API_HTTP_MAX_CONNECTIONS)
+        client = httpx.AsyncClient(limits=limits, timeout=API_HTTP_TIMEOUT)
+        _clients[loop] = client
+    return client
+
+
+async def aclose_async_http_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def endpoint_label(url: str) -> str:
+    return ID_SEGMENT_PATTERN.sub("/{id}", urlsplit(url).path) or "/"
+
+
+def request_api(method: str, url: str, **kwargs) -> requests.Response:
+    """requests.request timed as an http.request span"""
+    endpoint = endpoint_label(url)
+    status = "error"
+    start = time.perf_counter()
+    with span("http.request", method=method, endpoint=endpoint) as current:
+        try:
+            response = requests.request(method, url, **kwargs)
+            status = response.status_code
+            current.set(status=status)
+            return response
+        finally:
+            HTTP_CLIENT_SECONDS.labels(method, endpoint, status).observe(time.perf_counter() - start)
+
+
+async def arequest_api(method: str, url: str, **kwargs) -> httpx.Response:
+    """Like request_api on the shared AsyncClient of the running loop"""
+    endpoint = endpoint_label(url)
+    status = "error"
+    start = time.perf_counter()
+    with span("http.request", method=method, endpoint=endpoint) as current:
+        try:
+            response = await get_async_http_client().request(method, url, **kwargs)
+            status = response.status_code
+            current.set(status=status)
+            return response
+        finally:
+            HTTP_CLIENT_SECONDS.labels(method, endpoint, status).observe(time.perf_counter() - start)
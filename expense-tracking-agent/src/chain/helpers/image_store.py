@@ -0,0 +1,135 @@
+"""Content addressed store for receipt images.
+
+The graph state only carries the SHA-256 handles returned by put, the bytes
+stay on disk until the LLM request is built and the image is base64 encoded.
+
+Pages are shared by every run of the same image, so they are not deleted with
+a run. Instead put sweeps the store at most every IMAGE_STORE_SWEEP_INTERVAL_SECONDS,
+deleting the pages not used for IMAGE_STORE_MAX_AGE_SECONDS, then the least
+recently used ones until the store holds at most IMAGE_STORE_MAX_BYTES. Reading
+or storing a page again marks it as used, so the pages of a receipt waiting
+for its review stay while it is revised.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", ".image_store")
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+IMAGE_STORE_MAX_AGE_SECONDS = float(os.getenv("IMAGE_STORE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+IMAGE_STORE_SWEEP_INTERVAL_SECONDS = float(os.getenv("IMAGE_STORE_SWEEP_INTERVAL_SECONDS", "600"))
+
+logger = logging.getLogger(__name__)
+
+
+class ImageStore:
+    def __init__(self, directory: str, max_bytes: int = None, max_age_seconds: float = None, sweep_interval_seconds: float = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _path(self, handle: str) -> str:
+        # Two levels of sharding keep directories small
+        return os.path.join(self.directory, handle[:2], handle[2:4], handle)
+
+    def put(self, image_bytes: bytes) -> str:
+        """Store image_bytes and return their handle, storing the same bytes twice is a no-op"""
+        handle = hashlib.sha256(image_bytes).hexdigest()
+        path = self._path(handle)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial image
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as file:
+                file.write(image_bytes)
+            os.replace(temp_path, path)
+        else:
+            self._touch(path)
+        self._maybe_sweep()
+        return handle
+
+    def get(self, handle: str) -> bytes:
+        path = self._path(handle)
+        with open(path, "rb") as file:
+            image_bytes = file.read()
+        self._touch(path)
+        return image_bytes
+
+    def get_base64(self, handle: str) -> str:
+        return base64.b64encode(self.get(handle)).decode("utf-8")
+
+    def exists(self, handle: str) -> bool:
+        return os.path.exists(self._path(handle))
+
+    def size(self, handle: str) -> int:
+        return os.path.getsize(self._path(handle))
+
+    def delete(self, handle: str):
+        try:
+            os.remove(self._path(handle))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _touch(path: str):
+        # The modification time is the last use, the sweep deletes the oldest first
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _maybe_sweep(self):
+        if self.max_bytes is None and self.max_age_seconds is None:
+            return
+        if time.monotonic() - self._last_sweep < self.sweep_interval_seconds:
+            return
+        # One thread sweeps, the others carry on storing
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sweep = time.monotonic()
+            self.sweep()
+        except OSError as e:
+            logger.warning("Failed to sweep the image store %s: %s", self.directory, e)
+        finally:
+            self._sweep_lock.release()
+
+    def sweep(self) -> int:
+        """Delete the pages over the age and size limits, returns how many were deleted"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        total_bytes = sum(size for _, size, _ in files)
+        oldest_kept = time.time() - self.max_age_seconds if self.max_age_seconds is not None else None
+        deleted = 0
+        for mtime, size, path in files:
+            too_old = oldest_kept is not None and mtime < oldest_kept
+            too_large = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not too_old and not too_large:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            deleted += 1
+        return deleted
+
+
+image_store = ImageStore(IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES, IMAGE_STORE_MAX_AGE_SECONDS, IMAGE_STORE_SWEEP_INTERVAL_SECONDS)
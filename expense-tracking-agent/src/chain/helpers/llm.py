@@ -0,0 +1,188 @@
+"""Registry of structured chat models shared by the graph nodes.
+
+Building ChatOpenAI(...).with_structured_output(schema) creates new OpenAI
+clients and converts the schema to a function definition, so each
+(model name, schema, temperature) is built once and reused. All models share
+one keep-alive httpx.Client for invoke and one httpx.AsyncClient for ainvoke,
+so requests to the API reuse open connections instead of doing a TLS
+handshake per call.
+
+Every model reports to LLMMetricsCallback, which records request latency,
+token usage and estimated cost per model and per node, the node being the
+span the request runs in.
+
+invoke and ainvoke of the models go through llm_scheduler, which keeps every
+model within its rate limits and retries throttled calls, see llm_scheduler.py.
+"""
+
+import json
+import os
+import threading
+import time
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_openai import ChatOpenAI
+
+from src.chain.helpers.llm_scheduler import llm_scheduler, record_llm_usage
+from src.observability.metrics import ERRORS, LLM_COST_USD, LLM_PROMPT_TOKENS, LLM_REQUEST_SECONDS, LLM_TOKENS
+from src.observability.tracing import current_span, set_span_attributes
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# Seconds an idle connection is kept open
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+
+# US dollars per million (prompt, completion) tokens, matched on the longest model name prefix.
+# LLM_PRICES takes the same mapping as JSON to add models or follow price changes
+LLM_PRICES_PER_MILLION_TOKENS = {
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4-vision-preview": (10.0, 30.0),
+    "gpt-4-1106-vision-preview": (10.0, 30.0),
+    "gpt-4o": (5.0, 15.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
+    **{model: tuple(prices) for model, prices in json.loads(os.getenv("LLM_PRICES", "{}")).items()},
+}
+
+
+def llm_cost_usd(model_name: str, prompt_tokens: int, completion_tokens: int):
+    """Estimated cost of a request, None for a model without a known price"""
+    matches = [model for model in LLM_PRICES_PER_MILLION_TOKENS if model_name.startswith(model)]
+    if not matches:
+        return None
+    prompt_price, completion_price = LLM_PRICES_PER_MILLION_TOKENS[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Records every chat completion request of one model in the LLM metrics"""
+
+    # Called on the caller's context, so current_span() is the node making the request
+    run_inline = True
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        span_ = current_span()
+        self._started[run_id] = (time.perf_counter(), span_.name if span_ is not None else "none")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        seconds, node = self._finish(run_id)
+        llm_output = response.llm_output or {}
+        # The response names the exact model version, the price table matches it by prefix
+        model_name = llm_output.get("model_name") or self.model_name
+        usage = llm_output.get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+
+        LLM_REQUEST_SECONDS.labels(self.model_name, node).observe(seconds)
+        LLM_TOKENS.labels(self.model_name, node, "prompt").inc(prompt_tokens)
+        LLM_PROMPT_TOKENS.labels(self.model_name, node).observe(prompt_tokens)
+        LLM_TOKENS.labels(self.model_name, node, "completion").inc(completion_tokens)
+        record_llm_usage(prompt_tokens + completion_tokens)
+        cost = llm_cost_usd(model_name, prompt_tokens, completion_tokens)
+        if cost is not None:
+            LLM_COST_USD.labels(self.model_name, node).inc(cost)
+        set_span_attributes(llm_model=model_name, llm_ms=round(seconds * 1000, 3), prompt_tokens=prompt_tokens,
+                            completion_tokens=completion_tokens, llm_cost_usd=cost)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        seconds, node = self._finish(run_id)
+        LLM_REQUEST_SECONDS.labels(self.model_name, node).observe(seconds)
+        ERRORS.labels("llm", type(error).__name__).inc()
+
+    def _finish(self, run_id) -> tuple:
+        started, node = self._started.pop(run_id, (None, "none"))
+        return (time.perf_counter() - started if started is not None else 0.0), node
+
+
+class ScheduledLLM:
+    """A structured chat model whose invoke and ainvoke wait for llm_scheduler"""
+
+    def __init__(self, model_name: str, schema, model):
+        self.model_name = model_name
+        self.schema = schema
+        self.model = model
+
+    def invoke(self, messages: list, priority: int = None):
+        return llm_scheduler.call(self.model_name, self.schema, messages, self.model.invoke, priority)
+
+    async def ainvoke(self, messages: list, priority: int = None):
+        return await llm_scheduler.acall(self.model_name, self.schema, messages, self.model.ainvoke, priority)
+
+
+class LLMRegistry:
+    def __init__(self):
+        self._models = {}
+        self._http_client = None
+        self._http_async_client = None
+        self._lock = threading.Lock()
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+
+    def get(self, model_name: str, schema, temperature: float = 0):
+        key = (model_name, schema, temperature)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                if self._http_client is None:
+                    self._http_client = httpx.Client(limits=self._limits(), timeout=LLM_REQUEST_TIMEOUT)
+                    self._http_async_client = httpx.AsyncClient(limits=self._limits(), timeout=LLM_REQUEST_TIMEOUT)
+                model = ScheduledLLM(model_name, schema, ChatOpenAI(
+                    temperature=temperature,
+                    model=model_name,
+                    http_client=self._http_client,
+                    http_async_client=self._http_async_client,
+                    # Retries go through the scheduler, so they count against the rate limits
+                    max_retries=0 if llm_scheduler.enabled else 2,
+                    callbacks=[LLMMetricsCallback(model_name)],
+                ).with_structured_output(schema))
+                self._models[key] = model
+        return model
+
+    def _reset(self) -> tuple:
+        with self._lock:
+            clients = (self._http_client, self._http_async_client)
+            self._models = {}
+            self._http_client = None
+            self._http_async_client = None
+        return clients
+
+    def close(self):
+        """Close the shared connections, models are rebuilt on the next get"""
+        http_client, http_async_client = self._reset()
+        if http_client is not None:
+            http_client.close()
+
+    async def aclose(self):
+        """Like close, and also closes the async connections. Call it on the event loop that used them"""
+        http_client, http_async_client = self._reset()
+        if http_client is not None:
+            http_client.close()
+            await http_async_client.aclose()
+
+
+llm_registry = LLMRegistry()
+
+
+def get_structured_llm(model_name: str, schema, temperature: float = 0):
+    """Chat model returning instances of schema through function calling"""
+    return llm_registry.get(model_name, schema, temperature)
+
+
+async def ainvoke_structured_llm(model_name: str, schema, messages: list, temperature: float = 0, priority: int = None):
+    """Async variant of get_structured_llm(...).invoke(messages) on the shared async connections"""
+    return await llm_registry.get(model_name, schema, temperature).ainvoke(messages, priority)
@@ -0,0 +1,407 @@
+"""Scheduler every structured LLM call of the graph goes through.
+
+Each model has a requests per minute and a tokens per minute budget, token
+buckets refilled continuously, and an adaptive concurrency limit (AIMD):
+- the limit grows by 1/limit after every call that answered within
+  LLM_LATENCY_TOLERANCE times the recent fastest latency, about one slot per round trip
+- a 429 halves it, at most once per round trip, and pauses the model for the
+  Retry-After the API asked for. A slow call shrinks it by LLM_AIMD_SLOW_FACTOR
+
+Waiting calls are started by priority, then in arrival order, so an
+interactive revision overtakes a batch backfill waiting for the same model.
+
+The tokens of a call are estimated before it is sent: the prompt text with
+tiktoken, images from their resolution the way the vision API bills them,
+the function schema, and LLM_COMPLETION_TOKENS_ESTIMATE for the answer. Once
+the response reports its usage the difference is settled with the budget.
+
+Calls failing with 429, a 5xx, a timeout or a connection error are retried up
+to LLM_MAX_RETRIES times through the scheduler, the OpenAI client's own
+retries are turned off so they do not bypass it.
+"""
+
+import asyncio
+import base64
+import heapq
+import io
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+import openai
+import tiktoken
+from PIL import Image
+
+from src.observability.metrics import metrics_registry
+
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Budgets of a model without an entry in LLM_RATE_LIMITS
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "150000"))
+# JSON {"model prefix": [requests per minute, tokens per minute]}, matched on the longest prefix
+LLM_RATE_LIMITS = {model: tuple(limits) for model, limits in json.loads(os.getenv("LLM_RATE_LIMITS", "{}")).items()}
+LLM_INITIAL_CONCURRENCY = float(os.getenv("LLM_INITIAL_CONCURRENCY", "4"))
+LLM_MAX_CONCURRENCY = float(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_AIMD_DECREASE = float(os.getenv("LLM_AIMD_DECREASE", "0.5"))
+LLM_AIMD_SLOW_FACTOR = float(os.getenv("LLM_AIMD_SLOW_FACTOR", "0.9"))
+LLM_LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "3"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+# Seconds before the first retry of a failure without Retry-After, doubled for every further retry
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "1"))
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "200"))
+
+LLM_PRIORITY_INTERACTIVE = 0
+LLM_PRIORITY_NORMAL = 1
+LLM_PRIORITY_BATCH = 2
+
+# Tokens of an image whose resolution cannot be read, a 1024x1024 image in high detail
+IMAGE_TOKENS_FALLBACK = 765
+# Seconds an async waiter sleeps before checking again for a free concurrency slot
+ASYNC_POLL_SECONDS = 0.01
+
+_priority = ContextVar("llm_priority", default=LLM_PRIORITY_NORMAL)
+_reservation = ContextVar("llm_reservation", default=None)
+
+
+@contextmanager
+def llm_priority(priority: int):
+    """Schedule the LLM calls made inside the block, also from nodes it runs, with this priority"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def record_llm_usage(total_tokens: int):
+    """Called with the usage the response reported, settles the estimate of the call being made"""
+    reservation = _reservation.get()
+    if reservation is not None:
+        reservation.used_tokens = total_tokens
+
+
+@lru_cache(maxsize=16)
+def get_encoding(model_name: str):
+    # tiktoken downloads its tables on first use, without them tokens are estimated from characters
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_text_tokens(model_name: str, text: str) -> int:
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def image_size(url: str) -> tuple:
+    """(width, height) of a data URL image, (None, None) when it cannot be read"""
+    if not url.startswith("data:"):
+        return None, None
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+
+def image_tokens(url: str, detail: str = "auto") -> int:
+    """Tokens the vision API bills for an image: 85 plus 170 per 512px tile once scaled to fit 2048px and 768px on the short side"""
+    if detail == "low":
+        return 85
+    width, height = image_size(url)
+    if width is None:
+        return IMAGE_TOKENS_FALLBACK
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+@lru_cache(maxsize=64)
+def schema_tokens(model_name: str, schema) -> int:
+    return count_text_tokens(model_name, json.dumps(schema.schema()))
+
+
+def estimate_tokens(model_name: str, messages: list, schema=None) -> int:
+    """Prompt and expected completion tokens of a chat completion request"""
+    tokens = LLM_COMPLETION_TOKENS_ESTIMATE + (schema_tokens(model_name, schema) if schema is not None else 0)
+    for message in messages:
+        # Role and separators of every message
+        tokens += 4
+        content = message.content
+        if isinstance(content, str):
+            tokens += count_text_tokens(model_name, content)
+            continue
+        for part in content:
+            if isinstance(part, str):
+                tokens += count_text_tokens(model_name, part)
+            elif part.get("type") == "text":
+                tokens += count_text_tokens(model_name, part["text"])
+            elif part.get("type") == "image_url":
+                image_url = part["image_url"]
+                if isinstance(image_url, str):
+                    tokens += image_tokens(image_url)
+                else:
+                    tokens += image_tokens(image_url["url"], image_url.get("detail", "auto"))
+    return tokens
+
+
+def retry_after_seconds(error: Exception, attempt: int):
+    """Seconds to wait before retrying a failed call, None when the error is not worth a retry"""
+    if isinstance(error, openai.RateLimitError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            pass
+    elif not isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return None
+    # Jitter keeps the calls throttled together from coming back together
+    return LLM_RETRY_BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.0)
+
+
+class TokenBucket:
+    """Allowance of per_minute units refilled continuously, not thread safe on its own"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated_at = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        # A call larger than the whole budget starts once the bucket is full
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    __slots__ = ("tokens", "used_tokens", "started_at")
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.used_tokens = None
+        self.started_at = time.monotonic()
+
+
+class ModelScheduler:
+    """Budgets, concurrency limit and queue of the calls to one model"""
+
+    def __init__(self, model_name: str, requests_per_minute: float, tokens_per_minute: float):
+        self.model_name = model_name
+        self.limit = min(LLM_INITIAL_CONCURRENCY, LLM_MAX_CONCURRENCY)
+        self.in_flight = 0
+        self.throttled = 0
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._next_decrease_at = 0.0
+        self._base_latency = None
+
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def _enqueue(self, priority: int) -> tuple:
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _leave(self, ticket: tuple):
+        with self._condition:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+            self._condition.notify_all()
+
+    def _try_start(self, ticket: tuple, tokens: int):
+        """With the lock held, start the call and return 0 when it may go, otherwise the seconds to wait, None until a call ends"""
+        if self._waiting[0] != ticket or self.in_flight >= max(1, int(self.limit)):
+            return None
+        now = time.monotonic()
+        wait = max(self._paused_until - now, self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        heapq.heappop(self._waiting)
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        self.in_flight += 1
+        # The next call in the queue may be able to start as well
+        self._condition.notify_all()
+        return 0
+
+    def acquire(self, tokens: int, priority: int) -> Reservation:
+        ticket = self._enqueue(priority)
+        try:
+            with self._condition:
+                while (wait := self._try_start(ticket, tokens)) != 0:
+                    self._condition.wait(wait)
+        except BaseException:
+            self._leave(ticket)
+            raise
+        return Reservation(tokens)
+
+    async def aacquire(self, tokens: int, priority: int) -> Reservation:
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_start(ticket, tokens)
+                if wait == 0:
+                    return Reservation(tokens)
+                await asyncio.sleep(wait if wait is not None else ASYNC_POLL_SECONDS)
+        except BaseException:
+            self._leave(ticket)
+            raise
+
+    def release(self, reservation: Reservation, throttled_for: float = None, failed: bool = False):
+        """End a call: settle its tokens and adjust the concurrency limit from how it went"""
+        now = time.monotonic()
+        latency = now - reservation.started_at
+        with self._condition:
+            self.in_flight -= 1
+            if reservation.used_tokens is not None:
+                self._tokens.give_back(reservation.tokens - reservation.used_tokens)
+            if throttled_for is not None:
+                self.throttled += 1
+                self._paused_until = max(self._paused_until, now + throttled_for)
+                # Calls sent together are throttled together, one round trip of 429s is one decrease
+                if now >= self._next_decrease_at:
+                    self.limit = max(1.0, self.limit * LLM_AIMD_DECREASE)
+                    self._next_decrease_at = now + (self._base_latency or 1.0)
+            elif not failed:
+                # The base latency creeps up so it follows the API getting slower for good
+                self._base_latency = latency if self._base_latency is None else min(latency, self._base_latency * 1.02)
+                if latency > self._base_latency * LLM_LATENCY_TOLERANCE:
+                    self.limit = max(1.0, self.limit * LLM_AIMD_SLOW_FACTOR)
+                else:
+                    self.limit = min(LLM_MAX_CONCURRENCY, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class LLMScheduler:
+    def __init__(self):
+        self.enabled = LLM_SCHEDULER_ENABLED
+        self._models = {}
+        self._lock = threading.Lock()
+        self.requests_per_minute = LLM_REQUESTS_PER_MINUTE
+        self.tokens_per_minute = LLM_TOKENS_PER_MINUTE
+
+    def set_default_limits(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        """Change the budgets of models without an entry in LLM_RATE_LIMITS, before any call is made"""
+        with self._lock:
+            self.requests_per_minute = requests_per_minute or self.requests_per_minute
+            self.tokens_per_minute = tokens_per_minute or self.tokens_per_minute
+            self._models = {}
+
+    def model(self, model_name: str) -> ModelScheduler:
+        scheduler = self._models.get(model_name)
+        if scheduler is None:
+            with self._lock:
+                scheduler = self._models.get(model_name)
+                if scheduler is None:
+                    matches = [model for model in LLM_RATE_LIMITS if model_name.startswith(model)]
+                    limits = LLM_RATE_LIMITS[max(matches, key=len)] if matches else (self.requests_per_minute, self.tokens_per_minute)
+                    scheduler = self._models[model_name] = ModelScheduler(model_name, *limits)
+        return scheduler
+
+    def call(self, model_name: str, schema, messages: list, invoke, priority: int = None):
+        """invoke(messages) once the budgets of model_name allow it, retried on throttling and transient errors"""
+        if not self.enabled:
+            return invoke(messages)
+        scheduler = self.model(model_name)
+        tokens = estimate_tokens(model_name, messages, schema)
+        priority = _priority.get() if priority is None else priority
+        for attempt in itertools.count():
+            reservation = scheduler.acquire(tokens, priority)
+            token = _reservation.set(reservation)
+            try:
+                result = invoke(messages)
+            except Exception as e:
+                wait = self._release_failed(scheduler, reservation, e, attempt)
+                if wait is None:
+                    raise
+                time.sleep(wait)
+                continue
+            finally:
+                _reservation.reset(token)
+            scheduler.release(reservation)
+            return result
+
+    async def acall(self, model_name: str, schema, messages: list, ainvoke, priority: int = None):
+        """Like call for a coroutine function ainvoke"""
+        if not self.enabled:
+            return await ainvoke(messages)
+        scheduler = self.model(model_name)
+        tokens = estimate_tokens(model_name, messages, schema)
+        priority = _priority.get() if priority is None else priority
+        for attempt in itertools.count():
+            reservation = await scheduler.aacquire(tokens, priority)
+            token = _reservation.set(reservation)
+            try:
+                result = await ainvoke(messages)
+            except Exception as e:
+                wait = self._release_failed(scheduler, reservation, e, attempt)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+                continue
+            finally:
+                _reservation.reset(token)
+            scheduler.release(reservation)
+            return result
+
+    def _release_failed(self, scheduler: ModelScheduler, reservation: Reservation, error: Exception, attempt: int):
+        """Release the call and return the seconds to wait before retrying it, None to give up"""
+        wait = retry_after_seconds(error, attempt)
+        throttled = isinstance(error, openai.RateLimitError)
+        scheduler.release(reservation, throttled_for=wait if throttled else None, failed=True)
+        if wait is None or attempt >= LLM_MAX_RETRIES:
+            return None
+        # A throttled call waits in the queue until the model's pause is over
+        return 0.0 if throttled else wait
+
+    def collect(self) -> list:
+        """Samples for metrics_registry"""
+        with self._lock:
+            models = list(self._models.values())
+        return [
+            ("expense_tracker_llm_concurrency_limit", "gauge", "Adaptive limit of concurrent calls per model",
+             [({"model": model.model_name}, model.limit) for model in models]),
+            ("expense_tracker_llm_in_flight", "gauge", "Calls being made per model",
+             [({"model": model.model_name}, model.in_flight) for model in models]),
+            ("expense_tracker_llm_queued", "gauge", "Calls waiting for a budget or a concurrency slot per model",
+             [({"model": model.model_name}, model.queued()) for model in models]),
+            ("expense_tracker_llm_throttled_total", "counter", "Calls the API answered with 429 per model",
+             [({"model": model.model_name}, model.throttled) for model in models]),
+        ]
+
+
+llm_scheduler = LLMScheduler()
+
+metrics_registry.register_collector(llm_scheduler.collect)
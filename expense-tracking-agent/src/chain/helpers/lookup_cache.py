@@ -0,0 +1,110 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from src.chain.helpers.expenses_backend import get_expenses_backend
+
+# Seconds a fetched lookup table is used before it is revalidated with the backend
+LOOKUP_CACHE_TTL_SECONDS = float(os.getenv("LOOKUP_CACHE_TTL_SECONDS", "300"))
+
+
+class LookupCache:
+    """In-process cache of an id -> name lookup table read through the expenses backend.
+
+    Once the TTL expires the table is revalidated, on the http backend with
+    If-None-Match so an unchanged table costs a 304 without a body. Names are
+    matched case insensitively by get_id. The a-prefixed methods do the same
+    without blocking the event loop.
+    """
+
+    def __init__(self, table: str, id_field: str, name_field: str, ttl_seconds: float = LOOKUP_CACHE_TTL_SECONDS):
+        self.table = table
+        self.id_field = id_field
+        self.name_field = name_field
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # asyncio.Lock is bound to the loop it is first used on
+        self._async_locks = weakref.WeakKeyDictionary()
+        self._names_by_id = None
+        self._ids_by_name = None
+        self._etag = None
+        self._expires_at = 0.0
+
+    def get_all(self) -> dict:
+        """Return a copy of the whole table as {id: name}"""
+        return dict(self._get_names_by_id())
+
+    def get_name(self, item_id: int):
+        return self._get_names_by_id().get(item_id)
+
+    def get_id(self, name: str):
+        if name is None:
+            return None
+        self._get_names_by_id()
+        return self._ids_by_name.get(name.strip().casefold())
+
+    async def aget_all(self) -> dict:
+        return dict(await self._aget_names_by_id())
+
+    async def aget_name(self, item_id: int):
+        return (await self._aget_names_by_id()).get(item_id)
+
+    async def aget_id(self, name: str):
+        if name is None:
+            return None
+        await self._aget_names_by_id()
+        return self._ids_by_name.get(name.strip().casefold())
+
+    def invalidate(self):
+        """Force the next lookup to go to the backend, e.g. after adding a category"""
+        with self._lock:
+            self._names_by_id = None
+            self._ids_by_name = None
+            self._etag = None
+            self._expires_at = 0.0
+
+    def _get_names_by_id(self) -> dict:
+        if self._is_fresh():
+            return self._names_by_id
+
+        with self._lock:
+            # Another thread may have refreshed the table while we waited for the lock
+            if not self._is_fresh():
+                self._refresh()
+            return self._names_by_id
+
+    def _is_fresh(self) -> bool:
+        return self._names_by_id is not None and time.monotonic() < self._expires_at
+
+    async def _aget_names_by_id(self) -> dict:
+        if self._is_fresh():
+            return self._names_by_id
+
+        loop = asyncio.get_running_loop()
+        lock = self._async_locks.get(loop)
+        if lock is None:
+            lock = self._async_locks[loop] = asyncio.Lock()
+        async with lock:
+            # Another task may have refreshed the table while we waited for the lock
+            if not self._is_fresh():
+                rows, etag = await get_expenses_backend().afetch_lookup(self.table, self._cached_etag())
+                self._apply_rows(rows, etag)
+            return self._names_by_id
+
+    def _cached_etag(self):
+        return self._etag if self._names_by_id is not None else None
+
+    def _refresh(self):
+        rows, etag = get_expenses_backend().fetch_lookup(self.table, self._cached_etag())
+        self._apply_rows(rows, etag)
+
+    def _apply_rows(self, rows, etag):
+        """Store the rows the backend returned, None means the cached table is still current"""
+        if rows is not None:
+            names_by_id = {item[self.id_field]: item[self.name_field] for item in rows}
+            self._ids_by_name = {name.strip().casefold(): item_id for item_id, name in names_by_id.items()}
+            self._names_by_id = names_by_id
+            self._etag = etag
+        self._expires_at = time.monotonic() + self.ttl_seconds
@@ -0,0 +1,38 @@
+"""Structured output schemas whose category and payment method are restricted to the lookup tables.
+
+The names are sent once per call as the enum of a function parameter instead
+of also being joined into the prompt text, and function calling keeps the
+answer to one of them, so the name always resolves to an id. A schema is
+built once per list of names and reused, so the function definition at the
+start of the request stays byte for byte the same between calls and the
+provider's prompt caching applies to it.
+"""
+
+from functools import lru_cache
+from typing import Literal
+
+from langchain_core.pydantic_v1 import Field, create_model
+
+CATEGORY_DESCRIPTION = "The category the receipt belongs to"
+PAYMENT_METHOD_DESCRIPTION = "Indicate the payment method"
+
+
+def lookup_names(lookup: dict) -> tuple:
+    """Names of an {id: name} table in id order, so the schema does not change with the order the table was read in"""
+    return tuple(name for _, name in sorted(lookup.items()))
+
+
+def lookup_field(names: tuple, description: str) -> tuple:
+    # Literal needs at least one value, an empty table leaves the field free
+    return (Literal[names] if names else str), Field(description=description)
+
+
+@lru_cache(maxsize=32)
+def with_lookup_fields(schema, payment_method_names: tuple = None, category_names: tuple = None) -> type:
+    """schema with payment_method and category restricted to the given names, the fields left out when None"""
+    fields = {}
+    if payment_method_names is not None:
+        fields["payment_method"] = lookup_field(payment_method_names, PAYMENT_METHOD_DESCRIPTION)
+    if category_names is not None:
+        fields["category"] = lookup_field(category_names, CATEGORY_DESCRIPTION)
+    return create_model(schema.__name__, __base__=schema, **fields)
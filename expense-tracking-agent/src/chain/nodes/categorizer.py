@@ -1,27 +1,26 @@
+import asyncio
+
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI  
 from langchain_core.messages import HumanMessage
 
-from chain.graph_state import AgentState
-from chain.helpers.get_categories import get_categories  
+from src.chain.agent_state import AgentState, receipt_fields
+from src.chain.helpers.category_classifier import classify_category
+from src.chain.helpers.get_categories import aget_categories, aget_category_id, get_categories, get_category_id
+from src.chain.helpers.get_payment_methods import aget_payment_method_id, get_payment_method_id
+from src.chain.helpers.llm import ainvoke_structured_llm, get_structured_llm
+from src.chain.helpers.lookup_schema import lookup_names, with_lookup_fields
+from src.observability.tracing import set_span_attributes
 
 class Category(BaseModel):
     "This contains information of the receipt category"
     category: str = Field(description="This describes the category of the receipt")
 
 
-def categorizer(state: AgentState) -> AgentState:
-    receipt_date = state.get("date", None)
-    receipt_description = state.get("description", None)
-    receipt_amount = state.get("amount", None)
-    receipt_vat = state.get("vat", None)
-    receipt_business_personal = state.get("business_personal", None)
-    receipt_payment_method = state.get("payment_method", None)
-
-    category_list = get_categories().values()
+# The instruction comes first and the receipt last, so every call starts with the same tokens.
+# The category names are the enum of the schema, not repeated here
+SYSTEM_PROMPT_TEMPLATE = """
+    Please select the category best suited for the receipt summarized below.
 
-    SYSTEM_PROMPT_TEMPLATE = """
     The following is a summary information of the receipt 
     - date = {receipt_date}
     - description = {receipt_description}
@@ -29,53 +28,76 @@ def categorizer(state: AgentState) -> AgentState:
     - vat = {receipt_vat} 
     - business_personal = {receipt_business_personal}
     - payment_method = {receipt_payment_method} 
-    
-    Based on the information above, Please select the category best suited for the
-    information in the following list:
-    {category_list}
     """
 
-    prompt = ChatPromptTemplate.format_messages([
-        ["system", SYSTEM_PROMPT_TEMPLATE.format(
-            receipt_date=receipt_date, receipt_description=receipt_description, receipt_amount=receipt_amount, 
-            receipt_vat=receipt_vat, receipt_business_personal=receipt_business_personal, receipt_payment_method=receipt_payment_method,
-            category_list=", ".join(category_list)
-        )]
-    ])
 
-    categorizer_model_name = state.get("categorizer_model_name", "gpt-3.5-turbo")
+def get_category_schema(categories: dict) -> type:
+    return with_lookup_fields(Category, category_names=lookup_names(categories))
+
+
+def build_categorizer_messages(state: AgentState) -> list:
+    receipt_date = state.get("date", None)
+    receipt_description = state.get("description", None)
+    receipt_amount = state.get("amount", None)
+    receipt_vat = state.get("vat", None)
+    receipt_business_personal = state.get("business_personal", None)
+    receipt_payment_method = state.get("payment_method", None)
+
+    prompt = SYSTEM_PROMPT_TEMPLATE.format(
+        receipt_date=receipt_date, receipt_description=receipt_description, receipt_amount=receipt_amount, 
+        receipt_vat=receipt_vat, receipt_business_personal=receipt_business_personal, receipt_payment_method=receipt_payment_method
+    )
 
-    llm = ChatOpenAI(temperature=0, model=categorizer_model_name)
-    structured_llm = llm.with_structured_output(Category)
     prompt_message = { "type": "text", "text": prompt}
-    messages = HumanMessage(content=[prompt_message])
-    response = structured_llm.invoke([messages])
-    selected_category = response.dict().get("category", None)
+    return [HumanMessage(content=[prompt_message])]
+
 
+def get_categorizer_model_name(state: AgentState) -> str:
+    return state.get("categorizer_model_name", "gpt-3.5-turbo")
+
+
+def update_state_with_category(state: AgentState, selected_category, category_id, payment_method_id) -> AgentState:
     new_state = state.copy()
 
     new_state["category"] = selected_category
+    # The ids come from the name indexes of the lookup caches
+    new_state["category_id"] = category_id
+    new_state["payment_method_id"] = payment_method_id
 
-    # Set category_id on new state
-    if "category" in new_state and "categories" in new_state:
-        categories = new_state["categories"]
-        category = new_state["category"]
-
-        for key, value in categories.items():
-            if value == category:
-                new_state["category_id"] = key 
-                break
-
-    # Set payment_method_id on new state
-    if "payment_method" in new_state and "payment_methods" in new_state:
-        payment_methods = new_state["payment_methods"]
-        payment_method = new_state["payment_method"]
-
-        for key, value in payment_methods.items():
-            if value == payment_method:
-                new_state["payment_method_id"] = key 
-                break
-    
-    print("New agent state after using categorizer: ", new_state)
+    set_span_attributes(receipt=receipt_fields(new_state))
     return new_state
 
+
+def categorize_locally(state: AgentState):
+    """The category name picked by the local classifier, None when the LLM has to decide"""
+    categories = state.get("categories") or {}
+    category_id = classify_category(state.get("description"), categories)
+    set_span_attributes(categorized_by="classifier" if category_id is not None else "llm")
+    return categories[category_id] if category_id is not None else None
+
+
+def categorizer(state: AgentState) -> AgentState:
+    # Obvious receipts are categorized without a round trip to the LLM
+    selected_category = categorize_locally(state)
+    if selected_category is None:
+        structured_llm = get_structured_llm(get_categorizer_model_name(state), get_category_schema(get_categories()))
+        response = structured_llm.invoke(build_categorizer_messages(state))
+        selected_category = response.dict().get("category", None)
+
+    return update_state_with_category(state, selected_category, get_category_id(selected_category),
+                                      get_payment_method_id(state.get("payment_method")))
+
+
+async def acategorizer(state: AgentState) -> AgentState:
+    selected_category = categorize_locally(state)
+    if selected_category is None:
+        categories = await aget_categories()
+        response = await ainvoke_structured_llm(get_categorizer_model_name(state), get_category_schema(categories),
+                                                build_categorizer_messages(state))
+        selected_category = response.dict().get("category", None)
+
+    category_id, payment_method_id = await asyncio.gather(
+        aget_category_id(selected_category),
+        aget_payment_method_id(state.get("payment_method")),
+    )
+    return update_state_with_category(state, selected_category, category_id, payment_method_id)
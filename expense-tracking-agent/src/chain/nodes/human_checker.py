@@ -1,14 +1,18 @@
-from src.chain.graph_state import AgentState
+import asyncio
 
+from src.chain.agent_state import AgentState, display_value
+from src.observability.tracing import set_span_attributes
+
+USER_DECISION_PROMPT = "Choose a(accept), change_model(m) or r(revise): "
 
-def human_checker(state: AgentState) -> AgentState:
 
-    receipt_date = state.get("date", None).strip()
-    receipt_description = state.get("description", None).strip()
-    receipt_amount = state.get("amount", None).strip()
-    receipt_vat = state.get("vat", None).strip()
-    receipt_business_personal = state.get("business_personal", None).strip()
-    receipt_payment_method = state.get("payment_method", None).strip()
+def print_receipt_summary(state: AgentState):
+    receipt_date = display_value(state.get("date"))
+    receipt_description = display_value(state.get("description"))
+    receipt_amount = display_value(state.get("amount"))
+    receipt_vat = display_value(state.get("vat"))
+    receipt_business_personal = display_value(state.get("business_personal"))
+    receipt_payment_method = display_value(state.get("payment_method"))
 
     RECEIPT_INFORMATION = f"""
     The following is a summary information of the receipt 
@@ -22,10 +26,14 @@ def human_checker(state: AgentState) -> AgentState:
     
     # This shows receipt information to the human in the loop for verification
     print(RECEIPT_INFORMATION)
+    if state.get("duplicate_receipt"):
+        print("Warning: an expense was already saved from this receipt image")
+    if state.get("pages_truncated"):
+        print(f"Warning: {state['pages_truncated']} pages of this PDF were not read, check the amounts against the full receipt")
 
-    new_state = state.copy()
 
-    choice = input("Choose a(accept), change_model(m) or r(revise): ")
+def apply_user_decision(state: AgentState, choice: str) -> AgentState:
+    new_state = state.copy()
 
     if choice.strip() == "a":
         new_state["user_decision"] = "accept"
@@ -37,4 +45,16 @@ def human_checker(state: AgentState) -> AgentState:
     else:
         new_state["user_decision"] = None
 
+    set_span_attributes(user_decision=new_state["user_decision"])
     return new_state
+
+
+def human_checker(state: AgentState) -> AgentState:
+    print_receipt_summary(state)
+    return apply_user_decision(state, input(USER_DECISION_PROMPT))
+
+
+async def ahuman_checker(state: AgentState) -> AgentState:
+    print_receipt_summary(state)
+    # input blocks, so it waits in a thread while the event loop serves other receipts
+    return apply_user_decision(state, await asyncio.to_thread(input, USER_DECISION_PROMPT))
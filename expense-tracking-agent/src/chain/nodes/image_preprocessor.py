@@ -0,0 +1,116 @@
+import asyncio
+import os
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageOps
+
+from src.chain.agent_state import AgentState
+from src.chain.helpers.extraction_cache import extraction_cache, hash_image
+from src.chain.helpers.image_store import image_store
+from src.observability.tracing import set_span_attributes
+
+# Longest side of the image sent to the vision model, in pixels
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "true").lower() in ("1", "true", "yes")
+IMAGE_AUTOCROP = os.getenv("IMAGE_AUTOCROP", "true").lower() in ("1", "true", "yes")
+# Pixels differing from the background by more than this count as receipt content when cropping
+AUTOCROP_THRESHOLD = int(os.getenv("AUTOCROP_THRESHOLD", "40"))
+AUTOCROP_MARGIN = int(os.getenv("AUTOCROP_MARGIN", "16"))
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "150"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "5"))
+
+
+def preprocessing_fingerprint() -> str:
+    """Identifies the settings, so cached extractions of differently processed images are kept apart"""
+    return (f"max{IMAGE_MAX_DIMENSION}-q{IMAGE_JPEG_QUALITY}-gray{int(IMAGE_GRAYSCALE)}"
+            f"-crop{int(IMAGE_AUTOCROP)}:{AUTOCROP_THRESHOLD}:{AUTOCROP_MARGIN}-pdf{PDF_RENDER_DPI}:{PDF_MAX_PAGES}")
+
+
+def autocrop(image: Image.Image) -> Image.Image:
+    """Crop to the area that differs from the background colour found in the top left corner"""
+    grayscale = image if image.mode == "L" else image.convert("L")
+    background = Image.new("L", grayscale.size, grayscale.getpixel((0, 0)))
+    mask = ImageChops.difference(grayscale, background).point(lambda value: 255 if value > AUTOCROP_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - AUTOCROP_MARGIN),
+        max(0, top - AUTOCROP_MARGIN),
+        min(image.width, right + AUTOCROP_MARGIN),
+        min(image.height, bottom + AUTOCROP_MARGIN),
+    ))
+
+
+def preprocess_image(image: Image.Image) -> bytes:
+    """Auto-orient, grayscale, crop and downsample a receipt and re-encode it as JPEG"""
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L") if IMAGE_GRAYSCALE else image.convert("RGB")
+
+    if IMAGE_AUTOCROP:
+        image = autocrop(image)
+
+    image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def rasterize_pdf(pdf_bytes: bytes) -> tuple:
+    """Render the first PDF_MAX_PAGES pages of a PDF to PIL images, returns (images, pages left out)"""
+    # Only needed for PDF receipts, so imported on first use
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        pages = [pdf[index].render(scale=PDF_RENDER_DPI / 72).to_pil() for index in range(min(len(pdf), PDF_MAX_PAGES))]
+        return pages, len(pdf) - len(pages)
+    finally:
+        pdf.close()
+
+
+def preprocess_receipt(file_bytes: bytes) -> tuple:
+    """Processed JPEG bytes for every page of an image or PDF receipt, and the number of PDF pages beyond PDF_MAX_PAGES left out"""
+    if file_bytes[:5] == b"%PDF-":
+        pages, pages_truncated = rasterize_pdf(file_bytes)
+    else:
+        pages, pages_truncated = [Image.open(BytesIO(file_bytes))], 0
+
+    return [preprocess_image(page) for page in pages], pages_truncated
+
+
+def image_preprocessor(state: AgentState) -> AgentState:
+    image_location = state.get("image_location", "").strip()
+    with open(image_location, "rb") as image_file:
+        file_bytes = image_file.read()
+
+    image_hash = hash_image(file_bytes)
+    image_pages, pages_truncated = preprocess_receipt(file_bytes)
+    processed_size = sum(len(page) for page in image_pages)
+
+    new_state = state.copy()
+    new_state["image_hash"] = image_hash
+    # Only handles go into the state, the pages are read back when the LLM request is built
+    new_state["image_pages"] = [image_store.put(page) for page in image_pages]
+    new_state["image_bytes_saved"] = len(file_bytes) - processed_size
+    # The model does not see these pages, the total may be on one of them
+    new_state["pages_truncated"] = pages_truncated
+
+    # An expense was already saved from the same file, e.g. a receipt uploaded twice. Receipts that were
+    # only extracted, like those of a batch re-run after a crash, are not duplicates
+    saved_transaction_id = extraction_cache.saved_transaction_id(image_hash) if extraction_cache is not None else None
+    new_state["duplicate_receipt"] = saved_transaction_id is not None
+
+    set_span_attributes(original_bytes=len(file_bytes), processed_bytes=processed_size, pages=len(image_pages),
+                        pages_truncated=pages_truncated, duplicate_receipt=new_state["duplicate_receipt"], duplicate_of_transaction_id=saved_transaction_id)
+
+    return new_state
+
+
+async def aimage_preprocessor(state: AgentState) -> AgentState:
+    # Reading, decoding and re-encoding the image is blocking work, done in a thread
+    return await asyncio.to_thread(image_preprocessor, state)
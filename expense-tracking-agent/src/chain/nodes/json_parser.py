@@ -1,12 +1,17 @@
-from langchain_core.prompts import ChatPromptTemplate  
-from langchain_core.pydantic_v1 import BaseModel, Field  
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+import asyncio
 
-from chain.graph_state import AgentState
-from chain.helpers.get_payment_methods import get_payment_methods
+from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.messages import HumanMessage
 
-PAYMENT_METHODS_ENDPOINT = "http://localhost:8000/payment_methods"
+from src.chain.agent_state import AgentState, receipt_fields
+from src.chain.helpers.get_categories import aget_category_id, get_category_id
+from src.chain.helpers.get_payment_methods import aget_payment_method_id, aget_payment_methods, get_payment_methods, get_payment_method_id
+from src.chain.helpers.llm import ainvoke_structured_llm, get_structured_llm
+from src.chain.helpers.lookup_schema import lookup_names, with_lookup_fields
+from src.chain.helpers.extraction_cache import ExtractionCache, extraction_cache, prompt_version
+from src.chain.helpers.image_store import image_store
+from src.chain.nodes.image_preprocessor import preprocessing_fingerprint
+from src.observability.tracing import set_span_attributes
 
 # Create ExpenseSchema data
 class ReceiptSchema(BaseModel):
@@ -19,53 +24,120 @@ class ReceiptSchema(BaseModel):
     payment_method: str = Field(description="Indicate the payment method")
 
 
-def get_receipt_data_with_llm(image_b64: str, state: AgentState):
-    vision_model_name = state.get("vision_model_name", "gpt-4-vision-preview") 
+# The prompt is the same for every receipt, the payment method and category names are the enums of the schema
+SYSTEM_PROMPT_TEMPLATE = """
+You are an expert extraction algorithm.
+Extract the following information from the text:
+- Date
+- Description
+- Amount
+- VAT
+- Whether the expense is for business or personal use
+- Payment method
+{category_line}If you do not know the value of an attribute asked to extract, you may omit the attribute's value.
+"""
 
-    payment_methods = get_payment_methods()
-    # Define the prompt
-    SYSTEM_PROMPT_TEMPLATE = """
-    You are an expert extraction algorithm.  
-    Extract the following information from the text:  
-    - Date  
-    - Description  
-    - Amount  
-    - VAT  
-    - Whether the expense is for business or personal use  
-    - Payment method (options: {payment_methods})  
-    If you do not know the value of an attribute asked to extract, you may omit the attribute's value.
-    """
-
-    prompt = ChatPromptTemplate.from_messages([
-        ["system", SYSTEM_PROMPT_TEMPLATE.format(payment_methods = ", ".join(payment_methods))]
-    ])
-
-    structured_llm = ChatOpenAI(temperature=0, model=vision_model_name).with_structured_output(ReceiptSchema)
-
-    image_message = {
+SINGLE_PASS_CATEGORY_LINE = "- Category\n"
+
+
+def build_extraction_prompt(state: AgentState, payment_methods: dict) -> tuple:
+    """The output schema and system prompt for the vision call"""
+    payment_method_names = lookup_names(payment_methods)
+    # In single pass mode the category is picked in the same call instead of by the categorizer node
+    if state.get("single_pass"):
+        schema = with_lookup_fields(ReceiptSchema, payment_method_names, lookup_names(state["categories"]))
+        category_line = SINGLE_PASS_CATEGORY_LINE
+    else:
+        schema = with_lookup_fields(ReceiptSchema, payment_method_names)
+        category_line = ""
+
+    prompt = SYSTEM_PROMPT_TEMPLATE.format(category_line=category_line)
+    return schema, prompt
+
+
+def extraction_cache_key(state: AgentState, schema, prompt: str):
+    """Cache key and prompt version of the extraction, (None, None) when it is not cached"""
+    image_hash = state.get("image_hash")
+    if extraction_cache is None or image_hash is None:
+        return None, None
+    version = prompt_version(prompt, schema, preprocessing_fingerprint())
+    return ExtractionCache.make_key(image_hash, get_vision_model_name(state), version), version
+
+
+def get_vision_model_name(state: AgentState) -> str:
+    return state.get("vision_model_name", "gpt-4-vision-preview")
+
+
+def build_image_messages(image_pages: list) -> list:
+    # One image per page, pages are JPEG after preprocessing. They are encoded when the
+    # request is built so the base64 strings only live for the duration of the request
+    return [{
         "type": "image_url",
         "image_url": {
-            "url": f"data:image/jpeg;base64,{image_b64}"
+            "url": f"data:image/jpeg;base64,{image_store.get_base64(handle)}"
         }
-    }
+    } for handle in image_pages]
+
 
+def build_messages(prompt: str, image_messages: list) -> list:
     prompt_message = {
         "type": "text",
         "text": prompt
     }
+    return [HumanMessage(content=[prompt_message, *image_messages])]
 
-    messages = HumanMessage(content=[prompt_message, image_message])
 
-    response = structured_llm.invoke([messages])
+def store_extraction(state: AgentState, cache_key: str, version: str, receipt_data: dict):
+    if cache_key is not None:
+        extraction_cache.put(cache_key, state["image_hash"], get_vision_model_name(state), version, receipt_data)
 
-    return response.dict()
 
-def json_parser(state: AgentState) -> AgentState:
+def get_receipt_data_with_llm(image_pages: list, state: AgentState):
+    payment_methods = get_payment_methods()
+    schema, prompt = build_extraction_prompt(state, payment_methods)
+
+    # Re-running an image with the same model and prompt returns the stored extraction
+    cache_key, version = extraction_cache_key(state, schema, prompt)
+    if cache_key is not None:
+        cached_receipt_data = extraction_cache.get(cache_key)
+        if cached_receipt_data is not None:
+            set_span_attributes(extraction_cache_hit=True)
+            return cached_receipt_data
+
+    structured_llm = get_structured_llm(get_vision_model_name(state), schema)
+    response = structured_llm.invoke(build_messages(prompt, build_image_messages(image_pages)))
+    receipt_data = response.dict()
 
+    store_extraction(state, cache_key, version, receipt_data)
+    return receipt_data
+
+
+async def aget_receipt_data_with_llm(image_pages: list, state: AgentState):
+    # The payment methods are needed for the prompt, the pages are encoded meanwhile. On a
+    # cache hit the encoding is wasted, which costs less than doing both one after the other
+    payment_methods, image_messages = await asyncio.gather(
+        aget_payment_methods(),
+        asyncio.to_thread(build_image_messages, image_pages),
+    )
+    schema, prompt = build_extraction_prompt(state, payment_methods)
+
+    cache_key, version = extraction_cache_key(state, schema, prompt)
+    if cache_key is not None:
+        cached_receipt_data = extraction_cache.get(cache_key)
+        if cached_receipt_data is not None:
+            set_span_attributes(extraction_cache_hit=True)
+            return cached_receipt_data
+
+    response = await ainvoke_structured_llm(get_vision_model_name(state), schema, build_messages(prompt, image_messages))
+    receipt_data = response.dict()
+
+    store_extraction(state, cache_key, version, receipt_data)
+    return receipt_data
+
+
+def update_state_with_receipt_data(state: AgentState, receipt_data: dict) -> AgentState:
     new_state = state.copy()
-    image_b64 = state.get("image_base64", "").strip()
-    receipt_data = get_receipt_data_with_llm(image_b64, state)
-    
+
     # Update, date, description, amount, vat, business_personal and payment_method
     new_state["date"] = receipt_data.get("date", None)
     new_state["description"] = receipt_data.get("description", None)
@@ -73,7 +145,36 @@ def json_parser(state: AgentState) -> AgentState:
     new_state["vat"] = receipt_data.get("vat", None)
     new_state["business_personal"] = receipt_data.get("business_personal", None)
     new_state["payment_method"] = receipt_data.get("payment_method", None)
+    if state.get("single_pass"):
+        new_state["category"] = receipt_data.get("category", None)
+
+    return new_state
+
+def json_parser(state: AgentState) -> AgentState:
+    image_pages = state.get("image_pages") or []
+    receipt_data = get_receipt_data_with_llm(image_pages, state)
+    new_state = update_state_with_receipt_data(state, receipt_data)
+
+    # Without the categorizer node the ids have to be resolved here
+    if state.get("single_pass"):
+        new_state["category_id"] = get_category_id(new_state["category"])
+        new_state["payment_method_id"] = get_payment_method_id(new_state["payment_method"])
+
+    set_span_attributes(receipt=receipt_fields(new_state))
+
+    return new_state
+
+async def ajson_parser(state: AgentState) -> AgentState:
+    image_pages = state.get("image_pages") or []
+    receipt_data = await aget_receipt_data_with_llm(image_pages, state)
+    new_state = update_state_with_receipt_data(state, receipt_data)
+
+    if state.get("single_pass"):
+        new_state["category_id"], new_state["payment_method_id"] = await asyncio.gather(
+            aget_category_id(new_state["category"]),
+            aget_payment_method_id(new_state["payment_method"]),
+        )
 
-    print("New agent state after updating with receipt data: ", new_state)
+    set_span_attributes(receipt=receipt_fields(new_state))
 
     return new_state
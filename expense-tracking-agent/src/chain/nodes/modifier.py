@@ -1,11 +1,15 @@
-from langchain_core.prompts import ChatPromptTemplate  
+import asyncio
+
 from langchain_core.pydantic_v1 import BaseModel, Field  
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage
 
-from chain.graph_state import AgentState
-from chain.helpers.get_categories import get_categories
-from chain.helpers.get_payment_methods import get_payment_methods
+from src.chain.agent_state import AgentState, display_value
+from src.chain.helpers.get_categories import aget_categories, aget_category_id, get_categories, get_category_id
+from src.chain.helpers.get_payment_methods import aget_payment_method_id, aget_payment_methods, get_payment_method_id, get_payment_methods
+from src.chain.helpers.llm import ainvoke_structured_llm, get_structured_llm
+from src.chain.helpers.lookup_schema import lookup_names, with_lookup_fields
+from src.chain.nodes.normalizer import normalize_state
+from src.chain.helpers.llm_scheduler import LLM_PRIORITY_INTERACTIVE
 
 
 # Create ExpenseSchema data
@@ -20,17 +24,7 @@ class ReceiptSchema(BaseModel):
     category: str = Field(description="The category the receipt belongs to")
 
 
-def get_modified_receipt_data(state: AgentState) -> AgentState:
-
-    receipt_date = state.get("date", "").strip()
-    receipt_description = state.get("description", "").strip()
-    receipt_amount = state.get("amount", "").strip()
-    receipt_vat = state.get("vat", "").strip()
-    receipt_business_personal = state.get("business_personal", "").strip()
-    receipt_payment_method = state.get("payment_method", "").strip()
-    receipt_category = state.get("category", "")
-
-    RECEIPT_INFORMATION = f"""
+RECEIPT_INFORMATION_TEMPLATE = """
     The following is a summary information of the receipt 
     - date = {receipt_date}
     - description = {receipt_description}
@@ -40,15 +34,12 @@ def get_modified_receipt_data(state: AgentState) -> AgentState:
     - payment_method = {receipt_payment_method} 
     """
 
-    # Print summary of receipt so user can provide instruction to change necessary information
-    print(RECEIPT_INFORMATION)
-
-    instructions = input("Tell the LLM what to change in the summary of receipts provide")
+# The instruction comes first and the receipt and feedback last, so every call starts with the same tokens.
+# The category and payment method names are the enums of the schema, not repeated here
+SYSTEM_PROMPT_TEMPLATE = """
+    Please change the summary of the receipt below based on the user feed back, and keep
+    the other values as they are.
 
-    categories = get_categories()
-    payment_methods = get_payment_methods()
-
-    SYSTEM_PROMPT_TEMPLATE = """
     ## Here is a summary information of the receipt 
     - date = {receipt_date}
     - description = {receipt_description}
@@ -58,71 +49,114 @@ def get_modified_receipt_data(state: AgentState) -> AgentState:
     - payment_method = {receipt_payment_method} 
     - category = {receipt_category}
 
-    ### Please change the summary based on the user feed back below:
+    ### User feed back:
     {instructions}
-
-    If user wants you to modify category, choose category information in the following list:
-    {categories}
-    If user wants you to modify payment_method, choose the payment method information in the following list:
-    {payment_methods}
     """
 
-    prompt = ChatPromptTemplate.from_messages([
-        ["system", SYSTEM_PROMPT_TEMPLATE.format(
-            receipt_date=receipt_date, receipt_description=receipt_description, receipt_amount=receipt_amount, receipt_vat=receipt_vat,
-            receipt_business_personal=receipt_business_personal, receipt_payment_method=receipt_payment_method, receipt_category=receipt_category,
-            instructions=instructions, categories=", ".join(categories), payment_methods = ", ".join(payment_methods)
-        )]
-    ])
+INSTRUCTIONS_PROMPT = "Tell the LLM what to change in the summary of receipts provide"
 
-    vision_model_name = state.get("vision_model_name", "gpt-4-vision-preview") 
 
-    structured_llm = ChatOpenAI(temperature=0, model=vision_model_name).with_structured_output(ReceiptSchema)
+def get_receipt_summary(state: AgentState) -> dict:
+    return {
+        "receipt_date": display_value(state.get("date")),
+        "receipt_description": display_value(state.get("description")),
+        "receipt_amount": display_value(state.get("amount")),
+        "receipt_vat": display_value(state.get("vat")),
+        "receipt_business_personal": display_value(state.get("business_personal")),
+        "receipt_payment_method": display_value(state.get("payment_method")),
+    }
+
+
+def get_modifier_schema(categories: dict, payment_methods: dict) -> type:
+    return with_lookup_fields(ReceiptSchema, lookup_names(payment_methods), lookup_names(categories))
+
+
+def build_modifier_messages(state: AgentState, receipt_summary: dict, instructions: str) -> list:
+    prompt = SYSTEM_PROMPT_TEMPLATE.format(**receipt_summary, receipt_category=state.get("category", ""), instructions=instructions)
 
     prompt_message = {
         "type": "text",
         "text": prompt
     }
 
-    messages = HumanMessage(content=[prompt_message])
+    return [HumanMessage(content=[prompt_message])]
+
+
+def get_modifier_model_name(state: AgentState) -> str:
+    return state.get("vision_model_name", "gpt-4-vision-preview") 
+
+
+def get_modified_receipt_data(state: AgentState) -> AgentState:
+    receipt_summary = get_receipt_summary(state)
+
+    # Instructions given through the review API replace the prompt
+    instructions = state.get("review_instructions")
+    if not instructions:
+        # Print summary of receipt so user can provide instruction to change necessary information
+        print(RECEIPT_INFORMATION_TEMPLATE.format(**receipt_summary))
+        instructions = input(INSTRUCTIONS_PROMPT)
+
+    categories = get_categories()
+    payment_methods = get_payment_methods()
+
+    messages = build_modifier_messages(state, receipt_summary, instructions)
 
-    response = structured_llm.invoke([messages])
+    structured_llm = get_structured_llm(get_modifier_model_name(state), get_modifier_schema(categories, payment_methods))
+
+    # Someone is waiting for the revision, it goes before queued receipts
+    response = structured_llm.invoke(messages, priority=LLM_PRIORITY_INTERACTIVE)
 
     return response.dict()
 
-def modifier(state: AgentState) -> AgentState:
 
+async def aget_modified_receipt_data(state: AgentState) -> AgentState:
+    receipt_summary = get_receipt_summary(state)
+
+    # The lookups are fetched while the user types the instructions
+    lookups = asyncio.gather(aget_categories(), aget_payment_methods())
+    instructions = state.get("review_instructions")
+    if not instructions:
+        print(RECEIPT_INFORMATION_TEMPLATE.format(**receipt_summary))
+        instructions = await asyncio.to_thread(input, INSTRUCTIONS_PROMPT)
+    categories, payment_methods = await lookups
+
+    messages = build_modifier_messages(state, receipt_summary, instructions)
+
+    response = await ainvoke_structured_llm(get_modifier_model_name(state), get_modifier_schema(categories, payment_methods), messages,
+                                            priority=LLM_PRIORITY_INTERACTIVE)
+
+    return response.dict()
+
+
+def update_state_with_modified_data(state: AgentState, modified_receipt_data: dict, category_id, payment_method_id) -> AgentState:
     new_state = state.copy()
-    modified_receipt_data = get_modified_receipt_data(state)
-    
-    # Update, date, description, amount, vat, business_personal and payment_method
+    # The instructions are used once, the next revision asks again
+    new_state["review_instructions"] = None
+
+    # Update, date, description, amount, vat, business_personal, payment_method and category
     new_state["date"] = modified_receipt_data.get("date", None)
     new_state["description"] = modified_receipt_data.get("description", None)
     new_state["amount"] = modified_receipt_data.get("amount", None)
     new_state["vat"] = modified_receipt_data.get("vat", None)
     new_state["business_personal"] = modified_receipt_data.get("business_personal", None)
     new_state["payment_method"] = modified_receipt_data.get("payment_method", None)
+    new_state["category"] = modified_receipt_data.get("category", None)
+    # The ids come from the name indexes of the lookup caches
+    new_state["category_id"] = category_id
+    new_state["payment_method_id"] = payment_method_id
+
+    # The revision is checked like an extraction, invalid fields are shown to the reviewer again
+    return normalize_state(new_state)
 
-    # Set category_id on new state
-    if "category" in new_state and "categories" in new_state:
-        categories = new_state["categories"]
-        category = new_state["category"]
-
-        for key, value in categories.items():
-            if value == category:
-                new_state["category_id"] = key 
-                break
-
-    # Set payment_method_id on new state
-    if "payment_method" in new_state and "payment_methods" in new_state:
-        payment_methods = new_state["payment_methods"]
-        payment_method = new_state["payment_method"]
-
-        for key, value in payment_methods.items():
-            if value == payment_method:
-                new_state["payment_method_id"] = key 
-                break
-    
-    print("New agent state after modifying receipt data with LLM: ", new_state)
-
-    return new_state
+def modifier(state: AgentState) -> AgentState:
+    modified_receipt_data = get_modified_receipt_data(state)
+    return update_state_with_modified_data(state, modified_receipt_data, get_category_id(modified_receipt_data.get("category")),
+                                           get_payment_method_id(modified_receipt_data.get("payment_method")))
+
+async def amodifier(state: AgentState) -> AgentState:
+    modified_receipt_data = await aget_modified_receipt_data(state)
+    category_id, payment_method_id = await asyncio.gather(
+        aget_category_id(modified_receipt_data.get("category")),
+        aget_payment_method_id(modified_receipt_data.get("payment_method")),
+    )
+    return update_state_with_modified_data(state, modified_receipt_data, category_id, payment_method_id)
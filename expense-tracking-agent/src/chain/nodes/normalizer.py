@@ -0,0 +1,292 @@
+"""Local validation and repair of the extracted receipt fields.
+
+The vision model answers the date in whatever format the receipt prints it
+and the amounts as floats or text with currency signs. normalizer parses them
+without the LLM: the date in the usual formats to an ISO date, amount and VAT
+to decimal strings with two places like the expenses table stores them, and
+business_personal to business or personal. The values stay strings so the
+state can still be checkpointed and sent to the API as JSON.
+
+Fields that are still invalid, e.g. an unreadable or future date or a VAT
+larger than the amount, are asked again in one small LLM call for those
+fields only. A value that merely failed to parse is sent back as text, the
+receipt images are only added when the value itself has to be read again.
+"""
+
+import asyncio
+import logging
+import os
+import re
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal, DecimalException, InvalidOperation
+from functools import lru_cache
+
+from langchain_core.pydantic_v1 import BaseModel, create_model
+
+from src.chain.agent_state import AgentState, receipt_fields
+from src.chain.helpers.llm import ainvoke_structured_llm, get_structured_llm
+from src.chain.nodes.json_parser import ReceiptSchema, build_image_messages, build_messages, get_vision_model_name
+from src.observability.tracing import set_span_attributes
+
+# Ask the LLM again for the fields the local checks could not repair
+RECEIPT_REPAIR_ENABLED = os.getenv("RECEIPT_REPAIR_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Numeric formats with - as separator, month first because the extraction asks for MM-DD-YYYY.
+# Day first only matches when the day is above 12
+NUMERIC_DATE_FORMATS = ("%Y-%m-%d", "%m-%d-%Y", "%d-%m-%Y", "%m-%d-%y", "%d-%m-%y", "%Y%m%d")
+TEXT_DATE_FORMATS = ("%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y", "%B %d %y", "%b %d %y", "%d %B %y", "%d %b %y")
+ORDINAL_SUFFIX = re.compile(r"(\d)(st|nd|rd|th)\b", re.IGNORECASE)
+# Tue, 18 Apr 2024 and Tuesday April 18 2024
+WEEKDAY_PREFIX = re.compile(r"^(mon|tue|wed|thu|fri|sat|sun)[a-z]*\.?,?\s+", re.IGNORECASE)
+# 10:30, 10:30:00 PM or 10:30 +0000 after the date
+TIME_SUFFIX = re.compile(r"[\sT,]+\d{1,2}:\d{2}(:\d{2})?.*$", re.IGNORECASE)
+NON_AMOUNT_CHARACTERS = re.compile(r"[^\d,.\-]")
+# One separator followed by three digits, 1,234 or 12.345, is a thousands separator
+THOUSANDS_GROUP = re.compile(r"-?[1-9]\d{0,2}[.,]\d{3}")
+CENT = Decimal("0.01")
+# Largest value of the DECIMAL(10, 2) amount and vat columns
+MAX_AMOUNT = Decimal("99999999.99")
+
+BUSINESS_WORDS = ("business", "work", "company", "corporate", "professional")
+PERSONAL_WORDS = ("personal", "private", "individual")
+# not business, non-business or no personal use
+NEGATED_WORD = re.compile(r"\b(?:not|non|no)[\s-]+(?:an?\s+|for\s+)?(\w+)")
+
+# Fields the checks cover, in the order they are asked again
+NORMALIZED_FIELDS = ("date", "description", "amount", "vat", "business_personal")
+
+REPAIR_PROMPT_TEMPLATE = """
+You are an expert extraction algorithm.
+Some values extracted from the receipt are invalid, read them again from the receipt.
+The date is formatted MM-DD-YYYY, amounts are plain numbers and business_personal is business or personal.
+Invalid values:
+{problems}
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptRepair(BaseModel):
+    """Corrected values of the receipt fields that were invalid"""
+
+
+@lru_cache(maxsize=32)
+def get_repair_schema(fields: tuple) -> type:
+    """ReceiptSchema restricted to fields"""
+    return create_model(
+        "ReceiptRepair",
+        __base__=ReceiptRepair,
+        **{field: (ReceiptSchema.__fields__[field].outer_type_, ReceiptSchema.__fields__[field].field_info) for field in fields},
+    )
+
+
+def parse_receipt_date(value):
+    """The date of a receipt in the formats receipts and the model use, None when it cannot be read"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if value is None:
+        return None
+
+    # 2024-04-18T10:30:00, 04/18/2024 12:30 and Tue, 18 Apr 2024 10:30 keep their date part
+    text = TIME_SUFFIX.sub("", WEEKDAY_PREFIX.sub("", str(value).strip()))
+    numeric = re.sub(r"[/.]", "-", re.split(r"[T ]", text)[0])
+    # Apr. 18th, 2024 reads as Apr 18 2024
+    words = " ".join(re.sub(r"[,.]", " ", ORDINAL_SUFFIX.sub(r"\1", text)).split())
+    for text_value, formats in ((numeric, NUMERIC_DATE_FORMATS), (words, TEXT_DATE_FORMATS)):
+        for date_format in formats:
+            try:
+                return datetime.strptime(text_value, date_format).date()
+            except ValueError:
+                continue
+    return None
+
+
+def parse_amount(value):
+    """An amount as a Decimal with two places, None when it is not a number or does not fit the expenses table.
+
+    Text may carry a currency and separators. 1.234,56 and 1,234.56 both read as 1234.56,
+    a single separator followed by three digits separates thousands, so 1,234 and 1.234 are 1234.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, (int, float, Decimal)):
+            amount = Decimal(str(value))
+        else:
+            amount = parse_amount_text(str(value).strip())
+        # Compared before quantize, which raises InvalidOperation from 1e28 up
+        if amount is None or not amount.is_finite() or abs(amount) > MAX_AMOUNT:
+            return None
+        amount = amount.quantize(CENT, rounding=ROUND_HALF_UP)
+    except DecimalException:
+        # Overflow of 1e999999999 and the like
+        return None
+    return amount if abs(amount) <= MAX_AMOUNT else None
+
+
+def parse_amount_text(text: str):
+    # Plain numbers, 1.5e3 included, before any character is stripped
+    if not THOUSANDS_GROUP.fullmatch(text):
+        try:
+            return Decimal(text)
+        except InvalidOperation:
+            pass
+
+    text = NON_AMOUNT_CHARACTERS.sub("", text)
+    comma, dot = text.rfind(","), text.rfind(".")
+    if comma != -1 and dot != -1:
+        # With both separators the last one is the decimal separator
+        thousands, decimal = (".", ",") if comma > dot else (",", ".")
+    else:
+        separator = "," if comma != -1 else "."
+        position = comma if comma != -1 else dot
+        # A repeated separator, or one with three digits after it, separates thousands
+        if position != -1 and (text.count(separator) > 1 or len(text) - position - 1 == 3):
+            thousands, decimal = separator, None
+        else:
+            thousands, decimal = None, separator
+    if thousands is not None:
+        text = text.replace(thousands, "")
+    if decimal is not None:
+        text = text.replace(decimal, ".")
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        return None
+
+
+def normalize_business_personal(value):
+    """business or personal, None when the value says neither or both"""
+    text = str(value or "").casefold()
+    is_business = is_personal = False
+
+    # Negations are read first, not business means personal
+    def negate(match):
+        nonlocal is_business, is_personal
+        word = match.group(1)
+        if any(word.startswith(business_word) for business_word in BUSINESS_WORDS):
+            is_personal = True
+        elif any(word.startswith(personal_word) for personal_word in PERSONAL_WORDS):
+            is_business = True
+        else:
+            return match.group(0)
+        return " "
+
+    text = NEGATED_WORD.sub(negate, text)
+    is_business = is_business or any(word in text for word in BUSINESS_WORDS)
+    is_personal = is_personal or any(word in text for word in PERSONAL_WORDS)
+    if is_business == is_personal:
+        return None
+    return "business" if is_business else "personal"
+
+
+def is_missing(value) -> bool:
+    return value is None or str(value).strip() == ""
+
+
+def normalize_fields(receipt: dict) -> tuple:
+    """(values, problems, needs_image): the normalized valid fields, {field: reason} for the invalid
+    ones, and whether a repair needs the image because a value is wrong rather than unreadable"""
+    values, problems, needs_image = {}, {}, False
+
+    for field in NORMALIZED_FIELDS:
+        if is_missing(receipt.get(field)):
+            problems[field] = f"missing {field}"
+            needs_image = True
+
+    if "date" not in problems:
+        receipt_date = parse_receipt_date(receipt["date"])
+        if receipt_date is None:
+            problems["date"] = f"unreadable date {receipt['date']!r}"
+        elif receipt_date > date.today():
+            problems["date"] = f"date {receipt_date.isoformat()} is in the future"
+            needs_image = True
+        else:
+            values["date"] = receipt_date.isoformat()
+
+    if "description" not in problems:
+        values["description"] = str(receipt["description"]).strip()
+
+    amounts = {}
+    for field in ("amount", "vat"):
+        if field in problems:
+            continue
+        amounts[field] = parse_amount(receipt[field])
+        if amounts[field] is None:
+            problems[field] = f"{field} {receipt[field]!r} is not a number up to {MAX_AMOUNT}"
+        elif amounts[field] < 0 or (field == "amount" and amounts[field] == 0):
+            problems[field] = f"{field} {amounts[field]} is not positive"
+            needs_image = True
+        else:
+            values[field] = str(amounts[field])
+    if "amount" in values and "vat" in values and amounts["vat"] > amounts["amount"]:
+        problems["amount"] = problems["vat"] = "vat is larger than amount"
+        del values["amount"], values["vat"]
+        needs_image = True
+
+    if "business_personal" not in problems:
+        business_personal = normalize_business_personal(receipt["business_personal"])
+        if business_personal is None:
+            problems["business_personal"] = f"business_personal {receipt['business_personal']!r} is neither business nor personal"
+        else:
+            values["business_personal"] = business_personal
+
+    return values, problems, needs_image
+
+
+def normalize_state(state: AgentState) -> AgentState:
+    """The state with its valid fields normalized, the invalid ones are left for the reviewer"""
+    values, problems, needs_image = normalize_fields(state)
+    return update_state_with_normalized_fields(state, values, problems)
+
+
+def update_state_with_normalized_fields(state: AgentState, values: dict, problems: dict) -> AgentState:
+    new_state = state.copy()
+    new_state.update(values)
+    set_span_attributes(invalid_fields=problems or None, receipt=receipt_fields(new_state))
+    return new_state
+
+
+def build_repair_prompt(state: AgentState, problems: dict) -> str:
+    lines = [f"- {field} = {state.get(field)!r}: {problems[field]}" for field in NORMALIZED_FIELDS if field in problems]
+    return REPAIR_PROMPT_TEMPLATE.format(problems="\n".join(lines))
+
+
+def repair_fields(state: AgentState, values: dict, problems: dict, repaired: dict) -> AgentState:
+    """Normalize the repaired values with the ones that were already valid"""
+    values, remaining, needs_image = normalize_fields({**state, **values, **repaired})
+    set_span_attributes(repaired_fields=sorted(set(problems) - set(remaining)))
+    return update_state_with_normalized_fields(state, values, remaining)
+
+
+def normalizer(state: AgentState) -> AgentState:
+    values, problems, needs_image = normalize_fields(state)
+    if not problems or not RECEIPT_REPAIR_ENABLED:
+        return update_state_with_normalized_fields(state, values, problems)
+
+    image_messages = build_image_messages(state.get("image_pages") or []) if needs_image else []
+    structured_llm = get_structured_llm(get_vision_model_name(state), get_repair_schema(tuple(sorted(problems))))
+    try:
+        response = structured_llm.invoke(build_messages(build_repair_prompt(state, problems), image_messages))
+    except Exception as e:
+        # The reviewer still sees the invalid fields, a failed repair does not fail the receipt
+        logger.warning("Failed to repair receipt fields %s: %s", sorted(problems), e)
+        return update_state_with_normalized_fields(state, values, problems)
+    return repair_fields(state, values, problems, response.dict())
+
+
+async def anormalizer(state: AgentState) -> AgentState:
+    values, problems, needs_image = normalize_fields(state)
+    if not problems or not RECEIPT_REPAIR_ENABLED:
+        return update_state_with_normalized_fields(state, values, problems)
+
+    image_messages = await asyncio.to_thread(build_image_messages, state.get("image_pages") or []) if needs_image else []
+    try:
+        response = await ainvoke_structured_llm(get_vision_model_name(state), get_repair_schema(tuple(sorted(problems))),
+                                                build_messages(build_repair_prompt(state, problems), image_messages))
+    except Exception as e:
+        logger.warning("Failed to repair receipt fields %s: %s", sorted(problems), e)
+        return update_state_with_normalized_fields(state, values, problems)
+    return repair_fields(state, values, problems, response.dict())
@@ -1,10 +1,15 @@
-import requests
-from chain.graph_state import AgentState
+import asyncio
+import logging
 
+from src.chain.agent_state import AgentState
+from src.chain.helpers.expenses_backend import get_expenses_backend
+from src.chain.helpers.extraction_cache import extraction_cache
+from src.observability.tracing import set_span_attributes
 
-EXPENSE_ENDPOINT_URL = "http://localhost:8000/expenses"
 
-def save_expense_to_db(state: AgentState) -> AgentState:
+logger = logging.getLogger(__name__)
+
+def build_expense_data(state: AgentState) -> dict:
     receipt_date = state.get("date", None)
     receipt_category_id = state.get("category_id", None)
     receipt_description = state.get("description", None)
@@ -13,7 +18,7 @@ def save_expense_to_db(state: AgentState) -> AgentState:
     receipt_payment_method_id = state.get("payment_method_id", None)
     receipt_business_personal = state.get("business_personal", None)
 
-    expense_data = {
+    return {
         "date": receipt_date,
         "category_id": receipt_category_id,
         "description": receipt_description,
@@ -23,9 +28,49 @@ def save_expense_to_db(state: AgentState) -> AgentState:
         "business_personal": receipt_business_personal
     }
 
-    response = requests.post(EXPENSE_ENDPOINT_URL, json=expense_data)
+def save_expense_to_db(state: AgentState) -> AgentState:
+    expense_data = build_expense_data(state)
+
+    transaction_id, error = get_expenses_backend().save_expense(expense_data)
+    report_saved_expense(transaction_id, error)
+    record_saved_receipts([(state.get("image_hash"), transaction_id)])
+    return {"transaction_id": transaction_id}
+
+async def asave_expense_to_db(state: AgentState) -> AgentState:
+    expense_data = build_expense_data(state)
+
+    transaction_id, error = await get_expenses_backend().asave_expense(expense_data)
+    report_saved_expense(transaction_id, error)
+    await asyncio.to_thread(record_saved_receipts, [(state.get("image_hash"), transaction_id)])
+    return {"transaction_id": transaction_id}
+
+def report_saved_expense(transaction_id, error):
+    set_span_attributes(saved=error is None, transaction_id=transaction_id, error=error)
+    if error is not None:
+        logger.warning("Failure to save expense data in DB: %s", error)
+
+def record_saved_receipts(saved: list):
+    """Remember the images of the saved expenses, so image_preprocessor flags them as duplicates"""
+    saved = [(image_hash, transaction_id) for image_hash, transaction_id in saved
+             if image_hash is not None and transaction_id is not None]
+    if extraction_cache is None or not saved:
+        return
+    try:
+        extraction_cache.record_saved(saved)
+    except Exception as e:
+        # The expense is saved, only the duplicate warning of a later upload is lost
+        logger.warning("Failed to record saved receipts: %s", e)
+
+def save_expenses_to_db(states: list) -> dict:
+    """Save many receipts at once through the bulk path of the expenses backend.
+
+    Returns the result with transaction_ids, inserted_indexes and per-row errors,
+    indexes refer to positions in states.
+    """
+    expenses_data = [build_expense_data(state) for state in states]
 
-    if response.status_code in (200, 201):
-        print("Expense data succesfully saved into DB")
-    else:
-        print(f"Failure to save expense data in DB with status code: {response.status_code}")
\ No newline at end of file
+    result = get_expenses_backend().save_expenses(expenses_data)
+    set_span_attributes(saved=len(result["transaction_ids"]), rejected=len(result["errors"]))
+    record_saved_receipts([(states[index].get("image_hash"), transaction_id)
+                           for index, transaction_id in zip(result["inserted_indexes"], result["transaction_ids"])])
+    return result
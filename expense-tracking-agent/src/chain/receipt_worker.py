@@ -0,0 +1,206 @@
+"""Worker processes running the receipt graph for jobs uploaded with POST /receipts.
+
+Every process runs --concurrency threads, each claiming one job at a time from
+the receipt_jobs table (FOR UPDATE SKIP LOCKED), so workers can be added on any
+host that reaches the database. A job runs the graph up to its review through
+the review queue of src/chain/review_queue.py, under the thread id
+receipt-job-<job_id>. Jobs uploaded with auto_accept whose extraction looks
+complete are saved straight away, the others wait in GET /reviews.
+
+A failed attempt is queued again until RECEIPT_JOB_MAX_ATTEMPTS attempts were
+made. The next attempt continues the checkpointed run, so the LLM calls that
+already succeeded are not repeated. Idle workers wake up on the notification
+sent when a job is inserted, and poll every RECEIPT_WORKER_POLL_SECONDS in case
+it was missed.
+
+    python -m src.chain.receipt_worker --processes 4 --concurrency 8
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from src.chain.batch_runner import review_reasons
+from src.chain.review_queue import ReviewNotFoundError, get_review_queue
+from src.database.change_listener import ChangeListener
+from src.database.db_connection import close_connection_pool, get_connection
+from src.database.receipt_jobs import (claim_receipt_job, fail_abandoned_receipt_jobs, fail_receipt_job, finish_receipt_job,
+                                       receipt_job_thread_id)
+from src.observability.metrics import start_metrics_server
+from src.observability.tracing import configure_logging, span
+
+RECEIPT_JOB_MAX_ATTEMPTS = int(os.getenv("RECEIPT_JOB_MAX_ATTEMPTS", "3"))
+# A job not finished this many seconds after it was claimed is given to another worker
+RECEIPT_JOB_LEASE_SECONDS = float(os.getenv("RECEIPT_JOB_LEASE_SECONDS", "900"))
+RECEIPT_WORKER_POLL_SECONDS = float(os.getenv("RECEIPT_WORKER_POLL_SECONDS", "5"))
+# The graph reads receipts from files, the uploaded image is written here while its job runs
+RECEIPT_WORK_DIR = os.getenv("RECEIPT_WORK_DIR", os.path.join(".cache", "receipt_jobs"))
+
+logger = logging.getLogger(__name__)
+
+
+def run_job(job: dict) -> tuple:
+    """Run the graph for a claimed job and return (status, review_thread_id, transaction_id)"""
+    review_queue = get_review_queue()
+    thread_id = receipt_job_thread_id(job["job_id"])
+    image_location = os.path.join(RECEIPT_WORK_DIR, f"{job['job_id']}_{job['image_name']}")
+    os.makedirs(RECEIPT_WORK_DIR, exist_ok=True)
+    with open(image_location, "wb") as image_file:
+        image_file.write(job["image"])
+
+    try:
+        try:
+            previous = review_queue.get(thread_id)
+        except ReviewNotFoundError:
+            previous = None
+
+        if previous is None:
+            review = review_queue.start(image_location, job["single_pass"], thread_id=thread_id)
+        elif previous["status"] == "failed":
+            review = review_queue.retry(thread_id)
+        else:
+            # The last attempt got as far as the review before its worker stopped
+            review = previous
+
+        if job["auto_accept"] and review["status"] == "pending" and not review_reasons(
+                {**review["receipt"], "duplicate_receipt": review["duplicate_receipt"], "pages_truncated": review["pages_truncated"]}):
+            review = review_queue.resume(thread_id, "accept")
+    finally:
+        # The preprocessed pages are in the image store, the job row keeps the upload for another attempt
+        os.remove(image_location)
+
+    return ("saved" if review["status"] == "saved" else "review"), thread_id, review.get("transaction_id")
+
+
+class ReceiptWorker:
+    """Threads of one process claiming and running receipt jobs until stop is called"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._change_listener = ChangeListener(on_change=self._on_table_changed)
+
+    def _on_table_changed(self, table: str):
+        if table == "receipt_jobs":
+            self._wakeup.set()
+
+    def run(self):
+        self._change_listener.start()
+        threads = [threading.Thread(target=self._work, name=f"receipt-worker-{index}") for index in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+        finally:
+            self._change_listener.stop()
+
+    def stop(self):
+        """Let the running jobs finish and claim no new ones"""
+        self._stop.set()
+        self._wakeup.set()
+
+    def _work(self):
+        worker = f"{self.name}:{threading.current_thread().name}"
+        while not self._stop.is_set():
+            try:
+                job = self._claim(worker)
+            except Exception as e:
+                logger.warning("Failed to claim a receipt job: %s", e)
+                job = None
+            if job is None:
+                self._wakeup.wait(RECEIPT_WORKER_POLL_SECONDS)
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _claim(self, worker: str):
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                job = claim_receipt_job(cursor, worker, RECEIPT_JOB_LEASE_SECONDS, RECEIPT_JOB_MAX_ATTEMPTS)
+                if job is None:
+                    fail_abandoned_receipt_jobs(cursor, RECEIPT_JOB_MAX_ATTEMPTS)
+            conn.commit()
+        return job
+
+    def _process(self, job: dict):
+        with span("receipt_job", job_id=job["job_id"], attempt=job["attempts"]) as current:
+            try:
+                status, review_thread_id, transaction_id = run_job(job)
+            except Exception as e:
+                logger.warning("Receipt job %s failed on attempt %s: %s", job["job_id"], job["attempts"], e)
+                with get_connection() as conn:
+                    with conn.cursor() as cursor:
+                        fail_receipt_job(cursor, job["job_id"], f"{type(e).__name__}: {e}", RECEIPT_JOB_MAX_ATTEMPTS,
+                                         receipt_job_thread_id(job["job_id"]))
+                    conn.commit()
+                return
+
+            current.set(status=status, transaction_id=transaction_id)
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    finish_receipt_job(cursor, job["job_id"], status, review_thread_id, transaction_id)
+                conn.commit()
+
+
+def run_worker_process(concurrency: int, metrics_port: int = None):
+    configure_logging()
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
+    worker = ReceiptWorker(concurrency)
+    # SIGTERM from a process manager finishes the running jobs first
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.run()
+    finally:
+        close_connection_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the receipt graph for the jobs queued with POST /receipts")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes")
+    parser.add_argument("--concurrency", type=int, default=4, help="Jobs each process runs at once")
+    parser.add_argument("--metrics-port", type=int, help="Serve GET /metrics on this port, and the following ports for further processes")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker_process(args.concurrency, args.metrics_port)
+        return
+
+    # Spawned processes open their own database pools and LLM clients
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker_process, args=(args.concurrency, args.metrics_port + index if args.metrics_port else None),
+                        name=f"receipt-worker-process-{index}")
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop_processes(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_processes)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the whole process group, the children stop on their own
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""Receipt graph runs that wait for a human review without holding a process.
+
+The graph is compiled with a postgres checkpointer and an interrupt before
+human_checker. ReviewQueue.start runs a receipt up to that point: the extraction
+and categorization are checkpointed after every node, and the run is listed
+in the pending_reviews table. Nothing of the run stays in memory or on the
+local disk while it waits, so any host can continue it. ReviewQueue.resume records the decision the way
+human_checker would (accept, revise with instructions, or change the vision
+model), and continues the run from its checkpoint. A revision or a new model
+stops before human_checker again, an accepted receipt is saved.
+
+A run that fails, for instance on an LLM error, is listed as failed and
+keeps its last checkpoint. ReviewQueue.retry continues it from there, so the LLM
+calls that already finished are not paid again. The preprocessed pages are
+in the image store of the host that ran the extraction, another host
+preprocesses the receipt again, from the receipt_jobs image of a run started
+by a receipt worker. Start runs for a directory of
+receipts with
+
+    python -m src.chain.review_queue receipts/ --workers 4
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from src.chain.agent_state import receipt_fields
+from src.chain.graph_state import create_graph_state, setup_agent_graph
+from src.chain.helpers.image_store import image_store
+from src.chain.helpers.llm_scheduler import LLM_PRIORITY_INTERACTIVE, llm_priority
+from src.chain.nodes.image_preprocessor import preprocess_receipt
+from src.database.db_connection import close_connection_pool, get_connection
+from src.database.graph_checkpoints import PostgresCheckpointSaver, delete_graph_checkpoints
+from src.database.receipt_jobs import get_receipt_job_image, mark_receipt_job_saved
+from src.observability.tracing import configure_logging, span
+
+# A run claimed by a resume that has not finished after this many seconds is assumed lost and can be resumed again
+REVIEW_CLAIM_TIMEOUT_SECONDS = float(os.getenv("REVIEW_CLAIM_TIMEOUT_SECONDS", "600"))
+
+REVIEW_NODE = "human_checker"
+
+PENDING_REVIEW_COLUMNS = ("thread_id", "image_location", "single_pass", "receipt", "vision_model_name", "duplicate_receipt",
+                          "pages_truncated", "error", "claimed_at", "created_at", "updated_at")
+PENDING_REVIEW_SELECT_LIST = ", ".join(PENDING_REVIEW_COLUMNS)
+# The clock of the database, so hosts with skewed clocks agree on claim timeouts and on the order of GET /reviews
+EPOCH_NOW = "extract(epoch FROM now())"
+
+
+class ReviewNotFoundError(Exception):
+    pass
+
+
+class ReviewInProgressError(Exception):
+    pass
+
+
+class ReviewStateError(Exception):
+    """The decision does not fit the run, e.g. accepting a run that failed before its review"""
+
+
+class ReviewQueue:
+    """Checkpointed receipt runs stopped before human_checker, and the pending_reviews table listing them"""
+
+    def __init__(self):
+        checkpointer = PostgresCheckpointSaver()
+        # single_pass leaves out the categorizer node, so each variant is its own graph
+        self._workflows = {
+            single_pass: setup_agent_graph(single_pass=single_pass).compile(checkpointer=checkpointer, interrupt_before=[REVIEW_NODE])
+            for single_pass in (False, True)
+        }
+
+    def start(self, image_location: str, single_pass: bool = False, thread_id: str = None) -> dict:
+        """Run a receipt up to the review and return it, or the finished run when the graph ended earlier"""
+        thread_id = thread_id or uuid.uuid4().hex
+
+        with span("review.start", thread_id=thread_id, image_location=image_location):
+            workflow = self._workflows[single_pass]
+            try:
+                # Reading the lookups can fail too, the run is then listed as failed without a checkpoint
+                workflow.invoke(initial_state(image_location, single_pass), config=thread_config(thread_id))
+            except Exception as e:
+                self._record_failure(thread_id, e, image_location, single_pass)
+                raise
+            return self._record(thread_id, single_pass, workflow)
+
+    def pending(self, limit: int = 100, after: tuple = None) -> list:
+        """Runs waiting for a decision or a retry, oldest first.
+
+        after is the (created_at, thread_id) keyset position of the last run of the previous page,
+        runs created at the same time are told apart by their thread_id.
+        """
+        after_created_at, after_thread_id = after if after is not None else (-1.0, "")
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT {PENDING_REVIEW_SELECT_LIST} FROM pending_reviews WHERE (created_at, thread_id) > (%s, %s) "
+                    "ORDER BY created_at, thread_id LIMIT %s",
+                    (after_created_at, after_thread_id, limit)
+                )
+                rows = cursor.fetchall()
+        return [review_from_row(row) for row in rows]
+
+    def get(self, thread_id: str) -> dict:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT {PENDING_REVIEW_SELECT_LIST} FROM pending_reviews WHERE thread_id = %s", (thread_id,))
+                row = cursor.fetchone()
+        if row is None:
+            raise ReviewNotFoundError(thread_id)
+        return review_from_row(row)
+
+    def resume(self, thread_id: str, user_decision: str, **values) -> dict:
+        """Record the decision as the output of human_checker and continue the run from its checkpoint.
+
+        values are written to the state with the decision, e.g. review_instructions
+        for a revision or vision_model_name for change_model.
+        """
+        single_pass = self._claim(thread_id, failed=False)
+        values = {**values, "user_decision": user_decision}
+
+        try:
+            # A reviewer waits for the result, e.g. of change_model, so its LLM calls go first
+            with span("review.resume", thread_id=thread_id, user_decision=user_decision), llm_priority(LLM_PRIORITY_INTERACTIVE):
+                workflow = self._workflows[single_pass]
+                config = thread_config(thread_id)
+                # A revision or a new model sends the pages to the LLM again
+                values.update(self._restore_pages(thread_id, workflow.get_state(config).values))
+                # The decision is written as if human_checker returned it, so its edge picks the next node
+                workflow.update_state(config, values, as_node=REVIEW_NODE)
+                return self._continue(thread_id, single_pass, workflow)
+        except BaseException:
+            self._release(thread_id)
+            raise
+
+    def retry(self, thread_id: str) -> dict:
+        """Continue a failed run from the last node that completed, or start it again when it failed before the first"""
+        single_pass = self._claim(thread_id, failed=True)
+        try:
+            with span("review.retry", thread_id=thread_id):
+                workflow = self._workflows[single_pass]
+                config = thread_config(thread_id)
+                checkpointed = workflow.get_state(config).values
+                if checkpointed.get("image_pages"):
+                    restored = self._restore_pages(thread_id, checkpointed)
+                    if restored:
+                        # Written as the last node that ran, so the run continues with the same next node
+                        workflow.update_state(config, restored)
+                    return self._continue(thread_id, single_pass, workflow)
+
+                # Failed before image_preprocessor read the receipt, whose file the worker has removed since
+                image_location = checkpointed.get("image_location") or self.get(thread_id)["image_location"]
+                with local_receipt_file(thread_id, image_location) as path:
+                    state = None
+                    if not checkpointed:
+                        state = initial_state(path, single_pass)
+                    elif path != image_location:
+                        workflow.update_state(config, {"image_location": path})
+                    return self._continue(thread_id, single_pass, workflow, state)
+        except BaseException:
+            self._release(thread_id)
+            raise
+
+    def _restore_pages(self, thread_id: str, state: dict) -> dict:
+        """Preprocess the receipt again when its pages are not in the local image store, e.g. on another host than its worker.
+
+        Returns the state values to write, the new page handles when they differ from the checkpointed ones.
+        """
+        handles = state.get("image_pages") or []
+        if all(image_store.exists(handle) for handle in handles):
+            return {}
+        pages, _ = preprocess_receipt(load_receipt_image(thread_id, state["image_location"]))
+        restored = [image_store.put(page) for page in pages]
+        # Preprocessing is deterministic, the handles only change with another image library version
+        return {"image_pages": restored} if restored != handles else {}
+
+    def _continue(self, thread_id: str, single_pass: bool, workflow, state: dict = None) -> dict:
+        """Run the graph from its checkpoint, or from state for a run without one"""
+        try:
+            workflow.invoke(state, config=thread_config(thread_id))
+        except Exception as e:
+            self._record_failure(thread_id, e)
+            raise
+        return self._record(thread_id, single_pass, workflow)
+
+    def _claim(self, thread_id: str, failed: bool) -> bool:
+        """Mark the run as being continued so a second decision on it is refused, returns its single_pass"""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE pending_reviews SET claimed_at = {EPOCH_NOW} WHERE thread_id = %s "
+                    f"AND (claimed_at IS NULL OR claimed_at < {EPOCH_NOW} - %s) RETURNING single_pass, error",
+                    (thread_id, REVIEW_CLAIM_TIMEOUT_SECONDS)
+                )
+                row = cursor.fetchone()
+                if row is not None and (row[1] is not None) != failed:
+                    # Leaving the block with the exception rolls the claim back
+                    raise ReviewStateError("Retry a failed run before deciding on it" if row[1] is not None else "Only failed runs can be retried")
+                if row is None:
+                    cursor.execute("SELECT 1 FROM pending_reviews WHERE thread_id = %s", (thread_id,))
+                    if cursor.fetchone() is None:
+                        raise ReviewNotFoundError(thread_id)
+                    raise ReviewInProgressError(thread_id)
+            conn.commit()
+        return row[0]
+
+    def _release(self, thread_id: str):
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("UPDATE pending_reviews SET claimed_at = NULL WHERE thread_id = %s", (thread_id,))
+            conn.commit()
+
+    def _record_failure(self, thread_id: str, error: Exception, image_location: str = None, single_pass: bool = False):
+        """List the run as failed, its checkpoints keep the nodes that completed. image_location is given for a new run"""
+        error = f"{type(error).__name__}: {error}"
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                if image_location is None:
+                    cursor.execute(f"UPDATE pending_reviews SET error = %s, claimed_at = NULL, updated_at = {EPOCH_NOW} WHERE thread_id = %s",
+                                   (error, thread_id))
+                else:
+                    cursor.execute(
+                        "INSERT INTO pending_reviews (thread_id, image_location, single_pass, receipt, vision_model_name, duplicate_receipt, "
+                        f"error, claimed_at, created_at, updated_at) VALUES (%s, %s, %s, '{{}}', NULL, FALSE, %s, NULL, {EPOCH_NOW}, {EPOCH_NOW})",
+                        (thread_id, image_location, single_pass, error)
+                    )
+            conn.commit()
+
+    def _record(self, thread_id: str, single_pass: bool, workflow) -> dict:
+        """List the run as pending while it waits before human_checker, drop it and its checkpoints once its expense is saved.
+
+        Saving also marks the receipt job of the run saved in the same transaction, whether
+        the worker or the API accepted it.
+
+        A run that ended without saving, e.g. because the API rejected the expense,
+        stays listed so it can be accepted again or revised.
+        """
+        snapshot = workflow.get_state(thread_config(thread_id))
+        state = snapshot.values
+        review = {
+            "thread_id": thread_id,
+            "image_location": state.get("image_location"),
+            "single_pass": single_pass,
+            "receipt": json.loads(json.dumps(receipt_fields(state), default=str)),
+            "vision_model_name": state.get("vision_model_name"),
+            "duplicate_receipt": bool(state.get("duplicate_receipt")),
+            "pages_truncated": state.get("pages_truncated") or 0,
+            "transaction_id": state.get("transaction_id"),
+        }
+
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                if review["transaction_id"] is None:
+                    cursor.execute(
+                        "INSERT INTO pending_reviews (thread_id, image_location, single_pass, receipt, vision_model_name, duplicate_receipt, "
+                        "pages_truncated, error, claimed_at, created_at, updated_at) "
+                        f"VALUES (%s, %s, %s, %s, %s, %s, %s, NULL, NULL, {EPOCH_NOW}, {EPOCH_NOW}) "
+                        "ON CONFLICT (thread_id) DO UPDATE SET receipt = EXCLUDED.receipt, vision_model_name = EXCLUDED.vision_model_name, "
+                        "duplicate_receipt = EXCLUDED.duplicate_receipt, pages_truncated = EXCLUDED.pages_truncated, error = NULL, "
+                        "claimed_at = NULL, updated_at = EXCLUDED.updated_at",
+                        (thread_id, review["image_location"], single_pass, json.dumps(review["receipt"]), review["vision_model_name"],
+                         review["duplicate_receipt"], review["pages_truncated"])
+                    )
+                    review["status"] = "pending" if REVIEW_NODE in snapshot.next else "not_saved"
+                else:
+                    cursor.execute("DELETE FROM pending_reviews WHERE thread_id = %s", (thread_id,))
+                    # The run is finished, nothing resumes it again
+                    delete_graph_checkpoints(cursor, thread_id)
+                    mark_receipt_job_saved(cursor, thread_id, review["transaction_id"])
+                    review["status"] = "saved"
+            conn.commit()
+        return review
+
+
+def initial_state(image_location: str, single_pass: bool) -> dict:
+    state = create_graph_state(single_pass=single_pass)
+    state["image_location"] = image_location
+    return state
+
+
+def encode_reviews_cursor(created_at: float, thread_id: str) -> str:
+    # repr keeps every digit of the float, so the cursor compares equal to the stored value
+    return f"{created_at!r}_{thread_id}"
+
+
+def decode_reviews_cursor(cursor: str) -> tuple:
+    """Parse a cursor produced by encode_reviews_cursor, raises ValueError when malformed"""
+    created_at, thread_id = cursor.split("_", 1)
+    return float(created_at), thread_id
+
+
+def load_receipt_image(thread_id: str, image_location: str) -> bytes:
+    """The receipt file of a run, or the uploaded image of its receipt job once the worker removed its copy"""
+    if os.path.exists(image_location):
+        with open(image_location, "rb") as image_file:
+            return image_file.read()
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            image = get_receipt_job_image(cursor, thread_id)
+    if image is None:
+        raise ReviewStateError("The receipt image of this run is gone, upload the receipt again")
+    return image
+
+
+@contextmanager
+def local_receipt_file(thread_id: str, image_location: str):
+    """Path of the receipt file of a run, written out from its receipt job for the duration of the block when it is gone"""
+    if os.path.exists(image_location):
+        yield image_location
+        return
+    image = load_receipt_image(thread_id, image_location)
+    fd, path = tempfile.mkstemp(prefix="receipt-", suffix=os.path.splitext(image_location)[1])
+    try:
+        with os.fdopen(fd, "wb") as image_file:
+            image_file.write(image)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def thread_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def review_from_row(row: tuple) -> dict:
+    review = dict(zip(PENDING_REVIEW_COLUMNS, row))
+    review["status"] = "in_progress" if review.pop("claimed_at") is not None else "failed" if review["error"] is not None else "pending"
+    return review
+
+
+_review_queue = None
+_review_queue_lock = threading.Lock()
+
+
+def get_review_queue() -> ReviewQueue:
+    # Created lazily so importing the routes does not compile the graphs
+    global _review_queue
+    if _review_queue is None:
+        with _review_queue_lock:
+            if _review_queue is None:
+                _review_queue = ReviewQueue()
+    return _review_queue
+
+
+def main():
+    # Imported here, the batch runner is only needed to read the receipt list
+    from src.chain.batch_runner import load_receipt_paths
+
+    parser = argparse.ArgumentParser(description="Extract receipts and leave them waiting for review through the API")
+    parser.add_argument("source", help="Directory of receipt images, or a manifest file with one image path per line")
+    parser.add_argument("--workers", type=int, default=4, help="Receipts processed concurrently")
+    parser.add_argument("--single-pass", action="store_true", help="Extract the category in the same LLM call as the receipt data")
+    args = parser.parse_args()
+
+    configure_logging()
+    review_queue = get_review_queue()
+    image_locations = load_receipt_paths(args.source)
+    pending, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(review_queue.start, image_location, args.single_pass): image_location
+                   for image_location in image_locations}
+        for future in as_completed(futures):
+            try:
+                pending += future.result()["status"] == "pending"
+            except Exception as e:
+                failed += 1
+                print(f"Failed to process {futures[future]}: {e}")
+
+    print(f"{pending} of {len(image_locations)} receipts are waiting for review, {failed} failed")
+    close_connection_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Train the local category classifier from the expenses table.
+
+Each run loads the saved model and trains on the expenses added since the
+highest transaction_id it has seen, so it is cheap to run on a schedule. Use
+--full to rebuild from scratch, e.g. after categories of old expenses were
+corrected, since incremental runs only look at new rows.
+
+    python -m src.chain.train_category_classifier
+    python -m src.chain.train_category_classifier --full
+"""
+
+import argparse
+import os
+import time
+
+from src.chain.helpers.category_classifier import CATEGORY_CLASSIFIER_PATH, CategoryClassifier
+from src.database.db_connection import close_connection_pool, get_connection
+
+TRAINING_BATCH_SIZE = int(os.getenv("CATEGORY_CLASSIFIER_TRAINING_BATCH_SIZE", "5000"))
+
+new_expenses_query = """
+SELECT transaction_id, description, category_id
+FROM expenses
+WHERE transaction_id > %s AND description IS NOT NULL AND category_id IS NOT NULL
+ORDER BY transaction_id
+"""
+
+
+def train(path: str, full: bool = False) -> dict:
+    if full or not os.path.exists(path):
+        classifier = CategoryClassifier()
+    else:
+        classifier = CategoryClassifier.load(path)
+
+    start = time.perf_counter()
+    trained_before = classifier.examples
+    with get_connection() as conn:
+        # A named cursor streams the rows in batches instead of loading the whole table
+        with conn.cursor(name="category_classifier_training") as cursor:
+            cursor.itersize = TRAINING_BATCH_SIZE
+            cursor.execute(new_expenses_query, (classifier.trained_through_transaction_id,))
+            classifier.partial_fit(cursor)
+        conn.rollback()
+
+    classifier.save(path)
+    return {
+        "new_examples": classifier.examples - trained_before,
+        "trained_through_transaction_id": classifier.trained_through_transaction_id,
+        "elapsed_seconds": time.perf_counter() - start,
+        **classifier.evaluation_summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local category classifier from the expenses table")
+    parser.add_argument("--full", action="store_true", help="Retrain from scratch instead of adding new expenses")
+    parser.add_argument("--path", default=CATEGORY_CLASSIFIER_PATH, help="Model file")
+    args = parser.parse_args()
+
+    try:
+        report = train(args.path, args.full)
+    finally:
+        close_connection_pool()
+
+    for name, value in report.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Async connection pool for postgres used when the API runs in async mode.
+Connections are checked out per request through the get_async_db_connection
+dependency.
+"""
+
+import os
+from contextlib import asynccontextmanager
+
+import asyncpg
+from dotenv import load_dotenv
+
+from src.database.db_connection import get_connection_params
+from src.database.query_metrics import record_asyncpg_query
+
+load_dotenv()
+
+ASYNC_DB_POOL_MIN_CONN = int(os.getenv("ASYNC_DB_POOL_MIN_CONN", "5"))
+ASYNC_DB_POOL_MAX_CONN = int(os.getenv("ASYNC_DB_POOL_MAX_CONN", "50"))
+# Seconds to wait for a free connection before giving up
+ASYNC_DB_POOL_TIMEOUT = float(os.getenv("ASYNC_DB_POOL_TIMEOUT", "30"))
+# Idle connections above the minimum are closed after this many seconds
+ASYNC_DB_POOL_MAX_IDLE = float(os.getenv("ASYNC_DB_POOL_MAX_IDLE", "300"))
+
+_async_connection_pool = None
+
+
+async def open_async_connection_pool() -> asyncpg.Pool:
+    global _async_connection_pool
+    if _async_connection_pool is None:
+        params = get_connection_params()
+        _async_connection_pool = await asyncpg.create_pool(
+            database=params["dbname"],
+            user=params["user"],
+            password=params["password"],
+            host=params["host"],
+            port=int(params["port"]) if params["port"] else None,
+            min_size=ASYNC_DB_POOL_MIN_CONN,
+            max_size=ASYNC_DB_POOL_MAX_CONN,
+            max_inactive_connection_lifetime=ASYNC_DB_POOL_MAX_IDLE,
+        )
+    return _async_connection_pool
+
+
+async def close_async_connection_pool():
+    global _async_connection_pool
+    if _async_connection_pool is not None:
+        await _async_connection_pool.close()
+        _async_connection_pool = None
+
+
+def get_async_connection_pool() -> asyncpg.Pool:
+    if _async_connection_pool is None:
+        raise RuntimeError("Async connection pool is not open, call open_async_connection_pool() on startup")
+    return _async_connection_pool
+
+
+@asynccontextmanager
+async def acquire_async_connection():
+    """Check out a pooled connection whose statements are recorded in DB_QUERY_SECONDS"""
+    async with get_async_connection_pool().acquire(timeout=ASYNC_DB_POOL_TIMEOUT) as conn:
+        with conn.query_logger(record_asyncpg_query):
+            yield conn
+
+
+async def get_async_db_connection():
+    """FastAPI dependency yielding a pooled asyncpg connection for the request.
+
+    asyncpg resets the connection on release and replaces connections that
+    were closed by the server, so dropped connections are not handed out again.
+    """
+    async with acquire_async_connection() as conn:
+        yield conn
@@ -0,0 +1,74 @@
+"""Background LISTEN on the table_changed channel.
+
+Triggers on categories, payment_methods and expenses send the table name on
+table_changed whenever a statement writes to it, delivered when the writing
+transaction commits. ChangeListener keeps a dedicated connection listening in
+a thread and calls on_change with the table name, reconnecting when the
+connection drops.
+"""
+
+import logging
+import select
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+from src.database.db_connection import get_connection_params
+
+logger = logging.getLogger(__name__)
+
+TABLE_CHANGED_CHANNEL = "table_changed"
+# Seconds between checks of the stop flag while no notification arrives
+POLL_INTERVAL_SECONDS = 1.0
+RECONNECT_DELAY_SECONDS = 5.0
+
+
+class ChangeListener:
+    def __init__(self, on_change, on_connected=None, on_disconnected=None):
+        self.on_change = on_change
+        self.on_connected = on_connected
+        self.on_disconnected = on_disconnected
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="change-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=POLL_INTERVAL_SECONDS * 2)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                # TCP keepalives notice a dead server even when no notification is due
+                conn = psycopg2.connect(**get_connection_params(), keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {TABLE_CHANGED_CHANNEL}")
+                if self.on_connected:
+                    self.on_connected()
+                self._listen(conn)
+            except psycopg2.Error as e:
+                logger.warning("Change listener lost its connection, retrying in %.0fs: %s", RECONNECT_DELAY_SECONDS, e)
+            finally:
+                # Notifications sent while disconnected are lost, so the caller must treat everything as changed
+                if self.on_disconnected:
+                    self.on_disconnected()
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(RECONNECT_DELAY_SECONDS)
+
+    def _listen(self, conn):
+        while not self._stop.is_set():
+            if select.select([conn], [], [], POLL_INTERVAL_SECONDS) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                self.on_change(conn.notifies.pop(0).payload)
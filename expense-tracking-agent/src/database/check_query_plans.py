@@ -0,0 +1,90 @@
+"""Check with EXPLAIN that every filter combination of GET /expenses is served by an index.
+
+The queries are built with the same builder the routers use. Sequential scans
+are disabled for the session so the planner picks an index whenever one
+matches, even on a small development database where a sequential scan would
+be cheaper. Exits with status 1 when a query cannot use any expenses index.
+tests/test_query_plans.py runs the same checks under pytest.
+
+    python -m src.database.check_query_plans
+"""
+
+import itertools
+import sys
+from datetime import date
+
+from src.database.db_connection import get_connection, close_connection_pool
+from src.database.expense_queries import build_expenses_query
+
+SAMPLE_FILTERS = {
+    "category_id": 1,
+    "payment_method_id": 1,
+    "start_date": date(2024, 1, 1),
+    "end_date": date(2024, 12, 31),
+}
+
+INDEX_SCAN_NODE_TYPES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+# (limit, after) of the whole result, a page after a dated expense and a page after an expense without a date
+SAMPLE_PAGES = ((None, None), (100, (date(2024, 6, 1), 1)), (100, (None, 1)))
+
+
+def find_index_scans(plan: dict) -> list:
+    """Return the names of the expenses secondary indexes used anywhere in a JSON plan"""
+    index_names = []
+    index_name = plan.get("Index Name", "")
+    if plan.get("Node Type") in INDEX_SCAN_NODE_TYPES and index_name.startswith("expenses_") and index_name.endswith("_idx"):
+        index_names.append(index_name)
+    for child in plan.get("Plans", []):
+        index_names.extend(find_index_scans(child))
+    return index_names
+
+
+def filter_combinations():
+    names = list(SAMPLE_FILTERS)
+    for size in range(len(names) + 1):
+        for combination in itertools.combinations(names, size):
+            yield {name: SAMPLE_FILTERS[name] for name in combination}
+
+
+def query_label(filters: dict, limit: int, after: tuple) -> str:
+    label = ", ".join(filters) or "no filters"
+    if after is not None:
+        label += " (page after an expense without a date)" if after[0] is None else " (page)"
+    return label
+
+
+def explain_expenses_query(cursor, filters: dict, limit: int = None, after: tuple = None) -> dict:
+    """JSON plan of the GET /expenses query, run with sequential scans disabled in the current transaction"""
+    cursor.execute("SET LOCAL enable_seqscan = off")
+    query, params = build_expenses_query(limit=limit, after=after, **filters)
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", tuple(params))
+    return cursor.fetchone()[0][0]["Plan"]
+
+
+def check_query_plans() -> bool:
+    all_indexed = True
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            for filters in filter_combinations():
+                for limit, after in SAMPLE_PAGES:
+                    plan = explain_expenses_query(cursor, filters, limit, after)
+                    index_names = find_index_scans(plan)
+
+                    label = query_label(filters, limit, after)
+                    if index_names:
+                        print(f"OK   {label}: {', '.join(index_names)}")
+                    else:
+                        all_indexed = False
+                        print(f"FAIL {label}: {plan['Node Type']}")
+
+        conn.rollback()
+
+    return all_indexed
+
+
+if __name__ == "__main__":
+    indexed = check_query_plans()
+    close_connection_pool()
+    sys.exit(0 if indexed else 1)
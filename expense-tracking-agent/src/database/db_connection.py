@@ -1,20 +1,150 @@
-"""The connects to postgres and exposes conn and cursor object
+"""Connection pool for postgres. Connections are checked out per request
+through the get_db_cursor dependency instead of sharing one module-level
+connection and cursor.
 """
 
+import os
+import threading
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions, pool
 from dotenv import load_dotenv
-import os
+
+from src.database.query_metrics import InstrumentedCursor
 
 load_dotenv()
 
-# Establish connection to the PostgreSQL database
-conn = psycopg2.connect(
-    dbname=os.getenv("DB_NAME"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASSWORD"),
-    host=os.getenv("DB_HOST"),
-    port=os.getenv("DB_PORT")
-)
-
-# Create a cursor object
-cursor = conn.cursor()
\ No newline at end of file
+DB_POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN_CONN", "1"))
+DB_POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", "10"))
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Run a cheap query on checkout so dropped connections are replaced before use
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+def get_connection_params() -> dict:
+    return {
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+    }
+
+
+class ConnectionPool:
+    """Thread safe pool that blocks when exhausted instead of raising.
+
+    psycopg2's ThreadedConnectionPool raises PoolError as soon as maxconn
+    connections are checked out, so a semaphore bounds checkouts and makes
+    extra worker threads wait for a connection to be returned.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, pre_ping: bool, **connection_params):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **connection_params)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        self._pre_ping = pre_ping
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolTimeoutError(f"No database connection available after {self._timeout} seconds")
+
+        try:
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                # Discard the dropped connection and open a fresh one
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close: bool = False):
+        try:
+            if not close and not conn.closed:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    # Never hand out a connection with a half finished transaction
+                    conn.rollback()
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if not self._pre_ping:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> ConnectionPool:
+    # The pool is created lazily so importing the routers does not open connections
+    global _connection_pool
+    if _connection_pool is None:
+        with _connection_pool_lock:
+            if _connection_pool is None:
+                _connection_pool = ConnectionPool(
+                    DB_POOL_MIN_CONN,
+                    DB_POOL_MAX_CONN,
+                    DB_POOL_TIMEOUT,
+                    DB_POOL_PRE_PING,
+                    # Every statement is timed in DB_QUERY_SECONDS
+                    cursor_factory=InstrumentedCursor,
+                    **get_connection_params()
+                )
+    return _connection_pool
+
+
+def close_connection_pool():
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is not None:
+            _connection_pool.closeall()
+            _connection_pool = None
+
+
+@contextmanager
+def get_connection():
+    """Check out a pooled connection, rolling back on error and returning it afterwards"""
+    connection_pool = get_connection_pool()
+    conn = connection_pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # The server dropped the connection, so it must not go back in the pool
+        broken = True
+        raise
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        connection_pool.putconn(conn, close=broken)
+
+
+def get_db_cursor():
+    """FastAPI dependency yielding a cursor on a connection checked out for the request"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            yield cursor
@@ -0,0 +1,120 @@
+"""SQL for listing and summarizing expenses, shared by the sync and async routers.
+
+Queries are built with psycopg2 style %s placeholders, use
+to_asyncpg_placeholders to run them on asyncpg.
+"""
+
+from datetime import date
+import re
+
+# Column order of the expense rows returned by build_expenses_query. Amounts are
+# read as text, which is already their JSON form, so rows can be serialized
+# without converting them to Decimal and back
+EXPENSE_COLUMNS = ("transaction_id", "date", "category_id", "description", "amount", "vat", "payment_method_id", "business_personal")
+EXPENSE_SELECT_LIST = ("transaction_id, date, category_id, description, amount::text AS amount, vat::text AS vat, "
+                       "payment_method_id, business_personal")
+
+
+def build_expenses_filter(
+    category_id: int = None,
+    payment_method_id: int = None,
+    start_date: date = None,
+    end_date: date = None,
+    after: tuple = None) -> tuple:
+    """Return the WHERE clause and parameters for the filters supported by GET /expenses.
+
+    after is a (date, transaction_id) keyset position, only rows sorting after it are kept.
+    Receipts without a date sort last, the row comparison alone would never reach them.
+    """
+    query = "WHERE 1=1"
+    params = []
+
+    if category_id is not None:
+        query += " AND category_id = %s"
+        params.append(category_id)
+
+    if payment_method_id is not None:
+        query += " AND payment_method_id = %s"
+        params.append(payment_method_id)
+
+    if start_date is not None:
+        query += " AND date >= %s"
+        params.append(start_date)
+
+    if end_date is not None:
+        query += " AND date <= %s"
+        params.append(end_date)
+
+    if after is not None:
+        after_date, after_transaction_id = after
+        if after_date is None:
+            query += " AND date IS NULL AND transaction_id > %s"
+            params.append(after_transaction_id)
+        else:
+            query += " AND ((date, transaction_id) > (%s, %s) OR date IS NULL)"
+            params.extend(after)
+
+    return query, params
+
+
+def build_expenses_query(limit: int = None, **filters) -> tuple:
+    """SELECT for GET /expenses in keyset order (date, transaction_id), expenses without a date last"""
+    where, params = build_expenses_filter(**filters)
+    query = f"SELECT {EXPENSE_SELECT_LIST} FROM expenses {where} ORDER BY date NULLS LAST, transaction_id"
+
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    return query, params
+
+
+# Date part of the cursor of an expense without a date
+NULL_DATE_CURSOR = "null"
+
+
+def encode_expenses_cursor(expense_date: date, transaction_id: int) -> str:
+    return f"{expense_date.isoformat() if expense_date is not None else NULL_DATE_CURSOR}_{transaction_id}"
+
+
+def decode_expenses_cursor(cursor: str) -> tuple:
+    """Parse a cursor produced by encode_expenses_cursor, raises ValueError when malformed"""
+    expense_date, transaction_id = cursor.split("_", 1)
+    if expense_date == NULL_DATE_CURSOR:
+        return None, int(transaction_id)
+    return date.fromisoformat(expense_date), int(transaction_id)
+
+
+def to_asyncpg_placeholders(query: str) -> str:
+    counter = iter(range(1, query.count("%s") + 1))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", query)
+
+
+# Columns GET /expenses/summary can group by, periods are truncated dates
+SUMMARY_GROUP_COLUMNS = {
+    "category": "category_id",
+    "payment_method": "payment_method_id",
+    "business_personal": "business_personal",
+    "day": "date AS period",
+    "week": "date_trunc('week', date)::date AS period",
+    "month": "date_trunc('month', date)::date AS period",
+}
+SUMMARY_PERIODS = ("day", "week", "month")
+
+
+def build_expense_summary_query(group_by: list, **filters) -> tuple:
+    """SELECT of expense totals from the expense_daily_totals summary table, grouped by
+    the SUMMARY_GROUP_COLUMNS keys in group_by. At most one period may be given."""
+    where, params = build_expenses_filter(**filters)
+    columns = [SUMMARY_GROUP_COLUMNS[group] for group in group_by]
+    # GROUP BY and ORDER BY refer to the output columns by position
+    positions = ", ".join(str(position) for position in range(1, len(columns) + 1))
+
+    query = "SELECT " + "".join(f"{column}, " for column in columns)
+    query += ("COALESCE(sum(expense_count), 0) AS expense_count, COALESCE(sum(amount_total), 0) AS amount, "
+              "COALESCE(sum(vat_total), 0) AS vat "
+              f"FROM expense_daily_totals {where}")
+    if columns:
+        query += f" GROUP BY {positions} ORDER BY {positions}"
+
+    return query, params
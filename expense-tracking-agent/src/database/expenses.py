@@ -0,0 +1,110 @@
+"""Validation and saving of expenses, shared by the API and the graph.
+
+ExpenseCreate validates an expense the way POST /expenses does, save_expense and
+save_expenses insert and commit on a psycopg2 cursor with the SQL of
+repositories.py. The sync routers and the graph's database backend
+(src/chain/helpers/expenses_backend.py) both call them, the async routers
+reuse the models and the validation.
+"""
+
+import os
+from datetime import date
+from decimal import Decimal
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError, validator
+
+from src.database.repositories import existing_category_ids, existing_payment_method_ids, insert_expense, insert_expenses
+
+load_dotenv()
+
+# Rows sent per multi-row INSERT statement
+BULK_INSERT_PAGE_SIZE = int(os.getenv("BULK_INSERT_PAGE_SIZE", "1000"))
+
+
+class ExpenseCreate(BaseModel):
+    date: date
+    category_id: int
+    description: str
+    amount: Decimal 
+    vat: Decimal 
+    payment_method_id: int 
+    business_personal: str
+
+    @validator("date")
+    def validate_date(cls, value):
+        if value > date.today():
+            raise ValueError("Date cannot be in the future")
+        return value
+
+class Expense(BaseModel):
+    transaction_id: int
+    date: date
+    category_id: int
+    description: str
+    amount: Decimal
+    vat: Decimal
+    payment_method_id: int
+    business_personal: str
+
+class BulkExpenseError(BaseModel):
+    index: int
+    detail: str
+
+class BulkExpenseResult(BaseModel):
+    # transaction_ids[i] belongs to the i-th row that was inserted, rows listed in errors are skipped
+    transaction_ids: list[int]
+    inserted_indexes: list[int]
+    errors: list[BulkExpenseError]
+
+
+def validate_bulk_expenses(rows: list) -> tuple:
+    """Validate every row and return (index, ExpenseCreate) pairs for valid rows plus per-row errors"""
+    valid_rows, errors = [], []
+    for index, row in enumerate(rows):
+        if isinstance(row, Exception):
+            errors.append(BulkExpenseError(index=index, detail=f"Invalid JSON: {row}"))
+            continue
+        try:
+            valid_rows.append((index, ExpenseCreate.model_validate(row)))
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors())
+            errors.append(BulkExpenseError(index=index, detail=detail))
+    return valid_rows, errors
+
+def reject_unknown_references(valid_rows: list, errors: list, category_ids: set, payment_method_ids: set) -> list:
+    """Move rows pointing at a missing category or payment method to errors instead of failing the whole insert"""
+    accepted_rows = []
+    for index, expense in valid_rows:
+        if expense.category_id not in category_ids:
+            errors.append(BulkExpenseError(index=index, detail=f"category_id: Category {expense.category_id} does not exist"))
+        elif expense.payment_method_id not in payment_method_ids:
+            errors.append(BulkExpenseError(index=index, detail=f"payment_method_id: Payment method {expense.payment_method_id} does not exist"))
+        else:
+            accepted_rows.append((index, expense))
+    errors.sort(key=lambda error: error.index)
+    return accepted_rows
+
+
+def save_expense(cursor, expense_data: ExpenseCreate) -> Expense:
+    """Insert one expense and commit, shared by POST /expenses and the graph's database backend"""
+    new_expense = insert_expense(cursor, expense_data)
+    cursor.connection.commit()
+    return Expense(transaction_id=new_expense[0], date=new_expense[1], category_id=new_expense[2], description=new_expense[3],
+                   amount=new_expense[4], vat=new_expense[5], payment_method_id=new_expense[6], business_personal=new_expense[7])
+
+def save_expenses(cursor, rows: list) -> BulkExpenseResult:
+    """Validate and insert many expenses in one transaction, shared by POST /expenses/bulk and the graph's database backend"""
+    valid_rows, errors = validate_bulk_expenses(rows)
+    if valid_rows:
+        # Check foreign keys once for the whole batch
+        category_ids = existing_category_ids(cursor, {expense.category_id for _, expense in valid_rows})
+        payment_method_ids = existing_payment_method_ids(cursor, {expense.payment_method_id for _, expense in valid_rows})
+        valid_rows = reject_unknown_references(valid_rows, errors, category_ids, payment_method_ids)
+
+    transaction_ids = []
+    if valid_rows:
+        transaction_ids = insert_expenses(cursor, [expense for _, expense in valid_rows], BULK_INSERT_PAGE_SIZE)
+    cursor.connection.commit()
+
+    return BulkExpenseResult(transaction_ids=transaction_ids, inserted_indexes=[index for index, _ in valid_rows], errors=errors)
@@ -0,0 +1,71 @@
+"""LangGraph checkpointer keeping the receipt graph checkpoints in the graph_checkpoints table.
+
+Checkpoints go through the connection pool instead of a local SQLite file, so
+the API and the receipt workers continue each other's runs from any host that
+reaches the database.
+"""
+
+import pickle
+
+import psycopg2
+from langgraph.checkpoint.base import BaseCheckpointSaver, Checkpoint, CheckpointTuple
+
+from src.database.db_connection import get_connection
+
+
+def checkpoint_tuple(thread_id: str, thread_ts: str, parent_ts: str, checkpoint: Checkpoint) -> CheckpointTuple:
+    return CheckpointTuple(
+        {"configurable": {"thread_id": thread_id, "thread_ts": thread_ts}},
+        checkpoint,
+        {"configurable": {"thread_id": thread_id, "thread_ts": parent_ts}} if parent_ts else None,
+    )
+
+
+def delete_graph_checkpoints(cursor, thread_id: str):
+    """Drop every checkpoint of a finished run, leaves committing to the caller"""
+    cursor.execute("DELETE FROM graph_checkpoints WHERE thread_id = %s", (thread_id,))
+
+
+class PostgresCheckpointSaver(BaseCheckpointSaver):
+    """Same storage as langgraph's SqliteSaver, one pickled checkpoint per (thread_id, thread_ts)"""
+
+    serde = pickle
+
+    def get_tuple(self, config: dict):
+        thread_id = config["configurable"]["thread_id"]
+        thread_ts = config["configurable"].get("thread_ts")
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                if thread_ts:
+                    cursor.execute("SELECT thread_ts, parent_ts, checkpoint FROM graph_checkpoints WHERE thread_id = %s AND thread_ts = %s",
+                                   (thread_id, thread_ts))
+                else:
+                    cursor.execute("SELECT thread_ts, parent_ts, checkpoint FROM graph_checkpoints WHERE thread_id = %s "
+                                   "ORDER BY thread_ts DESC LIMIT 1", (thread_id,))
+                row = cursor.fetchone()
+        if row is None:
+            return None
+        return checkpoint_tuple(thread_id, row[0], row[1], self.serde.loads(bytes(row[2])))
+
+    def list(self, config: dict):
+        thread_id = config["configurable"]["thread_id"]
+        # Read before yielding so the connection is not held while the caller iterates
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT thread_ts, parent_ts, checkpoint FROM graph_checkpoints WHERE thread_id = %s ORDER BY thread_ts DESC",
+                               (thread_id,))
+                rows = cursor.fetchall()
+        for thread_ts, parent_ts, checkpoint in rows:
+            yield checkpoint_tuple(thread_id, thread_ts, parent_ts, self.serde.loads(bytes(checkpoint)))
+
+    def put(self, config: dict, checkpoint: Checkpoint) -> dict:
+        thread_id = config["configurable"]["thread_id"]
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO graph_checkpoints (thread_id, thread_ts, parent_ts, checkpoint) VALUES (%s, %s, %s, %s) "
+                    "ON CONFLICT (thread_id, thread_ts) DO UPDATE SET parent_ts = EXCLUDED.parent_ts, checkpoint = EXCLUDED.checkpoint",
+                    (thread_id, checkpoint["ts"], config["configurable"].get("thread_ts"), psycopg2.Binary(self.serde.dumps(checkpoint)))
+                )
+            conn.commit()
+        return {"configurable": {"thread_id": thread_id, "thread_ts": checkpoint["ts"]}}
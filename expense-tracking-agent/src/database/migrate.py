@@ -0,0 +1,87 @@
+"""Apply the versioned SQL migrations in src/database/migrations.
+
+Migration files are named <version>_<name>.sql and applied in version order,
+each one in its own transaction. Applied versions are recorded in
+schema_migrations so running the script again only applies new files.
+
+    python -m src.database.migrate
+"""
+
+import os
+import re
+
+from src.database.db_connection import get_connection, close_connection_pool
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_(\w+)\.sql$")
+# Arbitrary key for pg_advisory_lock so concurrent runs apply migrations one at a time
+MIGRATIONS_LOCK_ID = 72817
+
+create_table_schema_migrations = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(200) NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+def list_migrations() -> list:
+    """Return (version, name, path) for every migration file, sorted by version"""
+    migrations = []
+    for file_name in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_PATTERN.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, file_name)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Two migration files share the same version number")
+    return migrations
+
+
+def run_migrations() -> list:
+    """Apply pending migrations and return the versions that were applied"""
+    applied_now = []
+
+    with get_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+                try:
+                    cursor.execute(create_table_schema_migrations)
+                    cursor.execute("SELECT version FROM schema_migrations")
+                    applied = {row[0] for row in cursor.fetchall()}
+
+                    for version, name, path in list_migrations():
+                        if version in applied:
+                            continue
+                        with open(path, "r") as file:
+                            sql = file.read()
+
+                        # Apply the migration and record it atomically
+                        cursor.execute("BEGIN")
+                        try:
+                            cursor.execute(sql)
+                            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                            cursor.execute("COMMIT")
+                        except Exception:
+                            cursor.execute("ROLLBACK")
+                            raise
+                        applied_now.append(version)
+                        print(f"Applied migration {version:04d}_{name}")
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+        finally:
+            conn.autocommit = False
+
+    return applied_now
+
+
+if __name__ == "__main__":
+    applied_versions = run_migrations()
+    if not applied_versions:
+        print("Database schema is up to date")
+    close_connection_pool()
@@ -1,22 +1,15 @@
-from db_connection import conn, cursor
-
-# Define SQL statements to create tables
-create_table_categories = """
-CREATE TABLE categories (
+-- Initial schema: categories, payment_methods and expenses
+CREATE TABLE IF NOT EXISTS categories (
     category_id SERIAL PRIMARY KEY,
     category_name VARCHAR(100) UNIQUE
 );
-"""
 
-create_table_payment_methods = """
-CREATE TABLE payment_methods (
+CREATE TABLE IF NOT EXISTS payment_methods (
     payment_method_id SERIAL PRIMARY KEY,
     payment_method_name VARCHAR(100) UNIQUE
 );
-"""
 
-create_table_expenses = """
-CREATE TABLE expenses (
+CREATE TABLE IF NOT EXISTS expenses (
     transaction_id SERIAL PRIMARY KEY,
     date DATE,
     category_id INT,
@@ -29,16 +22,3 @@ CREATE TABLE expenses (
     FOREIGN KEY (category_id) REFERENCES categories(category_id),
     FOREIGN KEY (payment_method_id) REFERENCES payment_methods(payment_method_id)
 );
-"""
-
-# Execute the SQL statements to create tables
-cursor.execute(create_table_categories)
-cursor.execute(create_table_payment_methods)
-cursor.execute(create_table_expenses)
-
-# Commit the transaction
-conn.commit()
-
-# Close the cursor and connection
-cursor.close()
-conn.close()
\ No newline at end of file
@@ -0,0 +1,19 @@
+-- Indexes matching the filters of GET /expenses. Every index ends with
+-- (date, transaction_id) so filtered lists are read in keyset order and
+-- LIMIT / after pages stop early instead of sorting the whole match.
+
+-- No filter, start_date / end_date only
+CREATE INDEX IF NOT EXISTS expenses_date_transaction_id_idx
+    ON expenses (date, transaction_id);
+
+-- category_id with or without a date range, also covers the categories foreign key
+CREATE INDEX IF NOT EXISTS expenses_category_id_date_idx
+    ON expenses (category_id, date, transaction_id);
+
+-- payment_method_id with or without a date range, also covers the payment_methods foreign key
+CREATE INDEX IF NOT EXISTS expenses_payment_method_id_date_idx
+    ON expenses (payment_method_id, date, transaction_id);
+
+-- category_id and payment_method_id together
+CREATE INDEX IF NOT EXISTS expenses_category_id_payment_method_id_date_idx
+    ON expenses (category_id, payment_method_id, date, transaction_id);
@@ -0,0 +1,27 @@
+-- Version counters for the lookup tables. Every write statement on categories
+-- or payment_methods bumps the table's version, which the API serves as the
+-- ETag of GET /categories and GET /payment_methods.
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1
+);
+
+INSERT INTO table_versions (table_name) VALUES ('categories'), ('payment_methods')
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS categories_bump_table_version ON categories;
+CREATE TRIGGER categories_bump_table_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categories
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS payment_methods_bump_table_version ON payment_methods;
+CREATE TRIGGER payment_methods_bump_table_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON payment_methods
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
@@ -0,0 +1,102 @@
+-- Daily totals of expenses per category, payment method and business/personal,
+-- which GET /expenses/summary aggregates instead of scanning expenses. The
+-- table is kept up to date by statement level triggers that apply the net
+-- change of each statement, read from its transition tables, so a bulk insert
+-- costs one upsert per affected group rather than one per row.
+CREATE TABLE IF NOT EXISTS expense_daily_totals (
+    date DATE,
+    category_id INT,
+    payment_method_id INT,
+    business_personal VARCHAR(100),
+    expense_count BIGINT NOT NULL,
+    amount_total NUMERIC(18, 2) NOT NULL,
+    vat_total NUMERIC(18, 2) NOT NULL
+);
+
+-- The group columns can be NULL like in expenses, so the unique key coalesces them.
+-- An empty business_personal is stored as NULL so it cannot collide with it in the key
+CREATE UNIQUE INDEX IF NOT EXISTS expense_daily_totals_group_idx ON expense_daily_totals (
+    COALESCE(date, '-infinity'::date), COALESCE(category_id, 0), COALESCE(payment_method_id, 0), COALESCE(business_personal, '')
+);
+CREATE INDEX IF NOT EXISTS expense_daily_totals_date_idx ON expense_daily_totals (date);
+CREATE INDEX IF NOT EXISTS expense_daily_totals_category_id_date_idx ON expense_daily_totals (category_id, date);
+CREATE INDEX IF NOT EXISTS expense_daily_totals_payment_method_id_date_idx ON expense_daily_totals (payment_method_id, date);
+-- Finds the groups that became empty after a delete or update
+CREATE INDEX IF NOT EXISTS expense_daily_totals_empty_idx ON expense_daily_totals (expense_count) WHERE expense_count = 0;
+
+CREATE OR REPLACE FUNCTION apply_expense_daily_totals() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE expense_daily_totals;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO expense_daily_totals AS totals (date, category_id, payment_method_id, business_personal, expense_count, amount_total, vat_total)
+        SELECT date, category_id, payment_method_id, NULLIF(business_personal, ''), count(*), COALESCE(sum(amount), 0), COALESCE(sum(vat), 0)
+        FROM new_rows
+        GROUP BY date, category_id, payment_method_id, NULLIF(business_personal, '')
+        ON CONFLICT (COALESCE(date, '-infinity'::date), COALESCE(category_id, 0), COALESCE(payment_method_id, 0), COALESCE(business_personal, ''))
+        DO UPDATE SET expense_count = totals.expense_count + EXCLUDED.expense_count,
+                      amount_total = totals.amount_total + EXCLUDED.amount_total,
+                      vat_total = totals.vat_total + EXCLUDED.vat_total;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO expense_daily_totals AS totals (date, category_id, payment_method_id, business_personal, expense_count, amount_total, vat_total)
+        SELECT date, category_id, payment_method_id, NULLIF(business_personal, ''), -count(*), -COALESCE(sum(amount), 0), -COALESCE(sum(vat), 0)
+        FROM old_rows
+        GROUP BY date, category_id, payment_method_id, NULLIF(business_personal, '')
+        ON CONFLICT (COALESCE(date, '-infinity'::date), COALESCE(category_id, 0), COALESCE(payment_method_id, 0), COALESCE(business_personal, ''))
+        DO UPDATE SET expense_count = totals.expense_count + EXCLUDED.expense_count,
+                      amount_total = totals.amount_total + EXCLUDED.amount_total,
+                      vat_total = totals.vat_total + EXCLUDED.vat_total;
+    ELSE
+        -- An update moves rows from their old group to their new one
+        INSERT INTO expense_daily_totals AS totals (date, category_id, payment_method_id, business_personal, expense_count, amount_total, vat_total)
+        SELECT date, category_id, payment_method_id, business_personal, sum(sign), COALESCE(sum(sign * amount), 0), COALESCE(sum(sign * vat), 0)
+        FROM (
+            SELECT date, category_id, payment_method_id, NULLIF(business_personal, '') AS business_personal, amount, vat, 1 AS sign FROM new_rows
+            UNION ALL
+            SELECT date, category_id, payment_method_id, NULLIF(business_personal, ''), amount, vat, -1 FROM old_rows
+        ) changes
+        GROUP BY date, category_id, payment_method_id, business_personal
+        ON CONFLICT (COALESCE(date, '-infinity'::date), COALESCE(category_id, 0), COALESCE(payment_method_id, 0), COALESCE(business_personal, ''))
+        DO UPDATE SET expense_count = totals.expense_count + EXCLUDED.expense_count,
+                      amount_total = totals.amount_total + EXCLUDED.amount_total,
+                      vat_total = totals.vat_total + EXCLUDED.vat_total;
+    END IF;
+
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM expense_daily_totals WHERE expense_count = 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers with transition tables can only handle one event each
+DROP TRIGGER IF EXISTS expenses_daily_totals_insert ON expenses;
+CREATE TRIGGER expenses_daily_totals_insert
+    AFTER INSERT ON expenses REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_expense_daily_totals();
+
+DROP TRIGGER IF EXISTS expenses_daily_totals_update ON expenses;
+CREATE TRIGGER expenses_daily_totals_update
+    AFTER UPDATE ON expenses REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_expense_daily_totals();
+
+DROP TRIGGER IF EXISTS expenses_daily_totals_delete ON expenses;
+CREATE TRIGGER expenses_daily_totals_delete
+    AFTER DELETE ON expenses REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_expense_daily_totals();
+
+DROP TRIGGER IF EXISTS expenses_daily_totals_truncate ON expenses;
+CREATE TRIGGER expenses_daily_totals_truncate
+    AFTER TRUNCATE ON expenses
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_expense_daily_totals();
+
+-- Backfill from the existing expenses, with writes blocked so none are counted twice or missed
+LOCK TABLE expenses IN SHARE ROW EXCLUSIVE MODE;
+TRUNCATE expense_daily_totals;
+INSERT INTO expense_daily_totals (date, category_id, payment_method_id, business_personal, expense_count, amount_total, vat_total)
+SELECT date, category_id, payment_method_id, NULLIF(business_personal, ''), count(*), COALESCE(sum(amount), 0), COALESCE(sum(vat), 0)
+FROM expenses
+GROUP BY date, category_id, payment_method_id, NULLIF(business_personal, '');
@@ -0,0 +1,31 @@
+-- Notify the API processes on the table_changed channel, with the table name as
+-- payload, whenever a statement writes to categories, payment_methods or expenses.
+-- Notifications are delivered on commit and repeated ones in a transaction are
+-- folded into one, so they cost nothing per row. They invalidate the response
+-- cache, whose content hash ETags replace the table_versions counters.
+CREATE OR REPLACE FUNCTION notify_table_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('table_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS categories_notify_table_changed ON categories;
+CREATE TRIGGER categories_notify_table_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categories
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed();
+
+DROP TRIGGER IF EXISTS payment_methods_notify_table_changed ON payment_methods;
+CREATE TRIGGER payment_methods_notify_table_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON payment_methods
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed();
+
+DROP TRIGGER IF EXISTS expenses_notify_table_changed ON expenses;
+CREATE TRIGGER expenses_notify_table_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON expenses
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed();
+
+DROP TRIGGER IF EXISTS categories_bump_table_version ON categories;
+DROP TRIGGER IF EXISTS payment_methods_bump_table_version ON payment_methods;
+DROP FUNCTION IF EXISTS bump_table_version();
+DROP TABLE IF EXISTS table_versions;
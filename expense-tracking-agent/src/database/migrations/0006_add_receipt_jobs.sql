@@ -0,0 +1,37 @@
+-- Queue of uploaded receipts waiting for the graph. POST /receipts inserts a
+-- queued job holding the image, and src/chain/receipt_worker.py claims jobs with
+-- FOR UPDATE SKIP LOCKED, so any number of worker processes on any host can
+-- share the queue without handing out the same job twice. A claimed job is
+-- leased until locked_until, a job whose worker died is claimed again once the
+-- lease has expired.
+CREATE TABLE IF NOT EXISTS receipt_jobs (
+    job_id BIGSERIAL PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued'
+        CHECK (status IN ('queued', 'running', 'review', 'saved', 'failed')),
+    image_name VARCHAR(255) NOT NULL,
+    -- Cleared once the expense is saved
+    image BYTEA,
+    single_pass BOOLEAN NOT NULL DEFAULT FALSE,
+    auto_accept BOOLEAN NOT NULL DEFAULT FALSE,
+    attempts INT NOT NULL DEFAULT 0,
+    worker VARCHAR(200),
+    locked_until TIMESTAMPTZ,
+    review_thread_id VARCHAR(64),
+    transaction_id INT,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+
+-- Receipt images are already compressed, so they are stored out of line without another compression pass
+ALTER TABLE receipt_jobs ALTER COLUMN image SET STORAGE EXTERNAL;
+
+-- The jobs a worker can claim, in the order they were uploaded
+CREATE INDEX IF NOT EXISTS receipt_jobs_claimable_idx ON receipt_jobs (job_id) WHERE status IN ('queued', 'running');
+
+-- New jobs wake idle workers listening on table_changed instead of waiting for their next poll
+DROP TRIGGER IF EXISTS receipt_jobs_notify_table_changed ON receipt_jobs;
+CREATE TRIGGER receipt_jobs_notify_table_changed
+    AFTER INSERT ON receipt_jobs
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed();
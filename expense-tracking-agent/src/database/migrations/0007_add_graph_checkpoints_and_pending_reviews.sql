@@ -0,0 +1,32 @@
+-- Checkpoints of the receipt graph runs and the runs waiting for a review, see
+-- src/chain/review_queue.py. Both live in postgres so a run started by a receipt
+-- worker on one host can be listed, resumed and retried by the API on another.
+CREATE TABLE IF NOT EXISTS graph_checkpoints (
+    thread_id VARCHAR(64) NOT NULL,
+    -- ISO 8601 timestamps of the checkpoint and the one it follows, ordered as text
+    thread_ts VARCHAR(64) NOT NULL,
+    parent_ts VARCHAR(64),
+    -- Pickled langgraph checkpoint
+    checkpoint BYTEA NOT NULL,
+    PRIMARY KEY (thread_id, thread_ts)
+);
+
+-- Times are epoch seconds, GET /reviews returns them and pages on (created_at, thread_id)
+CREATE TABLE IF NOT EXISTS pending_reviews (
+    thread_id VARCHAR(64) PRIMARY KEY,
+    image_location TEXT NOT NULL,
+    single_pass BOOLEAN NOT NULL,
+    receipt JSONB NOT NULL,
+    vision_model_name VARCHAR(100),
+    duplicate_receipt BOOLEAN NOT NULL,
+    pages_truncated INT NOT NULL DEFAULT 0,
+    error TEXT,
+    claimed_at DOUBLE PRECISION,
+    created_at DOUBLE PRECISION NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS pending_reviews_created_at_thread_id_idx ON pending_reviews (created_at, thread_id);
+
+-- The review of a job reads its uploaded image to rebuild pages missing from the local image store
+CREATE INDEX IF NOT EXISTS receipt_jobs_review_thread_id_idx ON receipt_jobs (review_thread_id);
@@ -0,0 +1,59 @@
+"""Statement timing for the psycopg2 and asyncpg connections of the API.
+
+Statements are labelled by verb and first table, e.g. "SELECT expenses", so
+the label stays low cardinality whatever the filters and values are.
+"""
+
+import re
+import time
+
+from psycopg2 import extensions
+
+from src.observability.metrics import DB_QUERY_SECONDS, ERRORS
+
+STATEMENT_TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+
+
+def statement_label(query) -> str:
+    # Only the start is needed, execute_values pages can be megabytes
+    if isinstance(query, bytes):
+        query = query[:300].decode("utf-8", "replace")
+    else:
+        query = str(query)[:300]
+    words = query.split(None, 1)
+    if not words:
+        return "EMPTY"
+    verb = words[0].upper()
+    match = STATEMENT_TABLE_PATTERN.search(query)
+    return f"{verb} {match.group(1).lower()}" if match else verb
+
+
+class InstrumentedCursor(extensions.cursor):
+    """psycopg2 cursor recording every execute in DB_QUERY_SECONDS"""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception as e:
+            ERRORS.labels("db", type(e).__name__).inc()
+            raise
+        finally:
+            DB_QUERY_SECONDS.labels(statement_label(query)).observe(time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        except Exception as e:
+            ERRORS.labels("db", type(e).__name__).inc()
+            raise
+        finally:
+            DB_QUERY_SECONDS.labels(statement_label(query)).observe(time.perf_counter() - start)
+
+
+def record_asyncpg_query(record):
+    """Query logger for asyncpg connections, see Connection.query_logger"""
+    DB_QUERY_SECONDS.labels(statement_label(record.query)).observe(record.elapsed)
+    if record.exception is not None:
+        ERRORS.labels("db", type(record.exception).__name__).inc()
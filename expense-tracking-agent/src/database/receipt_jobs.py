@@ -0,0 +1,131 @@
+"""SQL for the receipt_jobs queue, shared by the receipts API and the receipt worker.
+
+The functions run on a psycopg2 cursor and leave committing to the caller.
+Jobs move from queued to running when a worker claims them, and from running
+to review, saved or failed, or back to queued when an attempt failed and
+attempts are left. A job in review is saved once its review is accepted.
+"""
+
+# Every column but the image, which is only read by the worker that claims the job
+RECEIPT_JOB_COLUMNS = ("job_id", "status", "image_name", "single_pass", "auto_accept", "attempts", "worker", "review_thread_id",
+                       "transaction_id", "error", "created_at", "started_at", "finished_at")
+RECEIPT_JOB_SELECT_LIST = ", ".join(RECEIPT_JOB_COLUMNS)
+RECEIPT_JOB_STATUSES = ("queued", "running", "review", "saved", "failed")
+# The graph run of a job is the review thread receipt-job-<job_id>
+RECEIPT_JOB_THREAD_ID_PREFIX = "receipt-job-"
+
+
+def receipt_job_thread_id(job_id: int) -> str:
+    return f"{RECEIPT_JOB_THREAD_ID_PREFIX}{job_id}"
+
+
+def receipt_job_from_row(row) -> dict:
+    return dict(zip(RECEIPT_JOB_COLUMNS, row))
+
+
+def enqueue_receipt_job(cursor, image_name: str, image: bytes, single_pass: bool, auto_accept: bool) -> dict:
+    cursor.execute(
+        f"INSERT INTO receipt_jobs (image_name, image, single_pass, auto_accept) VALUES (%s, %s, %s, %s) RETURNING {RECEIPT_JOB_SELECT_LIST}",
+        (image_name, image, single_pass, auto_accept)
+    )
+    return receipt_job_from_row(cursor.fetchone())
+
+
+def get_receipt_job(cursor, job_id: int):
+    cursor.execute(f"SELECT {RECEIPT_JOB_SELECT_LIST} FROM receipt_jobs WHERE job_id = %s", (job_id,))
+    row = cursor.fetchone()
+    return receipt_job_from_row(row) if row is not None else None
+
+
+def get_receipt_job_image(cursor, review_thread_id: str):
+    """The uploaded image of the job whose run is review_thread_id, None once it was dropped or for runs not started from a job"""
+    cursor.execute("SELECT image FROM receipt_jobs WHERE review_thread_id = %s AND image IS NOT NULL ORDER BY job_id DESC LIMIT 1",
+                   (review_thread_id,))
+    row = cursor.fetchone()
+    return bytes(row[0]) if row is not None else None
+
+
+def list_receipt_jobs(cursor, status: str = None, limit: int = 100, after: int = None) -> list:
+    """Jobs in upload order, after is the job_id of the last job of the previous page"""
+    conditions, params = ["job_id > %s"], [after or 0]
+    if status is not None:
+        conditions.append("status = %s")
+        params.append(status)
+    cursor.execute(
+        f"SELECT {RECEIPT_JOB_SELECT_LIST} FROM receipt_jobs WHERE {' AND '.join(conditions)} ORDER BY job_id LIMIT %s",
+        (*params, limit)
+    )
+    return [receipt_job_from_row(row) for row in cursor.fetchall()]
+
+
+def claim_receipt_job(cursor, worker: str, lease_seconds: float, max_attempts: int):
+    """Lease the oldest queued job, or a running one whose lease expired, and return it with its image.
+
+    SKIP LOCKED passes over jobs another worker is claiming at the same moment,
+    so concurrent workers never wait on each other or get the same job. The review
+    thread is recorded up front, so a review accepted through the API while the
+    worker is still finishing the job finds it.
+    """
+    cursor.execute(
+        f"""
+        UPDATE receipt_jobs SET status = 'running', attempts = attempts + 1, worker = %s,
+            locked_until = now() + make_interval(secs => %s), started_at = now(), error = NULL,
+            review_thread_id = %s || job_id
+        WHERE job_id = (
+            SELECT job_id FROM receipt_jobs
+            WHERE (status = 'queued' OR (status = 'running' AND locked_until < now())) AND attempts < %s
+            ORDER BY job_id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING {RECEIPT_JOB_SELECT_LIST}, image
+        """,
+        (worker, lease_seconds, RECEIPT_JOB_THREAD_ID_PREFIX, max_attempts)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    job = receipt_job_from_row(row)
+    job["image"] = bytes(row[-1])
+    return job
+
+
+def finish_receipt_job(cursor, job_id: int, status: str, review_thread_id: str = None, transaction_id: int = None):
+    """Record the outcome of a successful run, the image is dropped once the expense is saved.
+
+    A job whose review was already accepted through the API stays saved.
+    """
+    cursor.execute(
+        "UPDATE receipt_jobs SET status = %s, review_thread_id = %s, transaction_id = %s, locked_until = NULL, finished_at = now(), "
+        "image = CASE WHEN %s = 'saved' THEN NULL ELSE image END WHERE job_id = %s AND status <> 'saved'",
+        (status, review_thread_id, transaction_id, status, job_id)
+    )
+
+
+def mark_receipt_job_saved(cursor, review_thread_id: str, transaction_id: int):
+    """Mark saved the job whose review was accepted, e.g. through the API after its worker finished, and drop its image"""
+    cursor.execute(
+        "UPDATE receipt_jobs SET status = 'saved', transaction_id = %s, error = NULL, locked_until = NULL, finished_at = now(), "
+        "image = NULL WHERE review_thread_id = %s",
+        (transaction_id, review_thread_id)
+    )
+
+
+def fail_receipt_job(cursor, job_id: int, error: str, max_attempts: int, review_thread_id: str = None):
+    """Queue the job again, or mark it failed when it has used all its attempts"""
+    cursor.execute(
+        "UPDATE receipt_jobs SET status = CASE WHEN attempts < %s THEN 'queued' ELSE 'failed' END, error = %s, "
+        "review_thread_id = %s, locked_until = NULL, finished_at = now() WHERE job_id = %s AND status <> 'saved'",
+        (max_attempts, error, review_thread_id, job_id)
+    )
+
+
+def fail_abandoned_receipt_jobs(cursor, max_attempts: int) -> int:
+    """Mark failed the running jobs whose lease expired after their last attempt, their worker is gone"""
+    cursor.execute(
+        "UPDATE receipt_jobs SET status = 'failed', error = 'Worker stopped before finishing the last attempt', "
+        "locked_until = NULL, finished_at = now() "
+        "WHERE status = 'running' AND locked_until < now() AND attempts >= %s",
+        (max_attempts,)
+    )
+    return cursor.rowcount
@@ -0,0 +1,60 @@
+"""SQL for categories, payment methods and saving expenses, shared by the API and the graph.
+
+The functions run on a psycopg2 cursor and leave committing to the caller, so
+the sync routers and the graph's database backend (src/chain/helpers/expenses_backend.py)
+use the same statements. The async routers run the same SQL through
+to_asyncpg_placeholders.
+"""
+
+from psycopg2.extras import execute_values
+
+SELECT_CATEGORIES_SQL = "SELECT category_id, category_name FROM categories ORDER BY category_id"
+SELECT_PAYMENT_METHODS_SQL = "SELECT payment_method_id, payment_method_name FROM payment_methods ORDER BY payment_method_id"
+
+EXPENSE_INSERT_COLUMNS = ("date", "category_id", "description", "amount", "vat", "payment_method_id", "business_personal")
+
+INSERT_EXPENSE_SQL = (
+    f"INSERT INTO expenses ({', '.join(EXPENSE_INSERT_COLUMNS)}) VALUES ({', '.join(['%s'] * len(EXPENSE_INSERT_COLUMNS))}) "
+    "RETURNING transaction_id, date, category_id, description, amount, vat, payment_method_id, business_personal"
+)
+INSERT_EXPENSES_SQL = f"INSERT INTO expenses ({', '.join(EXPENSE_INSERT_COLUMNS)}) VALUES %s RETURNING transaction_id"
+
+
+def fetch_categories(cursor) -> list:
+    """[{category_id, category_name}] in the shape GET /categories returns"""
+    cursor.execute(SELECT_CATEGORIES_SQL)
+    return [{"category_id": row[0], "category_name": row[1]} for row in cursor.fetchall()]
+
+
+def fetch_payment_methods(cursor) -> list:
+    """[{payment_method_id, payment_method_name}] in the shape GET /payment_methods returns"""
+    cursor.execute(SELECT_PAYMENT_METHODS_SQL)
+    return [{"payment_method_id": row[0], "payment_method_name": row[1]} for row in cursor.fetchall()]
+
+
+def expense_values(expense) -> tuple:
+    """Column values of a validated expense in EXPENSE_INSERT_COLUMNS order"""
+    return tuple(getattr(expense, column) for column in EXPENSE_INSERT_COLUMNS)
+
+
+def insert_expense(cursor, expense) -> tuple:
+    """Insert one validated expense and return the stored row"""
+    cursor.execute(INSERT_EXPENSE_SQL, expense_values(expense))
+    return cursor.fetchone()
+
+
+def insert_expenses(cursor, expenses: list, page_size: int) -> list:
+    """Insert validated expenses with one statement per page_size rows, returning their transaction_ids in order"""
+    inserted = execute_values(cursor, INSERT_EXPENSES_SQL, [expense_values(expense) for expense in expenses],
+                              page_size=page_size, fetch=True)
+    return [row[0] for row in inserted]
+
+
+def existing_category_ids(cursor, category_ids) -> set:
+    cursor.execute("SELECT category_id FROM categories WHERE category_id = ANY(%s)", (list(category_ids),))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def existing_payment_method_ids(cursor, payment_method_ids) -> set:
+    cursor.execute("SELECT payment_method_id FROM payment_methods WHERE payment_method_id = ANY(%s)", (list(payment_method_ids),))
+    return {row[0] for row in cursor.fetchall()}
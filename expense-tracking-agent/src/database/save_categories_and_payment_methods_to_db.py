@@ -1,8 +1,12 @@
+import os
 import yaml
 import requests
+from dotenv import load_dotenv
+
+load_dotenv()
 
 CONFIG_FILE_PATH = "config.yml"
-BASE_URL = "http://localhost:8000"
+BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000").rstrip("/")
 CATEGORIES_ENDPOINT = f"{BASE_URL}/categories"
 PAYMENT_METHODS_ENDPOINT = f"{BASE_URL}/payment_methods"
 
@@ -0,0 +1,233 @@
+"""Prometheus style metrics kept in process.
+
+Counters and histograms with labels, rendered in the Prometheus text format by
+GET /metrics on the API and by start_metrics_server in the graph processes.
+Values are per process, so with several uvicorn workers every scrape sees one
+worker. With METRICS_ENABLED=false labels() returns a shared no-op child, so
+instrumented code pays one function call per observation.
+"""
+
+import bisect
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, wide enough for LLM calls that take most of a minute
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 5000, 10000, 20000)
+
+
+class NoopChild:
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+NOOP_CHILD = NoopChild()
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: dict) -> list:
+        return [(name, labels, self.value)]
+
+
+class HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name: str, labels: dict) -> list:
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", {**labels, "le": format_value(bound)}, cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or metrics_registry).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """The child for one combination of label values, in labelnames order"""
+        if not METRICS_ENABLED:
+            return NOOP_CHILD
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def collect(self) -> list:
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for key, child in children:
+            samples.extend(child.samples(self.name, dict(zip(self.labelnames, key))))
+        return [(self.name, self.kind, self.documentation, samples)]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        # Callables returning [(name, kind, documentation, [(sample name, labels, value)])]
+        # for values another component already keeps, read at scrape time
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = [metric.collect for metric in self._metrics] + list(self._collectors)
+        lines = []
+        for collect in collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f"# HELP {name} {escape_documentation(documentation)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for sample_name, labels, value in samples:
+                    lines.append(f"{sample_name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_documentation(documentation: str) -> str:
+    return documentation.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value) -> str:
+    if value is None:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+metrics_registry = MetricsRegistry()
+
+GRAPH_NODE_SECONDS = Histogram(
+    "expense_tracker_graph_node_duration_seconds", "Time spent in a graph node", ("node",))
+LLM_REQUEST_SECONDS = Histogram(
+    "expense_tracker_llm_request_duration_seconds", "Time of one chat completion request", ("model", "node"))
+LLM_TOKENS = Counter(
+    "expense_tracker_llm_tokens_total", "Tokens used by chat completion requests, kind is prompt or completion",
+    ("model", "node", "kind"))
+LLM_PROMPT_TOKENS = Histogram(
+    "expense_tracker_llm_prompt_tokens", "Prompt tokens of one chat completion request", ("model", "node"), buckets=TOKEN_BUCKETS)
+LLM_COST_USD = Counter(
+    "expense_tracker_llm_cost_usd_total", "Estimated cost of chat completion requests in US dollars", ("model", "node"))
+HTTP_CLIENT_SECONDS = Histogram(
+    "expense_tracker_http_client_request_duration_seconds", "Time of requests from the graph to the expenses API",
+    ("method", "endpoint", "status"))
+DB_QUERY_SECONDS = Histogram(
+    "expense_tracker_db_query_duration_seconds", "Time to execute a statement, labelled by verb and table", ("statement",))
+API_REQUEST_SECONDS = Histogram(
+    "expense_tracker_api_request_duration_seconds", "Time to answer an API request", ("method", "route", "status"))
+ERRORS = Counter(
+    "expense_tracker_errors_total", "Exceptions raised, by component and exception type", ("component", "error"))
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise be written to stderr
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve GET /metrics from a daemon thread, for processes without the API such as the batch runner"""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
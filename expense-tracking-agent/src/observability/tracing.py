@@ -0,0 +1,155 @@
+"""Structured span logging for graph runs.
+
+span() times a block and, when it ends, logs one JSON object to the
+expense_tracker.trace logger with the span name, duration, status, attributes
+and the trace_id / span_id / parent_id linking it to the enclosing span. The
+current span is kept in a context variable, so spans opened inside a node,
+including in asyncio tasks and asyncio.to_thread, become its children.
+Nodes attach what they produced with set_span_attributes instead of printing
+the state.
+
+With TRACE_ENABLED=false span() only feeds the histogram it was given, and
+with METRICS_ENABLED=false as well traced_node returns the node unwrapped.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from src.observability.metrics import ERRORS, GRAPH_NODE_SECONDS, NOOP_CHILD
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Span log file, stderr when unset
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH")
+
+logger = logging.getLogger("expense_tracker.trace")
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "status")
+
+    def __init__(self, name: str, parent, attributes: dict):
+        self.name = name
+        # Ids only correlate log lines, they need not be unpredictable
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.status = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class NoopSpan:
+    name = None
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_span_attributes(**attributes):
+    """Attach attributes to the span the caller runs in, if any"""
+    span_ = _current_span.get()
+    if span_ is not None:
+        span_.set(**attributes)
+
+
+@contextmanager
+def span(name: str, histogram=None, **attributes):
+    """Time the block as a span, observing its duration in seconds on histogram when given.
+
+    The histogram is a child returned by labels(), exceptions are counted in
+    ERRORS with the span name as component and re-raised.
+    """
+    histogram = histogram or NOOP_CHILD
+    if not TRACE_ENABLED:
+        start = time.perf_counter()
+        try:
+            yield NOOP_SPAN
+        except BaseException as e:
+            ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+        return
+
+    span_ = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(span_)
+    start = time.perf_counter()
+    try:
+        yield span_
+    except BaseException as e:
+        span_.status = "error"
+        span_.set(error=f"{type(e).__name__}: {e}")
+        ERRORS.labels(name, type(e).__name__).inc()
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _current_span.reset(token)
+        histogram.observe(seconds)
+        log_span(span_, seconds)
+
+
+def log_span(span_: Span, seconds: float):
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    record = {
+        "span": span_.name,
+        "trace_id": span_.trace_id,
+        "span_id": span_.span_id,
+        "parent_id": span_.parent_id,
+        "duration_ms": round(seconds * 1000, 3),
+        "status": span_.status,
+        **span_.attributes,
+    }
+    logger.info(json.dumps(record, default=str))
+
+
+def traced_node(name: str, node):
+    """Wrap a graph node, sync or async, in a node.<name> span feeding GRAPH_NODE_SECONDS"""
+    histogram = GRAPH_NODE_SECONDS.labels(name)
+    # Fully disabled instrumentation leaves the node as it is
+    if histogram is NOOP_CHILD and not TRACE_ENABLED:
+        return node
+
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def run_async_node(state):
+            with span(f"node.{name}", histogram, image_location=state.get("image_location")):
+                return await node(state)
+        return run_async_node
+
+    @functools.wraps(node)
+    def run_node(state):
+        with span(f"node.{name}", histogram, image_location=state.get("image_location")):
+            return node(state)
+    return run_node
+
+
+def configure_logging(level: int = logging.INFO):
+    """Write spans as JSON lines to TRACE_LOG_PATH or stderr, called once by the entry points"""
+    if logger.handlers:
+        return
+    handler = logging.FileHandler(TRACE_LOG_PATH) if TRACE_LOG_PATH else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    # Spans are already complete JSON objects, they should not also reach the root handlers
+    logger.propagate = False
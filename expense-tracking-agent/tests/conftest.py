@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def database():
+    """The postgres database of the DB_* settings, or of DATABASE_URL, migrated to the latest schema.
+
+    Tests using it are skipped when neither is set or postgres cannot be reached.
+    """
+    psycopg2 = pytest.importorskip("psycopg2")
+    if os.getenv("DATABASE_URL"):
+        params = psycopg2.extensions.parse_dsn(os.environ["DATABASE_URL"])
+        for name, key in (("DB_NAME", "dbname"), ("DB_USER", "user"), ("DB_PASSWORD", "password"), ("DB_HOST", "host"), ("DB_PORT", "port")):
+            if key in params:
+                os.environ[name] = params[key]
+    if not os.getenv("DB_NAME"):
+        pytest.skip("Set DATABASE_URL or the DB_* settings to run the postgres tests")
+
+    from src.database.db_connection import close_connection_pool
+    from src.database.migrate import run_migrations
+
+    try:
+        run_migrations()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"postgres is not available: {e}")
+    yield
+    close_connection_pool()
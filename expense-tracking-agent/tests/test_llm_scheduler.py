@@ -0,0 +1,208 @@
+import asyncio
+import socket
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import HumanMessage
+
+from benchmarks.utils import run_stub_llm_server
+from src.chain.helpers.llm import ainvoke_structured_llm, llm_registry
+from src.chain.helpers.llm_scheduler import (LLM_AIMD_DECREASE, LLM_PRIORITY_BATCH, LLM_PRIORITY_INTERACTIVE, LLMScheduler, ModelScheduler,
+                                             TokenBucket, llm_scheduler)
+from src.chain.nodes.json_parser import ReceiptSchema
+
+MESSAGES = [HumanMessage(content="Extract the receipt data")]
+
+
+def rate_limit_error(retry_after: str = None) -> openai.RateLimitError:
+    """The error the OpenAI client raises for a 429, with the Retry-After header the API sent"""
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://stub/v1/chat/completions"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def finish_call(scheduler: ModelScheduler, latency: float = 0.1, **release):
+    """Acquire and release one call that took latency seconds"""
+    reservation = scheduler.acquire(1, LLM_PRIORITY_BATCH)
+    reservation.started_at = time.monotonic() - latency
+    scheduler.release(reservation, **release)
+
+
+@pytest.fixture
+def scheduler():
+    llm_scheduler = LLMScheduler()
+    llm_scheduler.enabled = True
+    llm_scheduler.set_default_limits(1_000_000, 1_000_000_000)
+    return llm_scheduler
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_time(60, now) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(1, now + 1.0) == pytest.approx(0.0)
+    # A call larger than the whole budget waits for a full bucket, not forever
+    assert bucket.wait_time(1000, now + 1.0) == pytest.approx(59.0)
+
+
+def test_calls_wait_for_the_tokens_per_minute_budget():
+    # 6000 tokens per minute refill 100 tokens per second
+    model = ModelScheduler("gpt-test", 1_000_000, 6000)
+    model.release(model.acquire(6000, LLM_PRIORITY_BATCH))
+
+    start = time.monotonic()
+    model.release(model.acquire(50, LLM_PRIORITY_BATCH))
+    assert time.monotonic() - start == pytest.approx(0.5, abs=0.2)
+
+
+def test_calls_wait_for_the_requests_per_minute_budget():
+    # 600 requests per minute refill one request every 0.1 seconds
+    model = ModelScheduler("gpt-test", 600, 1_000_000)
+    model._requests.take(model._requests.level)
+
+    start = time.monotonic()
+    model.release(model.acquire(1, LLM_PRIORITY_BATCH))
+    assert time.monotonic() - start == pytest.approx(0.1, abs=0.08)
+
+
+def test_429_decreases_the_concurrency_limit_once_per_round_trip_and_it_recovers():
+    model = ModelScheduler("gpt-test", 1_000_000, 1_000_000_000)
+    for _ in range(5):
+        finish_call(model)
+    limit = model.limit
+
+    finish_call(model, throttled_for=0.0, failed=True)
+    assert model.limit == pytest.approx(limit * LLM_AIMD_DECREASE)
+    # Calls sent together are throttled together, the 429s of one round trip count once
+    finish_call(model, throttled_for=0.0, failed=True)
+    assert model.limit == pytest.approx(limit * LLM_AIMD_DECREASE)
+    assert model.throttled == 2
+
+    # Successful calls add about one slot per round trip until the limit is back
+    for _ in range(20):
+        finish_call(model)
+    assert model.limit > limit
+
+
+def test_slow_calls_decrease_the_concurrency_limit():
+    model = ModelScheduler("gpt-test", 1_000_000, 1_000_000_000)
+    finish_call(model, latency=0.1)
+    limit = model.limit
+    finish_call(model, latency=1.0)
+    assert model.limit < limit
+
+
+def test_call_retries_a_429_after_its_retry_after(scheduler):
+    attempts = []
+
+    def invoke(messages):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise rate_limit_error(retry_after="0.3")
+        return "answer"
+
+    assert scheduler.call("gpt-test", None, MESSAGES, invoke) == "answer"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.3
+    model = scheduler.model("gpt-test")
+    assert model.throttled == 1
+    assert model.in_flight == 0
+
+
+def test_retry_after_pauses_the_other_calls_to_the_model(scheduler):
+    model = scheduler.model("gpt-test")
+    reservation = model.acquire(1, LLM_PRIORITY_BATCH)
+    model.release(reservation, throttled_for=0.3, failed=True)
+
+    start = time.monotonic()
+    assert scheduler.call("gpt-test", None, MESSAGES, lambda messages: "answer") == "answer"
+    assert time.monotonic() - start >= 0.25
+
+
+def test_call_gives_up_on_errors_that_are_not_worth_a_retry(scheduler):
+    def invoke(messages):
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call("gpt-test", None, MESSAGES, invoke)
+    assert scheduler.model("gpt-test").in_flight == 0
+
+
+def test_interactive_calls_start_before_waiting_batch_calls():
+    model = ModelScheduler("gpt-test", 1_000_000, 1_000_000_000)
+    model.limit = 1
+    running = model.acquire(1, LLM_PRIORITY_BATCH)
+    started = []
+
+    def call(name: str, priority: int):
+        reservation = model.acquire(1, priority)
+        started.append(name)
+        model.release(reservation)
+
+    def wait_for_queue(length: int):
+        deadline = time.monotonic() + 5
+        while model.queued() < length and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    # The batch call is queued first, the interactive one arrives while it waits
+    batch = threading.Thread(target=call, args=("batch", LLM_PRIORITY_BATCH))
+    batch.start()
+    wait_for_queue(1)
+    interactive = threading.Thread(target=call, args=("interactive", LLM_PRIORITY_INTERACTIVE))
+    interactive.start()
+    wait_for_queue(2)
+
+    model.release(running)
+    batch.join(5)
+    interactive.join(5)
+    assert started == ["interactive", "batch"]
+
+
+def test_acall_retries_a_429_after_its_retry_after(scheduler):
+    attempts = []
+
+    async def ainvoke(messages):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise rate_limit_error(retry_after="0.2")
+        return "answer"
+
+    assert asyncio.run(scheduler.acall("gpt-test", None, MESSAGES, ainvoke)) == "answer"
+    assert attempts[1] - attempts[0] >= 0.2
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_calls_to_a_rate_limited_stub_all_succeed(monkeypatch):
+    # The stub answers 429 with Retry-After beyond 2 requests in flight, a limit the scheduler has to find
+    with run_stub_llm_server(free_port(), latency_ms=50, env={"STUB_LLM_MAX_CONCURRENCY": "2"}) as base_url:
+        monkeypatch.setenv("OPENAI_API_BASE", f"{base_url}/v1")
+        monkeypatch.setenv("OPENAI_API_KEY", "stub")
+        monkeypatch.setattr(llm_scheduler, "enabled", True)
+        monkeypatch.setattr(llm_scheduler, "_models", {})
+
+        async def run_calls():
+            try:
+                return await asyncio.gather(*(ainvoke_structured_llm("gpt-test", ReceiptSchema, MESSAGES) for _ in range(20)))
+            finally:
+                await llm_registry.aclose()
+
+        results = asyncio.run(run_calls())
+        stats = httpx.get(f"{base_url}/stats").json()
+
+    assert all(isinstance(result, ReceiptSchema) for result in results)
+    model = llm_scheduler.model("gpt-test")
+    assert stats["rate_limited"] > 0
+    assert model.throttled == stats["rate_limited"]
+    assert model.limit < 4
+    assert model.in_flight == 0
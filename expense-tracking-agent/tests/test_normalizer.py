@@ -0,0 +1,94 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from src.chain.nodes.normalizer import normalize_business_personal, normalize_fields, parse_amount, parse_receipt_date
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("04-18-2024", date(2024, 4, 18)),
+    ("2024-04-18", date(2024, 4, 18)),
+    ("18/04/2024", date(2024, 4, 18)),
+    ("04/18/24", date(2024, 4, 18)),
+    ("13.02.2024", date(2024, 2, 13)),
+    ("20240418", date(2024, 4, 18)),
+    ("2024-04-18T10:30:00", date(2024, 4, 18)),
+    ("04/18/2024 12:30 PM", date(2024, 4, 18)),
+    ("18 April 2024", date(2024, 4, 18)),
+    ("Apr. 18th, 2024", date(2024, 4, 18)),
+    ("April 18, 2024 10:30", date(2024, 4, 18)),
+    ("Tue, 18 Apr 2024", date(2024, 4, 18)),
+    ("Tue, 18 Apr 2024 10:30:00 +0000", date(2024, 4, 18)),
+    ("Thursday April 18th 2024", date(2024, 4, 18)),
+    ("Sun 03/10/2024", date(2024, 3, 10)),
+    ("garbage", None),
+    (None, None),
+])
+def test_parse_receipt_date(value, expected):
+    assert parse_receipt_date(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("12.50", Decimal("12.50")),
+    ("1.5e3", Decimal("1500.00")),
+    ("$1,234.56", Decimal("1234.56")),
+    ("1.234,56", Decimal("1234.56")),
+    ("1 234,56", Decimal("1234.56")),
+    ("12,34", Decimal("12.34")),
+    ("€ 12.5", Decimal("12.50")),
+    # A single separator followed by three digits separates thousands, whichever it is
+    ("1,234", Decimal("1234.00")),
+    ("12.345", Decimal("12345.00")),
+    ("1.234.567", Decimal("1234567.00")),
+    ("0.125", Decimal("0.13")),
+    (12.5, Decimal("12.50")),
+    ("-3", Decimal("-3.00")),
+    ("abc", None),
+    ("nan", None),
+    # Beyond the DECIMAL(10, 2) columns
+    ("1e30", None),
+    (1e30, None),
+    ("1e999999999", None),
+    ("100000000", None),
+    ("99999999.995", None),
+    ("99999999.99", Decimal("99999999.99")),
+    ("1e-999999999999", Decimal("0.00")),
+    (None, None),
+    (True, None),
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("business", "business"),
+    ("Business expense", "business"),
+    ("Private", "personal"),
+    ("not business", "personal"),
+    ("non-business", "personal"),
+    ("not personal", "business"),
+    ("no personal use", "business"),
+    ("work and personal", None),
+    ("notebook", None),
+    (None, None),
+])
+def test_normalize_business_personal(value, expected):
+    assert normalize_business_personal(value) == expected
+
+
+def test_normalize_fields_flags_amounts_out_of_range():
+    values, problems, needs_image = normalize_fields({
+        "date": "04-18-2024", "description": "Lunch", "amount": "1e30", "vat": 1e999, "business_personal": "business",
+    })
+    assert "amount" not in values and "vat" not in values
+    assert set(problems) == {"amount", "vat"}
+
+
+def test_normalize_fields_flags_vat_larger_than_amount():
+    values, problems, needs_image = normalize_fields({
+        "date": "04-18-2024", "description": " Lunch ", "amount": "10", "vat": "12", "business_personal": "Business",
+    })
+    assert values == {"date": "2024-04-18", "description": "Lunch", "business_personal": "business"}
+    assert set(problems) == {"amount", "vat"}
+    assert needs_image
@@ -0,0 +1,18 @@
+import pytest
+
+from src.database.check_query_plans import (SAMPLE_PAGES, explain_expenses_query, filter_combinations, find_index_scans,
+                                            query_label)
+
+CASES = [(filters, limit, after) for filters in filter_combinations() for limit, after in SAMPLE_PAGES]
+
+
+@pytest.mark.parametrize("filters, limit, after", CASES, ids=[query_label(*case) for case in CASES])
+def test_expenses_query_uses_an_index(database, filters, limit, after):
+    from src.database.db_connection import get_connection
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            plan = explain_expenses_query(cursor, filters, limit, after)
+        conn.rollback()
+
+    assert find_index_scans(plan), f"{query_label(filters, limit, after)} is planned as {plan['Node Type']} without an expenses index"
@@ -0,0 +1,242 @@
+import io
+import os
+import uuid
+
+import pytest
+from langgraph.graph import END, StateGraph
+from PIL import Image
+
+from src.api.review_routes import accept_review
+from src.chain.agent_state import AgentState
+from src.chain.graph_state import initial_graph_state
+from src.chain.helpers.image_store import ImageStore
+from src.chain.nodes.image_preprocessor import preprocess_receipt
+from src.chain.review_queue import REVIEW_NODE, ReviewNotFoundError, ReviewQueue, ReviewStateError, thread_config
+from src.database.db_connection import get_connection
+from src.database.graph_checkpoints import PostgresCheckpointSaver
+from src.database.receipt_jobs import claim_receipt_job, enqueue_receipt_job, finish_receipt_job, get_receipt_job
+
+pytestmark = pytest.mark.usefixtures("database")
+
+
+def receipt_image() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (200, 400), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def stand_in_graph(image_store: ImageStore):
+    """The receipt graph without LLM calls: preprocess, extract from the stored pages, review, save on accept"""
+
+    def preprocessor(state):
+        with open(state["image_location"], "rb") as image_file:
+            pages, _ = preprocess_receipt(image_file.read())
+        return {"image_pages": [image_store.put(page) for page in pages]}
+
+    def extractor(state):
+        # Like json_parser, fails when a page is missing from the image store
+        pages = [image_store.get(handle) for handle in state["image_pages"]]
+        return {"description": f"{len(pages)} page receipt", "amount": "12.50"}
+
+    def saver(state):
+        return {"transaction_id": 4242}
+
+    graph = StateGraph(AgentState)
+    graph.add_node("image_preprocessor", preprocessor)
+    graph.add_node("json_parser", extractor)
+    graph.add_node(REVIEW_NODE, lambda state: {})
+    graph.add_node("save_expense_to_db", saver)
+    graph.set_entry_point("image_preprocessor")
+    graph.add_edge("image_preprocessor", "json_parser")
+    graph.add_edge("json_parser", REVIEW_NODE)
+    graph.add_conditional_edges(REVIEW_NODE, lambda state: "save_expense_to_db" if state["user_decision"] == "accept" else "json_parser")
+    graph.add_edge("save_expense_to_db", END)
+    return graph.compile(checkpointer=PostgresCheckpointSaver(), interrupt_before=[REVIEW_NODE])
+
+
+@pytest.fixture
+def image_store(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path / "image_store"))
+    monkeypatch.setattr("src.chain.review_queue.image_store", store)
+    return store
+
+
+@pytest.fixture
+def review_queue(image_store, monkeypatch):
+    # The lookups come from the API, which is not running
+    monkeypatch.setattr("src.chain.review_queue.create_graph_state",
+                        lambda single_pass: initial_graph_state({1: "Groceries"}, {1: "Cash"}, single_pass))
+    queue = ReviewQueue()
+    workflow = stand_in_graph(image_store)
+    queue._workflows = {False: workflow, True: workflow}
+    return queue
+
+
+@pytest.fixture
+def receipt_file(tmp_path):
+    path = tmp_path / "receipt.png"
+    path.write_bytes(receipt_image())
+    return str(path)
+
+
+def enqueue_job(image: bytes) -> dict:
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            job = enqueue_receipt_job(cursor, "receipt.png", image, False, False)
+        conn.commit()
+    return job
+
+
+def read_job(job_id: int) -> dict:
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            job = get_receipt_job(cursor, job_id)
+            cursor.execute("SELECT image IS NULL FROM receipt_jobs WHERE job_id = %s", (job_id,))
+            job["image_dropped"] = cursor.fetchone()[0]
+    return job
+
+
+def job_run(image: bytes) -> str:
+    """A receipt job in review, as left by a worker, and the thread id of its run"""
+    thread_id = f"receipt-job-test-{uuid.uuid4().hex}"
+    job = enqueue_job(image)
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE receipt_jobs SET status = 'review', review_thread_id = %s WHERE job_id = %s", (thread_id, job["job_id"]))
+        conn.commit()
+    return thread_id
+
+
+def checkpoint_count(thread_id: str) -> int:
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM graph_checkpoints WHERE thread_id = %s", (thread_id,))
+            return cursor.fetchone()[0]
+
+
+def test_checkpointer_returns_the_latest_checkpoint_and_lists_them_newest_first():
+    saver = PostgresCheckpointSaver()
+    thread_id = uuid.uuid4().hex
+    first = saver.put(thread_config(thread_id), {"v": 1, "ts": "2024-06-01T10:00:00+00:00", "channel_values": {"amount": "1.00"}})
+    second = saver.put(first, {"v": 1, "ts": "2024-06-01T10:00:01+00:00", "channel_values": {"amount": "2.00"}})
+
+    latest = saver.get_tuple(thread_config(thread_id))
+    assert latest.config == second
+    assert latest.checkpoint["channel_values"] == {"amount": "2.00"}
+    assert latest.parent_config == first
+    assert saver.get_tuple(first).checkpoint["channel_values"] == {"amount": "1.00"}
+    assert [checkpoint.config for checkpoint in saver.list(thread_config(thread_id))] == [second, first]
+    assert saver.get_tuple(thread_config(uuid.uuid4().hex)) is None
+
+
+def test_accepting_a_review_saves_it_and_drops_its_checkpoints(review_queue, receipt_file):
+    thread_id = uuid.uuid4().hex
+    review = review_queue.start(receipt_file, thread_id=thread_id)
+    assert review["status"] == "pending"
+    assert review["receipt"]["description"] == "1 page receipt"
+    assert review_queue.get(thread_id)["status"] == "pending"
+    assert checkpoint_count(thread_id) > 0
+
+    review = review_queue.resume(thread_id, "accept")
+    assert review["status"] == "saved"
+    assert review["transaction_id"] == 4242
+    with pytest.raises(ReviewNotFoundError):
+        review_queue.get(thread_id)
+    assert checkpoint_count(thread_id) == 0
+
+
+def test_pending_pages_on_created_at_and_thread_id(review_queue, receipt_file):
+    thread_ids = [review_queue.start(receipt_file)["thread_id"] for _ in range(3)]
+    reviews = [review for review in review_queue.pending(limit=1000) if review["thread_id"] in thread_ids]
+    assert len(reviews) == 3
+
+    first_page = review_queue.pending(limit=1, after=(reviews[0]["created_at"], reviews[0]["thread_id"]))
+    assert first_page[0]["thread_id"] != reviews[0]["thread_id"]
+    assert (first_page[0]["created_at"], first_page[0]["thread_id"]) > (reviews[0]["created_at"], reviews[0]["thread_id"])
+
+
+def test_a_revision_on_another_host_preprocesses_the_job_image_again(review_queue, image_store, receipt_file):
+    thread_id = job_run(receipt_image())
+    review_queue.start(receipt_file, thread_id=thread_id)
+    handles = review_queue._workflows[False].get_state(thread_config(thread_id)).values["image_pages"]
+    # The API host has neither the worker's copy of the upload nor its image store
+    os.remove(receipt_file)
+    for handle in handles:
+        image_store.delete(handle)
+
+    review = review_queue.resume(thread_id, "revise", review_instructions="The amount is 13.50")
+    assert review["status"] == "pending"
+    assert all(image_store.exists(handle) for handle in handles)
+
+
+def test_accepting_a_worker_review_through_the_api_marks_its_job_saved(review_queue, receipt_file, monkeypatch):
+    job = enqueue_job(receipt_image())
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            claimed = claim_receipt_job(cursor, "test-worker", 60, 3)
+        conn.commit()
+    assert claimed["job_id"] == job["job_id"]
+
+    # The worker runs the job up to its review
+    review = review_queue.start(receipt_file, thread_id=claimed["review_thread_id"])
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            finish_receipt_job(cursor, job["job_id"], "review", review["thread_id"])
+        conn.commit()
+    assert read_job(job["job_id"])["status"] == "review"
+
+    monkeypatch.setattr("src.api.review_routes.get_review_queue", lambda: review_queue)
+    review = accept_review(review["thread_id"])
+    assert review["status"] == "saved"
+
+    saved = read_job(job["job_id"])
+    assert saved["status"] == "saved"
+    assert saved["transaction_id"] == 4242
+    assert saved["image_dropped"]
+
+    # A worker finishing the job late does not move it back to review
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            finish_receipt_job(cursor, job["job_id"], "review", review["thread_id"])
+        conn.commit()
+    assert read_job(job["job_id"])["status"] == "saved"
+
+
+def test_retry_writes_the_job_image_back_after_the_worker_removed_it(review_queue, tmp_path):
+    thread_id = job_run(receipt_image())
+    # The worker's copy of the upload is gone by the time image_preprocessor reads it
+    with pytest.raises(FileNotFoundError):
+        review_queue.start(str(tmp_path / "removed.png"), thread_id=thread_id)
+    assert review_queue.get(thread_id)["status"] == "failed"
+
+    review = review_queue.retry(thread_id)
+    assert review["status"] == "pending"
+    assert review["receipt"]["description"] == "1 page receipt"
+
+
+def test_retry_of_a_run_without_checkpoint_writes_the_job_image_back(review_queue, tmp_path, monkeypatch):
+    thread_id = job_run(receipt_image())
+
+    def lookups_unavailable(single_pass):
+        raise ConnectionError("The API is down")
+
+    # Reading the lookups fails before the graph writes its first checkpoint
+    monkeypatch.setattr("src.chain.review_queue.create_graph_state", lookups_unavailable)
+    with pytest.raises(ConnectionError):
+        review_queue.start(str(tmp_path / "removed.png"), thread_id=thread_id)
+    assert review_queue._workflows[False].get_state(thread_config(thread_id)).values == {}
+
+    monkeypatch.setattr("src.chain.review_queue.create_graph_state",
+                        lambda single_pass: initial_graph_state({1: "Groceries"}, {1: "Cash"}, single_pass))
+    assert review_queue.retry(thread_id)["status"] == "pending"
+
+
+def test_retry_without_any_copy_of_the_image_is_refused(review_queue, tmp_path):
+    thread_id = uuid.uuid4().hex
+    with pytest.raises(FileNotFoundError):
+        review_queue.start(str(tmp_path / "removed.png"), thread_id=thread_id)
+
+    with pytest.raises(ReviewStateError):
+        review_queue.retry(thread_id)
+    # The claim is released, the run can be retried once the file is back
+    assert review_queue.get(thread_id)["status"] == "failed"